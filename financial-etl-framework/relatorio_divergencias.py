@@ -6,6 +6,8 @@ Uso:
     python relatorio_divergencias.py
 """
 
+import io
+import os
 import sys
 from pathlib import Path
 from datetime import datetime
@@ -18,168 +20,169 @@ from src.financial_etl.conn import get_connection
 
 
 def limpar_tela():
-    """Limpa a tela do terminal."""
-    import os
-    os.system('cls' if os.name == 'nt' else 'clear')
-
-
-def exibir_cabecalho():
-    """Exibe cabecalho do relatorio."""
-    print("\n" + "="*70)
-    print("RELATORIO DE DIVERGENCIAS - BONUS VIEW")
-    print("="*70)
-    print(f"Data/Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-    print("="*70 + "\n")
-
-
-def analisar_pendentes_verificacao(cursor):
-    """Analisa pendentes de verificacao e retorna metricas."""
-    query = """
-    SELECT 
-        COUNT(*) as total,
-        MIN(dta_processamento) as mais_antigo,
-        MAX(dta_processamento) as mais_recente
-    FROM byd.bonus_view
-    WHERE bonus_utilizado = 'PENDENTE VERIFICACAO'
-        AND dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'
-    """
-    
-    cursor.execute(query)
-    row = cursor.fetchone()
-    
-    total = row[0] if row[0] else 0
-    mais_antigo = row[1]
-    mais_recente = row[2]
-    
-    # Define criticidade
+    """Limpa a tela do terminal via sequencia ANSI (sem abrir subshell)."""
+    if not sys.stdout.isatty():
+        return
+    if os.name == 'nt':
+        # Habilita o processamento de sequencias VT no console do Windows 10+
+        os.system('')
+    sys.stdout.write('\x1b[2J\x1b[H')
+    sys.stdout.flush()
+
+
+def exibir_cabecalho(saida=None):
+    """Exibe cabecalho do relatorio em saida (default: stdout)."""
+    print("\n" + "="*70, file=saida)
+    print("RELATORIO DE DIVERGENCIAS - BONUS VIEW", file=saida)
+    print("="*70, file=saida)
+    print(f"Data/Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", file=saida)
+    print("="*70 + "\n", file=saida)
+
+
+# Uma unica varredura de byd.bonus_view cobre as tres analises do relatorio.
+# Cada metrica usa seu proprio FILTER; o WHERE externo e a uniao dos periodos.
+QUERY_METRICAS = """
+SELECT 
+    COUNT(*) FILTER (
+        WHERE bonus_utilizado = 'PENDENTE VERIFICACAO'
+    ) as pendentes_total,
+    MIN(dta_processamento) FILTER (
+        WHERE bonus_utilizado = 'PENDENTE VERIFICACAO'
+    ) as pendentes_mais_antigo,
+    MAX(dta_processamento) FILTER (
+        WHERE bonus_utilizado = 'PENDENTE VERIFICACAO'
+    ) as pendentes_mais_recente,
+    COUNT(*) FILTER (
+        WHERE apontamento = 'Revisar Divergência!'
+            AND dta_processamento <= '2026-05-30'
+    ) as divergencias_total,
+    COUNT(DISTINCT competencia) FILTER (
+        WHERE apontamento = 'Revisar Divergência!'
+            AND dta_processamento <= '2026-05-30'
+    ) as competencias_afetadas,
+    COUNT(*) FILTER (
+        WHERE ABS(COALESCE(CAST(bonus_dpto AS NUMERIC), 0) - COALESCE(CAST(bonus AS NUMERIC), 0)) > 0.01
+            OR ABS(COALESCE(CAST(trade_mkt_dpto AS NUMERIC), 0) - COALESCE(CAST(trade AS NUMERIC), 0)) > 0.01
+    ) as trade_mkt_total
+FROM byd.bonus_view
+WHERE dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'
+"""
+
+
+def classificar_pendentes(total):
+    """Define criticidade, icone e acao a partir do total de pendentes."""
     if total < 10:
-        criticidade = "BAIXA"
-        icone = "✓"
-        acao = "Situacao controlada"
+        return "BAIXA", "✓", "Situacao controlada"
     elif total <= 20:
-        criticidade = "ATENCAO"
-        icone = "⚠"
-        acao = "Monitorar volume"
+        return "ATENCAO", "⚠", "Monitorar volume"
     else:
-        criticidade = "CRITICA"
-        icone = "✖"
-        acao = "Ajustar Chassis pendentes de verificacao!"
-    
-    return {
-        'total': total,
-        'mais_antigo': mais_antigo,
-        'mais_recente': mais_recente,
-        'criticidade': criticidade,
-        'icone': icone,
-        'acao': acao
-    }
+        return "CRITICA", "✖", "Ajustar Chassis pendentes de verificacao!"
 
 
-def analisar_divergencias_valor(cursor):
-    """Analisa divergencias de valor (Revisar Divergencia!)."""
-    query = """
-    SELECT 
-        COUNT(*) as total,
-        COUNT(DISTINCT competencia) as competencias_afetadas
-    FROM byd.bonus_view
-    WHERE dta_processamento BETWEEN '2025-08-01' AND '2026-05-30'
-        AND apontamento = 'Revisar Divergência!'
+def coletar_metricas(cursor):
     """
+    Executa a consulta consolidada e retorna as metricas do relatorio.
     
-    cursor.execute(query)
+    Returns:
+        tuple: (pendentes, divergencias, trade_mkt) no mesmo formato
+        usado pelas secoes do relatorio.
+    """
+    cursor.execute(QUERY_METRICAS)
     row = cursor.fetchone()
     
-    total = row[0] if row[0] else 0
-    competencias = row[1] if row[1] else 0
+    total_pendentes = row[0] if row[0] else 0
+    criticidade, icone, acao = classificar_pendentes(total_pendentes)
     
-    return {
-        'total': total,
-        'competencias_afetadas': competencias
+    pendentes = {
+        'total': total_pendentes,
+        'mais_antigo': row[1],
+        'mais_recente': row[2],
+        'criticidade': criticidade,
+        'icone': icone,
+        'acao': acao
     }
-
-
-def analisar_trade_marketing(cursor):
-    """Analisa divergencias de Trade Marketing."""
-    query = """
-    SELECT COUNT(*) 
-    FROM byd.bonus_view
-    WHERE (
-        ABS(COALESCE(CAST(bonus_dpto AS NUMERIC), 0) - COALESCE(CAST(bonus AS NUMERIC), 0)) > 0.01
-        OR ABS(COALESCE(CAST(trade_mkt_dpto AS NUMERIC), 0) - COALESCE(CAST(trade AS NUMERIC), 0)) > 0.01
-    )
-    AND dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'
-    """
     
-    cursor.execute(query)
-    row = cursor.fetchone()
+    divergencias = {
+        'total': row[3] if row[3] else 0,
+        'competencias_afetadas': row[4] if row[4] else 0
+    }
+    
+    trade_mkt = row[5] if row[5] else 0
     
-    return row[0] if row[0] else 0
+    return pendentes, divergencias, trade_mkt
 
 
 def exibir_relatorio():
     """Funcao principal do relatorio."""
     limpar_tela()
-    exibir_cabecalho()
+    
+    # O relatorio inteiro e montado em memoria e escrito de uma vez
+    saida = io.StringIO()
+    exibir_cabecalho(saida)
     
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
+        pendentes, divergencias, trade_mkt = coletar_metricas(cursor)
+        
         # 1. Pendentes de Verificacao
-        pendentes = analisar_pendentes_verificacao(cursor)
-        print("1. PENDENTES DE VERIFICACAO")
-        print("-" * 70)
-        print(f"   Total de Chassis:      {pendentes['total']}")
-        print(f"   Criticidade:           {pendentes['icone']} {pendentes['criticidade']}")
-        print(f"   Acao:                  {pendentes['acao']}")
+        print("1. PENDENTES DE VERIFICACAO", file=saida)
+        print("-" * 70, file=saida)
+        print(f"   Total de Chassis:      {pendentes['total']}", file=saida)
+        print(f"   Criticidade:           {pendentes['icone']} {pendentes['criticidade']}", file=saida)
+        print(f"   Acao:                  {pendentes['acao']}", file=saida)
         if pendentes['mais_antigo']:
-            print(f"   Mais antigo:           {pendentes['mais_antigo'].strftime('%d/%m/%Y')}")
+            print(f"   Mais antigo:           {pendentes['mais_antigo'].strftime('%d/%m/%Y')}", file=saida)
         if pendentes['mais_recente']:
-            print(f"   Mais recente:          {pendentes['mais_recente'].strftime('%d/%m/%Y')}")
-        print()
+            print(f"   Mais recente:          {pendentes['mais_recente'].strftime('%d/%m/%Y')}", file=saida)
+        print(file=saida)
         
         # 2. Divergencias de Valor
-        divergencias = analisar_divergencias_valor(cursor)
-        print("2. DIVERGENCIAS DE VALOR (Revisar Divergencia!)")
-        print("-" * 70)
-        print(f"   Total de Registros:    {divergencias['total']}")
-        print(f"   Competencias Afetadas: {divergencias['competencias_afetadas']}")
-        print()
+        print("2. DIVERGENCIAS DE VALOR (Revisar Divergencia!)", file=saida)
+        print("-" * 70, file=saida)
+        print(f"   Total de Registros:    {divergencias['total']}", file=saida)
+        print(f"   Competencias Afetadas: {divergencias['competencias_afetadas']}", file=saida)
+        print(file=saida)
         
         # 3. Trade Marketing
-        trade_mkt = analisar_trade_marketing(cursor)
-        print("3. DIVERGENCIAS TRADE MARKETING")
-        print("-" * 70)
-        print(f"   Total de Registros:    {trade_mkt}")
-        print()
+        print("3. DIVERGENCIAS TRADE MARKETING", file=saida)
+        print("-" * 70, file=saida)
+        print(f"   Total de Registros:    {trade_mkt}", file=saida)
+        print(file=saida)
         
         # Resumo Final
-        print("="*70)
-        print("RESUMO GERAL")
-        print("="*70)
+        print("="*70, file=saida)
+        print("RESUMO GERAL", file=saida)
+        print("="*70, file=saida)
         total_geral = pendentes['total'] + divergencias['total'] + trade_mkt
-        print(f"Total de Divergencias: {total_geral}")
-        print()
+        print(f"Total de Divergencias: {total_geral}", file=saida)
+        print(file=saida)
         
         if pendentes['criticidade'] == 'CRITICA' or divergencias['total'] > 50:
-            print("⚠ ATENCAO: Acoes corretivas necessarias!")
+            print("⚠ ATENCAO: Acoes corretivas necessarias!", file=saida)
         elif pendentes['criticidade'] == 'ATENCAO' or divergencias['total'] > 20:
-            print("⚠ Monitoramento recomendado")
+            print("⚠ Monitoramento recomendado", file=saida)
         else:
-            print("✓ Situacao sob controle")
+            print("✓ Situacao sob controle", file=saida)
+        
+        print("="*70 + "\n", file=saida)
         
-        print("="*70 + "\n")
+        sys.stdout.write(saida.getvalue())
+        sys.stdout.flush()
         
         cursor.close()
         conn.close()
         
     except Exception as e:
-        print(f"\n✖ ERRO ao gerar relatorio: {e}\n")
-        print("Verificacoes:")
-        print("  1. Arquivo .env configurado?")
-        print("  2. PostgreSQL rodando?")
-        print("  3. Credenciais corretas?")
-        print()
+        print(f"\n✖ ERRO ao gerar relatorio: {e}\n", file=saida)
+        print("Verificacoes:", file=saida)
+        print("  1. Arquivo .env configurado?", file=saida)
+        print("  2. PostgreSQL rodando?", file=saida)
+        print("  3. Credenciais corretas?", file=saida)
+        print(file=saida)
+        sys.stdout.write(saida.getvalue())
+        sys.stdout.flush()
         sys.exit(1)
 
 
@@ -6,8 +6,12 @@ Uso: python run_tests.py [opção]
 
 import sys
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+LOG_FILE = Path('logs/last_run.log')
+BUFFER_SIZE = 1 << 16
+
 
 def run_command(cmd, description=""):
     """Executa comando e retorna status."""
@@ -16,8 +20,27 @@ def run_command(cmd, description=""):
         print(f"  {description}")
         print(f"{'='*60}\n")
     
-    result = subprocess.run(cmd, shell=True)
-    return result.returncode == 0
+    # Saída lida em blocos (read1 devolve o que já está disponível) e
+    # gravada de uma vez no terminal e no log da última execução
+    LOG_FILE.parent.mkdir(exist_ok=True)
+    sys.stdout.flush()
+    process = subprocess.Popen(
+        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        bufsize=BUFFER_SIZE
+    )
+    with open(LOG_FILE, 'wb', buffering=BUFFER_SIZE) as log:
+        for chunk in iter(lambda: process.stdout.read1(BUFFER_SIZE), b''):
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            log.write(chunk)
+    
+    return process.wait() == 0
+
+
+def run_check(cmd):
+    """Executa comando capturando a saída e retorna (status, saída)."""
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    return result.returncode == 0, result.stdout + result.stderr
 
 
 def main():
@@ -38,6 +61,9 @@ def main():
         print("  7. Verificar qualidade de código (Black, Flake8, mypy)")
         print("  8. Executar pre-commit em todos os arquivos")
         print("  9. Ver relatório de cobertura")
+        print(" 10. Re-executar apenas testes que falharam")
+        print(" 11. Executar testes impactados pela mudança (testmon)")
+        print(" 12. Executar suíte em paralelo (xdist)")
         print("  0. Sair\n")
         
         option = input("Opção: ").strip()
@@ -54,6 +80,9 @@ def main():
         '7': (None, 'Verificando qualidade de código'),
         '8': ('pre-commit run --all-files', 'Executando pre-commit'),
         '9': (None, 'Abrindo relatório de cobertura'),
+        '10': ('pytest --lf -v', 'Re-executando apenas testes que falharam'),
+        '11': ('pytest --testmon -v', 'Executando testes impactados pela mudança'),
+        '12': ('pytest -n auto --dist loadfile', 'Executando suíte em paralelo'),
         '0': (None, 'Saindo...'),
     }
     
@@ -78,10 +107,18 @@ def main():
             ("mypy src/", "mypy (tipos)"),
         ]
         
+        # Checks independentes: rodam em paralelo e a saída capturada é
+        # exibida na ordem da lista, sem intercalar no terminal
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            futures = [executor.submit(run_check, cmd) for cmd, _ in checks]
+            resultados = [future.result() for future in futures]
+        
         all_passed = True
-        for cmd, name in checks:
+        for (cmd, name), (passed, output) in zip(checks, resultados):
             print(f"\n🔍 {name}...")
-            if not run_command(cmd):
+            if output.strip():
+                print(output.rstrip())
+            if not passed:
                 all_passed = False
                 print(f"  ❌ {name} falhou")
             else:
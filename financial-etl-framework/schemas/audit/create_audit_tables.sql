@@ -52,7 +52,9 @@ CREATE TABLE IF NOT EXISTS audit.operacoes (
     -- Controle temporal
     timestamp_inicio TIMESTAMP NOT NULL DEFAULT NOW(),
     timestamp_fim TIMESTAMP,
-    duracao_segundos NUMERIC(10,3),               -- Duração calculada
+    duracao_segundos NUMERIC(10,3) GENERATED ALWAYS AS (
+        EXTRACT(EPOCH FROM (timestamp_fim - timestamp_inicio))
+    ) STORED,                                     -- Duração calculada pelo banco
     
     -- Status e controle
     status VARCHAR(20) NOT NULL DEFAULT 'PENDING', -- PENDING, SUCCESS, FAILED, ROLLED_BACK
@@ -153,7 +155,9 @@ CREATE TABLE IF NOT EXISTS audit.sessoes_processamento (
     -- Controle temporal
     inicio_processamento TIMESTAMP NOT NULL DEFAULT NOW(),
     fim_processamento TIMESTAMP,
-    duracao_total_segundos INTEGER,
+    duracao_total_segundos INTEGER GENERATED ALWAYS AS (
+        EXTRACT(EPOCH FROM (fim_processamento - inicio_processamento))::INTEGER
+    ) STORED,
     
     -- Métricas da sessão
     total_registros_analisados INTEGER DEFAULT 0,
@@ -302,7 +306,7 @@ COMMENT ON FUNCTION audit.registrar_operacao IS 'Helper para registro simplifica
 /**
  * FUNCTION: audit.finalizar_operacao
  * 
- * Atualiza uma operação com status final e calcula duração.
+ * Atualiza uma operação com status final (duracao_segundos é gerada).
  */
 CREATE OR REPLACE FUNCTION audit.finalizar_operacao(
     p_operacao_id INTEGER,
@@ -313,7 +317,6 @@ BEGIN
     UPDATE audit.operacoes
     SET 
         timestamp_fim = NOW(),
-        duracao_segundos = EXTRACT(EPOCH FROM (NOW() - timestamp_inicio)),
         status = p_status,
         erro_mensagem = p_erro_mensagem
     WHERE id = p_operacao_id;
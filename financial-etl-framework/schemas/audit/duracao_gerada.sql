@@ -0,0 +1,79 @@
+/**
+ * COLUNAS GERADAS: duração de operações e sessões
+ *
+ * Objetivo:
+ *   O AuditLogger grava só timestamp_fim / fim_processamento; a duração é
+ *   calculada pelo PostgreSQL na escrita da linha (STORED), sem o
+ *   EXTRACT(EPOCH ...) em cada UPDATE de finalização.
+ *
+ * Colunas:
+ *   - audit.operacoes.duracao_segundos:
+ *     EXTRACT(EPOCH FROM (timestamp_fim - timestamp_inicio))
+ *   - audit.sessoes_processamento.duracao_total_segundos:
+ *     EXTRACT(EPOCH FROM (fim_processamento - inicio_processamento))::INTEGER
+ *
+ * Observações:
+ *   - Requer PostgreSQL 12+. Uma coluna existente não pode virar gerada:
+ *     ela é recriada (o valor é recalculado a partir dos timestamps e a
+ *     coluna passa para o fim da tabela).
+ *   - vw_operacoes_resumo, audit.finalizar_operacao() e
+ *     mv_operacoes_perf_daily dependem da coluna e são recriadas aqui.
+ *   - A recriação reescreve as tabelas: executar fora do horário de carga,
+ *     com psql (usa \ir):
+ *         psql -f schemas/audit/duracao_gerada.sql
+ */
+
+BEGIN;
+
+DROP MATERIALIZED VIEW IF EXISTS audit.mv_operacoes_perf_daily;
+DROP VIEW IF EXISTS audit.vw_operacoes_resumo;
+
+ALTER TABLE audit.operacoes
+    DROP COLUMN duracao_segundos,
+    ADD COLUMN duracao_segundos NUMERIC(10,3) GENERATED ALWAYS AS (
+        EXTRACT(EPOCH FROM (timestamp_fim - timestamp_inicio))
+    ) STORED;
+
+ALTER TABLE audit.sessoes_processamento
+    DROP COLUMN duracao_total_segundos,
+    ADD COLUMN duracao_total_segundos INTEGER GENERATED ALWAYS AS (
+        EXTRACT(EPOCH FROM (fim_processamento - inicio_processamento))::INTEGER
+    ) STORED;
+
+-- A função antiga atribui duracao_segundos, o que agora é erro
+CREATE OR REPLACE FUNCTION audit.finalizar_operacao(
+    p_operacao_id INTEGER,
+    p_status VARCHAR(20),
+    p_erro_mensagem TEXT DEFAULT NULL
+) RETURNS VOID AS $$
+BEGIN
+    UPDATE audit.operacoes
+    SET
+        timestamp_fim = NOW(),
+        status = p_status,
+        erro_mensagem = p_erro_mensagem
+    WHERE id = p_operacao_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE VIEW audit.vw_operacoes_resumo AS
+SELECT
+    DATE(timestamp_inicio) as data,
+    tipo_operacao,
+    origem,
+    status,
+    COUNT(*) as total_operacoes,
+    SUM(registros_afetados) as total_registros,
+    AVG(duracao_segundos) as duracao_media_seg,
+    COUNT(CASE WHEN status = 'FAILED' THEN 1 END) as total_erros
+FROM audit.operacoes
+GROUP BY DATE(timestamp_inicio), tipo_operacao, origem, status;
+
+COMMENT ON VIEW audit.vw_operacoes_resumo IS 'Resumo diário de operações por tipo e status';
+
+\ir mv_operacoes_perf_daily.sql
+
+COMMIT;
+
+ANALYZE audit.operacoes;
+ANALYZE audit.sessoes_processamento;
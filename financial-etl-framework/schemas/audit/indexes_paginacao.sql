@@ -0,0 +1,58 @@
+/**
+ * ÍNDICES: listagens paginadas da API de auditoria
+ *
+ * Objetivo:
+ *   As listagens da API filtram audit.operacoes e audit.divergencias_processadas
+ *   e ordenam por timestamp DESC com LIMIT. Sem um índice cujas colunas
+ *   iniciais casem com o filtro e a última com a ordenação, o PostgreSQL
+ *   ordena todo o conjunto filtrado antes de aplicar o LIMIT.
+ *
+ * Principais índices:
+ *   - ix_operacoes_ts_desc: cobre GET /auditoria/operacoes sem filtros
+ *     (index-only scan das colunas mais consultadas)
+ *   - ix_operacoes_status_ts / ix_operacoes_usuario_ts: filtros por status
+ *     e por usuário mantendo a ordem de timestamp_inicio
+ *   - ix_div_detected_ts: parcial, fila de divergências pendentes (DETECTED)
+ *   - ix_div_status_ts / ix_div_tipo_ts: filtros por status e por tipo
+ *
+ * Todos terminam em id DESC para atender também a paginação por keyset
+ * (after_ts + after_id) das listagens: WHERE (ts, id) < (...) ORDER BY ts DESC, id DESC.
+ *
+ * Observações:
+ *   - CREATE INDEX CONCURRENTLY não bloqueia escritas, mas não pode rodar
+ *     dentro de uma transação: executar com psql (autocommit), por ex.:
+ *         psql -f schemas/audit/indexes_paginacao.sql
+ *   - INCLUDE requer PostgreSQL 11+.
+ *   - Depois de particionamento_divergencias.sql, os índices ix_div_* já
+ *     existem (CONCURRENTLY não é suportado em tabela particionada).
+ */
+
+-- audit.operacoes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_operacoes_ts_desc
+    ON audit.operacoes (timestamp_inicio DESC, id DESC)
+    INCLUDE (tipo_operacao, usuario, status);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_operacoes_status_ts
+    ON audit.operacoes (status, timestamp_inicio DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_operacoes_usuario_ts
+    ON audit.operacoes (usuario, timestamp_inicio DESC, id DESC);
+
+-- audit.divergencias_processadas
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_div_detected_ts
+    ON audit.divergencias_processadas (detectado_em DESC, id DESC)
+    WHERE status_processamento = 'DETECTED';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_div_status_ts
+    ON audit.divergencias_processadas (status_processamento, detectado_em DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_div_tipo_ts
+    ON audit.divergencias_processadas (tipo_divergencia, detectado_em DESC, id DESC);
+
+-- Os índices de coluna única sobre timestamp ficam redundantes
+DROP INDEX CONCURRENTLY IF EXISTS audit.idx_operacoes_timestamp;
+DROP INDEX CONCURRENTLY IF EXISTS audit.idx_divergencias_detectado;
+
+-- Atualiza estatísticas para o planner considerar os novos índices
+ANALYZE audit.operacoes;
+ANALYZE audit.divergencias_processadas;
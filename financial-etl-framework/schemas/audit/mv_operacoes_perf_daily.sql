@@ -0,0 +1,38 @@
+/**
+ * MATERIALIZED VIEW: audit.mv_operacoes_perf_daily
+ *
+ * Objetivo:
+ *   Rollup diário de duração e status das operações por tipo, consumido por
+ *   GET /api/v1/relatorios/metricas/performance. Os PERCENTILE sobre
+ *   audit.operacoes ordenam todo o histórico filtrado a cada consulta; com o
+ *   rollup o endpoint agrega dias x tipos de operação, não operações.
+ *
+ * Observações:
+ *   - percentile_disc devolve um valor observado (sem interpolação).
+ *   - Mediana e p95 de um período são aproximados pela média dos valores
+ *     diários ponderada pela quantidade de operações do dia.
+ *   - Atualizada ao final de cada execução do DailyProcessor com
+ *     REFRESH MATERIALIZED VIEW CONCURRENTLY (exige o índice único abaixo);
+ *     operações do dia corrente aparecem após a próxima atualização.
+ */
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS audit.mv_operacoes_perf_daily AS
+SELECT
+    DATE(timestamp_inicio) as dia,
+    tipo_operacao,
+    COUNT(*) as total_operacoes,
+    COUNT(duracao_segundos) as total_com_duracao,
+    SUM(duracao_segundos) as duracao_total,
+    MIN(duracao_segundos) as duracao_minima,
+    MAX(duracao_segundos) as duracao_maxima,
+    PERCENTILE_DISC(0.5) WITHIN GROUP (ORDER BY duracao_segundos) as mediana,
+    PERCENTILE_DISC(0.95) WITHIN GROUP (ORDER BY duracao_segundos) as p95,
+    COUNT(*) FILTER (WHERE status = 'SUCCESS') as sucessos,
+    COUNT(*) FILTER (WHERE status = 'FAILED') as falhas
+FROM audit.operacoes
+GROUP BY DATE(timestamp_inicio), tipo_operacao;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_operacoes_perf_daily
+    ON audit.mv_operacoes_perf_daily (dia, tipo_operacao);
+
+COMMENT ON MATERIALIZED VIEW audit.mv_operacoes_perf_daily IS 'Rollup diário de performance e status das operações por tipo';
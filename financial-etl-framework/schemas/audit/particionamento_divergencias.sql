@@ -0,0 +1,111 @@
+/**
+ * MIGRAÇÃO: particionamento mensal de audit.divergencias_processadas
+ *
+ * Objetivo:
+ *   Converter audit.divergencias_processadas em tabela particionada por
+ *   RANGE (detectado_em), uma partição por mês. A limpeza por retenção
+ *   passa a ser um DROP da partição expirada em vez de DELETE em massa
+ *   (sem bloat, sem VACUUM pesado), e as listagens por período só
+ *   varrem as partições do intervalo consultado.
+ *
+ * Partições:
+ *   - divergencias_processadas_YYYYMM: [primeiro dia do mês, primeiro dia do mês seguinte)
+ *   - divergencias_processadas_default: recebe linhas fora das partições
+ *     existentes; deve permanecer vazia em operação normal
+ *
+ * A criação das partições futuras e o descarte das expiradas são feitos por
+ * AuditLogger.rotacionar_particoes(), chamado ao fim do processamento diário
+ * (retenção configurada por AUDIT_RETENTION_MONTHS).
+ *
+ * Observações:
+ *   - audit.operacoes não é particionada: divergencias_processadas.operacao_id
+ *     e operacoes.rollback_de referenciam operacoes(id), e a PK de uma tabela
+ *     particionada precisa incluir a coluna de partição.
+ *   - A PK passa a ser (id, detectado_em); id continua vindo da mesma sequence.
+ *   - CREATE INDEX CONCURRENTLY não é suportado em tabela particionada: os
+ *     índices de indexes_paginacao.sql são recriados aqui.
+ *   - Requer PostgreSQL 11+. Executar em janela de manutenção (a cópia
+ *     mantém lock exclusivo sobre a tabela original):
+ *         psql -f schemas/audit/particionamento_divergencias.sql
+ */
+
+BEGIN;
+
+DROP VIEW IF EXISTS audit.vw_divergencias_abertas;
+
+ALTER TABLE audit.divergencias_processadas RENAME TO divergencias_processadas_legado;
+ALTER TABLE audit.divergencias_processadas_legado
+    RENAME CONSTRAINT divergencias_processadas_pkey TO divergencias_processadas_legado_pkey;
+
+CREATE TABLE audit.divergencias_processadas (
+    LIKE audit.divergencias_processadas_legado INCLUDING DEFAULTS INCLUDING COMMENTS,
+    PRIMARY KEY (id, detectado_em),
+    FOREIGN KEY (operacao_id) REFERENCES audit.operacoes(id)
+) PARTITION BY RANGE (detectado_em);
+
+ALTER SEQUENCE audit.divergencias_processadas_id_seq
+    OWNED BY audit.divergencias_processadas.id;
+
+CREATE TABLE audit.divergencias_processadas_default
+    PARTITION OF audit.divergencias_processadas DEFAULT;
+
+-- Uma partição por mês, do mês mais antigo com dados até o próximo mês
+DO $$
+DECLARE
+    mes DATE;
+    ultimo DATE := (date_trunc('month', NOW()) + INTERVAL '1 month')::date;
+BEGIN
+    SELECT COALESCE(date_trunc('month', MIN(detectado_em)), date_trunc('month', NOW()))::date
+      INTO mes
+      FROM audit.divergencias_processadas_legado;
+
+    WHILE mes <= ultimo LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS audit.%I PARTITION OF audit.divergencias_processadas '
+            'FOR VALUES FROM (%L) TO (%L)',
+            'divergencias_processadas_' || to_char(mes, 'YYYYMM'),
+            mes,
+            (mes + INTERVAL '1 month')::date
+        );
+        mes := (mes + INTERVAL '1 month')::date;
+    END LOOP;
+END
+$$;
+
+INSERT INTO audit.divergencias_processadas
+SELECT * FROM audit.divergencias_processadas_legado;
+
+DROP TABLE audit.divergencias_processadas_legado;
+
+-- Índices (criados em cada partição automaticamente)
+CREATE INDEX idx_divergencias_idnf ON audit.divergencias_processadas(idnfsexterno);
+CREATE INDEX idx_divergencias_tipo ON audit.divergencias_processadas(tipo_divergencia);
+CREATE INDEX idx_divergencias_status ON audit.divergencias_processadas(status_processamento);
+CREATE INDEX idx_divergencias_competencia ON audit.divergencias_processadas(competencia);
+
+CREATE INDEX ix_div_detected_ts
+    ON audit.divergencias_processadas (detectado_em DESC, id DESC)
+    WHERE status_processamento = 'DETECTED';
+
+CREATE INDEX ix_div_status_ts
+    ON audit.divergencias_processadas (status_processamento, detectado_em DESC, id DESC);
+
+CREATE INDEX ix_div_tipo_ts
+    ON audit.divergencias_processadas (tipo_divergencia, detectado_em DESC, id DESC);
+
+COMMENT ON TABLE audit.divergencias_processadas IS 'Histórico de divergências detectadas e suas resoluções (particionada por mês de detectado_em)';
+
+CREATE OR REPLACE VIEW audit.vw_divergencias_abertas AS
+SELECT
+    d.*,
+    EXTRACT(DAY FROM NOW() - d.detectado_em) as dias_pendente
+FROM audit.divergencias_processadas d
+WHERE status_processamento IN ('DETECTED', 'APPROVED')
+  AND processado_em IS NULL
+ORDER BY detectado_em ASC;
+
+COMMENT ON VIEW audit.vw_divergencias_abertas IS 'Divergências detectadas aguardando processamento';
+
+COMMIT;
+
+ANALYZE audit.divergencias_processadas;
@@ -0,0 +1,18 @@
+/**
+ * EXTENSÃO: pg_stat_statements
+ *
+ * Objetivo:
+ *   Estatísticas acumuladas de execução por consulta normalizada, exibidas
+ *   em GET /api/v1/relatorios/metricas/performance?top_consultas=N para
+ *   identificar as consultas mais lentas da API e da automação.
+ *
+ * Observações:
+ *   - Exige a biblioteca carregada no postgresql.conf (reinício do servidor):
+ *         shared_preload_libraries = 'pg_stat_statements'
+ *   - As colunas *_exec_time existem a partir do PostgreSQL 13.
+ *   - O texto das consultas é normalizado (constantes viram $1, $2, ...),
+ *     então valores de parâmetros não aparecem no relatório.
+ *   - Para zerar as estatísticas: SELECT pg_stat_statements_reset();
+ */
+
+CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
@@ -0,0 +1,54 @@
+/**
+ * COLUNAS GERADAS: diferenças de bônus e trade marketing
+ *
+ * Objetivo:
+ *   Tirar o CAST texto -> NUMERIC de cada varredura da byd.bonus_view.
+ *   bonus, bonus_dpto, trade_mkt_dpto e trade são armazenados como texto;
+ *   as colunas abaixo guardam o valor numérico já convertido (STORED),
+ *   calculado uma vez na escrita da linha.
+ *
+ * Colunas:
+ *   - byd.controladoria.bonus_diff: ABS(bonus_dpto - bonus), mesma
+ *     expressão usada pelo relatório e pelo DivergenceProcessor
+ *   - byd.controladoria.trade_mkt_dpto_num: trade_mkt_dpto numérico
+ *   - byd.byd_cadastro.trade_num: trade numérico
+ *
+ * A divergência de trade cruza controladoria e byd_cadastro, por isso não
+ * cabe em uma única coluna gerada: fica ABS(trade_mkt_dpto_num - trade_num),
+ * já sem CAST por linha.
+ *
+ * Observações:
+ *   - Requer PostgreSQL 12+.
+ *   - ADD COLUMN ... STORED reescreve a tabela: executar fora do horário
+ *     de carga.
+ *   - A definição de byd.bonus_view não está versionada neste repositório.
+ *     Para os filtros usarem as novas colunas, recriar a view expondo-as
+ *     (CREATE OR REPLACE VIEW permite acrescentar colunas ao final), por ex.:
+ *         c.bonus_diff,
+ *         ABS(c.trade_mkt_dpto_num - bc.trade_num) AS trade_diff
+ *     e trocar os predicados ABS(COALESCE(CAST(...))) por
+ *     bonus_diff > 0.01 OR trade_diff > 0.01.
+ */
+
+ALTER TABLE byd.controladoria
+    ADD COLUMN IF NOT EXISTS bonus_diff NUMERIC GENERATED ALWAYS AS (
+        ABS(COALESCE(CAST(bonus_dpto AS NUMERIC), 0) - COALESCE(CAST(bonus AS NUMERIC), 0))
+    ) STORED,
+    ADD COLUMN IF NOT EXISTS trade_mkt_dpto_num NUMERIC GENERATED ALWAYS AS (
+        COALESCE(CAST(trade_mkt_dpto AS NUMERIC), 0)
+    ) STORED;
+
+ALTER TABLE byd.byd_cadastro
+    ADD COLUMN IF NOT EXISTS trade_num NUMERIC GENERATED ALWAYS AS (
+        COALESCE(CAST(trade AS NUMERIC), 0)
+    ) STORED;
+
+-- Índice parcial sobre a coluna gerada substitui o índice de expressão
+DROP INDEX IF EXISTS byd.idx_controladoria_bonus_div;
+
+CREATE INDEX IF NOT EXISTS idx_controladoria_bonus_diff
+    ON byd.controladoria (idnfsexterno)
+    WHERE bonus_diff > 0.01;
+
+ANALYZE byd.controladoria;
+ANALYZE byd.byd_cadastro;
\ No newline at end of file
@@ -0,0 +1,53 @@
+/**
+ * ÍNDICES: tabelas base da byd.bonus_view
+ *
+ * Objetivo:
+ *   Acelerar os filtros usados pelo relatorio_divergencias.py e pelo
+ *   DivergenceProcessor sobre a byd.bonus_view.
+ *
+ * Observação:
+ *   byd.bonus_view é uma view comum e não pode ser indexada diretamente.
+ *   Os índices ficam nas tabelas base que alimentam as colunas filtradas:
+ *     - byd.db_vendas_byd  -> dta_processamento
+ *     - byd.byd_cadastro   -> bonus_utilizado, trade
+ *     - byd.controladoria  -> bonus, bonus_dpto, trade_mkt_dpto
+ *
+ * Principais índices:
+ *   - idx_vendas_dta_processamento: range de datas usado em todas as consultas
+ *   - idx_cadastro_pendente: parcial, só linhas 'PENDENTE VERIFICACAO'
+ *
+ * O índice da divergência de bônus (idx_controladoria_bonus_diff, parcial
+ * sobre a coluna gerada bonus_diff) é criado por
+ * alter/generated_diff_columns.sql, que também remove o antigo
+ * idx_controladoria_bonus_div; este script não o recria.
+ *
+ * A divergência de trade compara trade_mkt_dpto (controladoria) com trade
+ * (byd_cadastro); por cruzar tabelas não cabe em índice parcial. O join
+ * por idnfsexterno já é coberto pelas chaves únicas usadas no ON CONFLICT
+ * do trigger sync_insert.
+ *
+ * A validação de valores do DivergenceProcessor (negativos e acima de
+ * 100000) também não tem índice parcial: o predicado junta trade
+ * (byd_cadastro) e valor_bonus/bonus_dpto (controladoria) em um único OR, e
+ * o planner não consegue provar a partir dele o predicado de um índice
+ * parcial em nenhuma das duas tabelas.
+ *
+ * Também não há índice para apontamento = 'Revisar Divergência!': a coluna
+ * é calculada pela view a partir das mesmas diferenças (coberta pelo índice
+ * de bonus_diff), e bonus_utilizado e dta_processamento vêm de tabelas
+ * diferentes, o que impede um índice composto. Os índices são criados por
+ * este script (psql), não pela aplicação: o usuário do ETL não precisa de
+ * permissão de DDL.
+ */
+
+CREATE INDEX IF NOT EXISTS idx_vendas_dta_processamento
+    ON byd.db_vendas_byd (dta_processamento DESC);
+
+CREATE INDEX IF NOT EXISTS idx_cadastro_pendente
+    ON byd.byd_cadastro (idnfsexterno)
+    WHERE bonus_utilizado = 'PENDENTE VERIFICACAO';
+
+-- Atualiza estatísticas para o planner considerar os novos índices
+ANALYZE byd.db_vendas_byd;
+ANALYZE byd.byd_cadastro;
+ANALYZE byd.controladoria;
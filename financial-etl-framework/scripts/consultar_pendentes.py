@@ -4,6 +4,7 @@ Exporta resultados para CSV ou retorna DataFrame.
 """
 
 import sys
+import codecs
 import logging
 from pathlib import Path
 from datetime import datetime
@@ -15,48 +16,166 @@ from conn import db_connection
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Tamanho do lote trazido do servidor a cada round-trip do cursor nomeado
+ITERSIZE = 10000
 
-def consultar_pendentes_verificacao(ano=None, exportar_csv=False):
+# Apenas as colunas usadas na conferência dos pendentes (tela e CSV);
+# byd.bonus_view é um join largo e SELECT * trafegaria todas as colunas
+QUERY_PENDENTES = """
+    SELECT
+        idnfsexterno,
+        chassi,
+        des_modelo,
+        competencia,
+        dta_processamento,
+        bonus_utilizado,
+        valor_bonus,
+        bonus,
+        bonus_dpto,
+        trade,
+        trade_mkt_dpto,
+        apontamento
+    FROM byd.bonus_view
+    WHERE dta_processamento BETWEEN %s AND %s
+        AND bonus_utilizado = 'PENDENTE VERIFICACAO'
+    ORDER BY dta_processamento DESC
     """
-    Consulta registros com status PENDENTE VERIFICACAO.
+
+QUERY_CONTAGEM = """
+    SELECT COUNT(*)
+    FROM byd.bonus_view
+    WHERE dta_processamento BETWEEN %s AND %s
+        AND bonus_utilizado = 'PENDENTE VERIFICACAO'
+    """
+
+
+def _periodo(ano):
+    """Retorna (data_inicio, data_fim) do ano informado."""
+    return f'{ano}-01-01', f'{ano}-12-31'
+
+
+def _caminho_csv(ano):
+    """Caminho padrão do CSV exportado para o ano."""
+    return Path(__file__).parent.parent / 'Datasets' / f'pendentes_verificacao_{ano}.csv'
+
+
+def _copiar_para_csv(conn, ano, output_path):
+    """
+    Grava o resultado da consulta em CSV via COPY ... TO STDOUT.
+    
+    O PostgreSQL serializa as linhas e o arquivo é escrito em streaming,
+    sem materializar o resultado em objetos Python. COPY não aceita
+    parâmetros, por isso a query é montada com cursor.mogrify.
+    """
+    with conn.cursor() as cur:
+        query = cur.mogrify(QUERY_PENDENTES, _periodo(ano)).decode(conn.encoding)
+        with open(output_path, 'wb') as f:
+            # BOM mantém compatibilidade com o utf-8-sig usado antes (Excel)
+            f.write(codecs.BOM_UTF8)
+            cur.copy_expert(
+                f"COPY ({query}) TO STDOUT WITH CSV HEADER ENCODING 'UTF8'",
+                f
+            )
+
+
+def exportar_pendentes_csv(ano=None, output_path=None):
+    """
+    Exporta pendentes de verificação direto para CSV, sem DataFrame.
     
     Args:
         ano (int, optional): Ano para filtrar. Default: ano atual.
-        exportar_csv (bool): Se True, exporta para CSV.
+        output_path (Path, optional): Arquivo de saída. Default: Datasets/.
     
     Returns:
-        pd.DataFrame: DataFrame com os resultados.
+        Path: Caminho do arquivo gerado.
     """
     if ano is None:
         ano = datetime.now().year
+    if output_path is None:
+        output_path = _caminho_csv(ano)
     
-    query = """
-    SELECT * 
-    FROM byd.bonus_view
-    WHERE dta_processamento BETWEEN %s AND %s
-        AND bonus_utilizado = 'PENDENTE VERIFICACAO'
-    ORDER BY dta_processamento DESC
+    try:
+        with db_connection() as conn:
+            _copiar_para_csv(conn, ano, output_path)
+        
+        logger.info("Arquivo exportado: %s", output_path)
+        return output_path
+    
+    except Exception as e:
+        logger.error("Erro ao exportar pendentes: %s", e)
+        raise
+
+
+def contar_pendentes_verificacao(ano=None):
     """
+    Conta registros com status PENDENTE VERIFICACAO sem trazê-los.
+    
+    Args:
+        ano (int, optional): Ano para filtrar. Default: ano atual.
+    
+    Returns:
+        int: Total de registros pendentes no ano.
+    """
+    if ano is None:
+        ano = datetime.now().year
+    
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(QUERY_CONTAGEM, _periodo(ano))
+            return cur.fetchone()[0]
+
+
+def consultar_pendentes_verificacao(ano=None, limit=None):
+    """
+    Consulta registros com status PENDENTE VERIFICACAO.
+    
+    Para o CSV completo use exportar_pendentes_csv(), que não monta
+    DataFrame.
+    
+    Args:
+        ano (int, optional): Ano para filtrar. Default: ano atual.
+        limit (int, optional): Traz apenas os N registros mais recentes.
+    
+    Returns:
+        pd.DataFrame: DataFrame com os resultados.
+    """
+    if ano is None:
+        ano = datetime.now().year
     
     try:
         with db_connection() as conn:
-            data_inicio = f'{ano}-01-01'
-            data_fim = f'{ano}-12-31'
+            logger.info("Consultando pendentes de verificação: %s", ano)
             
-            logger.info(f"Consultando pendentes de verificação: {ano}")
-            df = pd.read_sql_query(query, conn, params=(data_inicio, data_fim))
+            # Cursor nomeado (server-side): o resultado é trazido em lotes
+            # de ITERSIZE linhas em vez de ser bufferizado inteiro no cliente
+            with conn.cursor(name='pendentes_cur') as cur:
+                cur.itersize = ITERSIZE
+                if limit is None:
+                    cur.execute(QUERY_PENDENTES, _periodo(ano))
+                else:
+                    cur.execute(QUERY_PENDENTES + "    LIMIT %s", (*_periodo(ano), limit))
+                
+                chunks = []
+                cols = None
+                while True:
+                    rows = cur.fetchmany(ITERSIZE)
+                    if cols is None:
+                        cols = [d[0] for d in cur.description]
+                    if not rows:
+                        break
+                    chunks.append(pd.DataFrame.from_records(rows, columns=cols))
             
-            logger.info(f"Total de registros encontrados: {len(df)}")
+            df = (
+                pd.concat(chunks, ignore_index=True) if chunks
+                else pd.DataFrame(columns=cols)
+            )
             
-            if exportar_csv and not df.empty:
-                output_path = Path(__file__).parent.parent / 'Datasets' / f'pendentes_verificacao_{ano}.csv'
-                df.to_csv(output_path, index=False, encoding='utf-8-sig')
-                logger.info(f"Arquivo exportado: {output_path}")
+            logger.info("Total de registros encontrados: %d", len(df))
             
             return df
             
     except Exception as e:
-        logger.error(f"Erro ao consultar pendentes: {e}")
+        logger.error("Erro ao consultar pendentes: %s", e)
         raise
 
 
@@ -67,17 +186,25 @@ def main():
     parser = argparse.ArgumentParser(description='Consulta pendentes de verificação')
     parser.add_argument('--ano', type=int, help='Ano para filtrar (default: ano atual)')
     parser.add_argument('--csv', action='store_true', help='Exportar para CSV')
+    parser.add_argument('--limite', type=int, default=10,
+                        help='Registros exibidos (default: 10)')
     
     args = parser.parse_args()
     
-    df = consultar_pendentes_verificacao(ano=args.ano, exportar_csv=args.csv)
+    if args.csv:
+        # O CSV completo sai via COPY, sem passar por DataFrame
+        exportar_pendentes_csv(ano=args.ano)
+    
+    # Só os registros exibidos são trazidos; o total vem de um COUNT
+    df = consultar_pendentes_verificacao(ano=args.ano, limit=args.limite)
+    total = contar_pendentes_verificacao(ano=args.ano) if not df.empty else 0
     
     if not df.empty:
         print(f"\n{'='*60}")
         print(f"REGISTROS PENDENTES DE VERIFICAÇÃO")
         print(f"{'='*60}\n")
-        print(df.head(10))
-        print(f"\nTotal: {len(df)} registros")
+        print(df.head(args.limite))
+        print(f"\nTotal: {total} registros")
     else:
         print("Nenhum registro pendente encontrado.")
 
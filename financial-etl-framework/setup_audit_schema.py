@@ -15,19 +15,47 @@ import sys
 import os
 from pathlib import Path
 
+import psycopg2
+
 # Adiciona o diretório raiz ao path
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from src.financial_etl.conn import get_connection
 
+
+def _linha_do_erro(sql_content, erro):
+    """
+    Converte a posição do erro reportada pelo PostgreSQL em número de linha.
+    
+    Args:
+        sql_content: Conteúdo SQL enviado ao banco
+        erro: Exceção psycopg2 levantada pelo execute
+    
+    Returns:
+        int ou None: Linha (1-based) do arquivo onde o erro ocorreu
+    """
+    diag = getattr(erro, 'diag', None)
+    posicao = getattr(diag, 'statement_position', None)
+    if not posicao:
+        return None
+    return sql_content.count('\n', 0, int(posicao) - 1) + 1
+
+
 def executar_sql_file(cursor, sql_file_path):
     """
     Executa um arquivo SQL no banco de dados.
     
+    O arquivo inteiro é enviado em um único execute (um round-trip) dentro
+    da transação corrente. Em caso de erro, a posição informada pelo
+    PostgreSQL é convertida na linha correspondente do arquivo.
+    
     Args:
         cursor: Cursor do psycopg2
         sql_file_path: Caminho para o arquivo SQL
+    
+    Raises:
+        psycopg2.Error: Se algum statement do arquivo falhar
     """
     print(f"Lendo arquivo: {sql_file_path}")
     
@@ -35,10 +63,64 @@ def executar_sql_file(cursor, sql_file_path):
         sql_content = f.read()
     
     print("Executando SQL...")
-    cursor.execute(sql_content)
+    # DDL de instalação: não é preciso aguardar o fsync do WAL no commit
+    cursor.execute("SET LOCAL synchronous_commit = off")
+    
+    try:
+        cursor.execute(sql_content)
+    except psycopg2.Error as e:
+        linha = _linha_do_erro(sql_content, e)
+        if linha:
+            trecho = sql_content.splitlines()[linha - 1].strip()
+            print(f"Erro na linha {linha} de {Path(sql_file_path).name}: {trecho}")
+        raise
+    
     print("SQL executado com sucesso")
 
 
+# Tabelas base da byd.bonus_view consultadas pelo relatório diário
+TABELAS_RELATORIO = [
+    'byd.db_vendas_byd',
+    'byd.byd_cadastro',
+    'byd.controladoria',
+]
+
+
+def preparar_tabelas_relatorio(conn):
+    """
+    Atualiza estatísticas e aquece o cache das tabelas do relatório.
+    
+    ANALYZE direcionado evita troca de plano por estatísticas desatualizadas;
+    pg_prewarm (se a extensão estiver instalada) carrega as tabelas no
+    shared_buffers, eliminando a latência de cache frio da primeira consulta.
+    Falhas aqui não invalidam a instalação do schema de auditoria.
+    
+    Args:
+        conn: Conexão psycopg2
+    """
+    cursor = conn.cursor()
+    
+    try:
+        for tabela in TABELAS_RELATORIO:
+            print(f"  ANALYZE {tabela}")
+            cursor.execute(f"ANALYZE {tabela}")
+        
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+        if cursor.fetchone():
+            for tabela in TABELAS_RELATORIO:
+                cursor.execute("SELECT pg_prewarm(%s::regclass)", (tabela,))
+                print(f"  pg_prewarm {tabela}: {cursor.fetchone()[0]} blocos")
+        else:
+            print("  pg_prewarm não instalado (CREATE EXTENSION pg_prewarm) - aquecimento ignorado")
+        
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"  AVISO: manutenção das tabelas do relatório falhou: {e}")
+    finally:
+        cursor.close()
+
+
 def main():
     """Função principal."""
     print("="*70)
@@ -109,6 +191,11 @@ def main():
         else:
             print("AVISO: Nenhuma tabela encontrada no schema 'audit'")
         
+        # Estatísticas e cache das tabelas usadas pelo relatório
+        print()
+        print("Preparando tabelas do relatório...")
+        preparar_tabelas_relatorio(conn)
+        
         # Fecha conexão
         cursor.close()
         conn.close()
@@ -6,7 +6,13 @@ Pacote para ETL de dados financeiros e controladoria.
 __version__ = "1.0.0"
 __author__ = "Giovanni Muller"
 
-from .conn import get_connection, db_connection
+from .conn import (
+    get_connection, db_connection, get_pool, close_pool,
+    executar_preparado, variantes_consulta
+)
 from .config import logger
 
-__all__ = ['get_connection', 'db_connection', 'logger']
+__all__ = [
+    'get_connection', 'db_connection', 'get_pool', 'close_pool',
+    'executar_preparado', 'variantes_consulta', 'logger'
+]
@@ -0,0 +1,186 @@
+"""
+Cache de Respostas da API
+
+Cache em memória com expiração (TTL) para endpoints de leitura pesados,
+como as métricas consultadas com alta frequência pelo Looker Studio.
+
+Características:
+- Expiração por TTL, com janela opcional de stale-while-revalidate
+- Single-flight: requisições simultâneas para a mesma chave aguardam
+  um único cálculo em vez de disparar várias consultas ao banco
+- Cálculo executado em threadpool para não bloquear o event loop
+- Expiração com jitter, para chaves criadas juntas não expirarem juntas
+- Invalidação por tag (ex: 'metricas') após operações que alteram os dados
+- Respostas condicionais (ETag / 304 Not Modified) para listagens consultadas
+  repetidamente pelos dashboards
+
+Autor: Financial ETL Framework
+Data: 2026-01-08
+"""
+
+import asyncio
+import hashlib
+import logging
+import random
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# Caches registrados por tag, para invalidação conjunta
+_caches_por_tag: Dict[str, "weakref.WeakSet[TTLCache]"] = {}
+
+
+def invalidar_tag(tag: str) -> None:
+    """
+    Limpa todos os caches registrados com a tag informada.
+    
+    Args:
+        tag: Tag usada na criação dos caches (ex: 'metricas')
+    """
+    for cache in list(_caches_por_tag.get(tag, ())):
+        cache.clear()
+
+
+# Cache-Control das listagens com ETag: o navegador reaproveita por alguns
+# segundos e depois revalida com If-None-Match
+LISTAGEM_CACHE_CONTROL = "private, max-age=5"
+
+
+def resposta_condicional(request: Request, response: Response, versao: Any) -> Optional[Response]:
+    """
+    Define ETag/Cache-Control e verifica o If-None-Match da requisição.
+    
+    A ETag combina a versão dos dados (ex: contagem e último timestamp da
+    tabela, obtidos com um agregado barato) com os parâmetros da consulta.
+    
+    Args:
+        request: Requisição recebida
+        response: Resposta do endpoint (recebe os cabeçalhos)
+        versao: Valor que muda sempre que os dados listados mudam
+    
+    Returns:
+        Optional[Response]: 304 Not Modified se o cliente já tem a versão
+            atual; None se a consulta principal deve ser executada
+    """
+    digest = hashlib.sha1(f"{versao!r}|{request.url.query}".encode()).hexdigest()
+    etag = f'W/"{digest}"'
+    cabecalhos = {"ETag": etag, "Cache-Control": LISTAGEM_CACHE_CONTROL}
+    
+    enviadas = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in enviadas.split(",")):
+        return Response(status_code=304, headers=cabecalhos)
+    
+    response.headers.update(cabecalhos)
+    return None
+
+
+class TTLCache:
+    """
+    Cache em memória com TTL e revalidação em segundo plano.
+    
+    Exemplo de uso:
+        >>> cache = TTLCache(ttl=60, stale_ttl=30)
+        >>> resultado = await cache.get_or_compute(
+        ...     (data_inicio, data_fim),
+        ...     lambda: calcular_metricas(data_inicio, data_fim)
+        ... )
+    """
+    
+    def __init__(
+        self,
+        ttl: float = 60,
+        stale_ttl: float = 0,
+        maxsize: int = 256,
+        jitter: float = 0,
+        tags: Iterable[str] = ()
+    ):
+        """
+        Inicializa o cache.
+        
+        Args:
+            ttl: Segundos em que uma entrada é considerada válida
+            stale_ttl: Segundos adicionais em que a entrada expirada ainda é
+                servida enquanto é recalculada em segundo plano
+            maxsize: Quantidade máxima de chaves (as mais antigas saem primeiro)
+            jitter: Variação relativa aleatória do TTL (0.2 = ±20%)
+            tags: Tags para invalidação conjunta via invalidar_tag()
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.jitter = jitter
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._tarefas: Set[asyncio.Task] = set()
+        
+        for tag in tags:
+            _caches_por_tag.setdefault(tag, weakref.WeakSet()).add(self)
+    
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Retorna o valor em cache ou calcula com `compute` (função síncrona).
+        
+        Args:
+            key: Chave do cache (ex: tupla com os filtros da requisição)
+            compute: Função sem argumentos que calcula o valor
+        
+        Returns:
+            Any: Valor em cache ou recém-calculado
+        """
+        entry = self._data.get(key)
+        agora = time.monotonic()
+        
+        if entry is not None:
+            expira_em, valor = entry
+            if agora < expira_em:
+                return valor
+            if agora < expira_em + self.stale_ttl:
+                self._agendar_revalidacao(key, compute)
+                return valor
+        
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Outra requisição pode ter calculado enquanto aguardávamos
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                return entry[1]
+            
+            valor = await run_in_threadpool(compute)
+            self._armazenar(key, valor)
+            return valor
+    
+    def clear(self) -> None:
+        """Remove todas as entradas do cache."""
+        self._data.clear()
+    
+    def _armazenar(self, key: Hashable, valor: Any) -> None:
+        ttl = self.ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self._data[key] = (time.monotonic() + ttl, valor)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            chave_antiga, _ = self._data.popitem(last=False)
+            self._locks.pop(chave_antiga, None)
+    
+    def _agendar_revalidacao(self, key: Hashable, compute: Callable[[], Any]) -> None:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        if lock.locked():
+            return
+        
+        tarefa = asyncio.get_running_loop().create_task(self._revalidar(key, compute, lock))
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+    
+    async def _revalidar(self, key: Hashable, compute: Callable[[], Any], lock: asyncio.Lock) -> None:
+        async with lock:
+            try:
+                valor = await run_in_threadpool(compute)
+                self._armazenar(key, valor)
+            except Exception as e:
+                logger.error(f"Erro ao revalidar cache para {key}: {e}")
@@ -0,0 +1,139 @@
+"""
+Eventos em Tempo Real da API
+
+Repassa notificações do PostgreSQL (LISTEN/NOTIFY) para clientes
+conectados por WebSocket, no lugar do polling das listagens.
+
+Características:
+- Uma única conexão dedicada em LISTEN por canal, compartilhada por
+  todos os assinantes do processo
+- Leitura não bloqueante: o socket da conexão é observado pelo event loop
+  (loop.add_reader) e as notificações são distribuídas em filas asyncio
+- A conexão é aberta no primeiro assinante e fechada quando o último sai
+- Cliente lento não atrasa os demais: com a fila cheia o evento é descartado
+  para aquele cliente
+
+Autor: Financial ETL Framework
+Data: 2026-01-08
+"""
+
+import asyncio
+import logging
+from typing import Optional, Set
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from starlette.concurrency import run_in_threadpool
+
+from ..conn import get_connection
+from ..services.audit_logger import CANAL_DIVERGENCIAS
+
+logger = logging.getLogger(__name__)
+
+
+class CanalNotificacoes:
+    """
+    Assinatura de um canal LISTEN/NOTIFY do PostgreSQL.
+    
+    Cada assinante recebe uma asyncio.Queue com os payloads (str) das
+    notificações. None na fila indica que a conexão foi perdida e o
+    assinante deve encerrar (o cliente reconecta).
+    
+    Exemplos de uso:
+        >>> canal = CanalNotificacoes('divergencia_new')
+        >>> fila = await canal.assinar()
+        >>> payload = await fila.get()
+        >>> canal.cancelar(fila)
+    """
+    
+    def __init__(self, canal: str, maxsize: int = 100):
+        """
+        Args:
+            canal: Nome do canal NOTIFY
+            maxsize: Eventos pendentes por assinante antes de descartar
+        """
+        self.canal = canal
+        self.maxsize = maxsize
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._assinantes: Set[asyncio.Queue] = set()
+        self._lock = asyncio.Lock()
+    
+    async def assinar(self) -> asyncio.Queue:
+        """
+        Registra um assinante, abrindo a conexão em LISTEN se necessário.
+        
+        Returns:
+            asyncio.Queue: Fila com os payloads recebidos
+        
+        Raises:
+            psycopg2.Error: Se não for possível conectar ao banco
+        """
+        fila: asyncio.Queue = asyncio.Queue(maxsize=self.maxsize)
+        async with self._lock:
+            if self._conn is None:
+                await self._iniciar()
+            self._assinantes.add(fila)
+        return fila
+    
+    def cancelar(self, fila: asyncio.Queue) -> None:
+        """Remove o assinante; sem assinantes, a conexão é fechada."""
+        self._assinantes.discard(fila)
+        if not self._assinantes:
+            self.fechar()
+    
+    def fechar(self) -> None:
+        """Para de observar o socket e fecha a conexão dedicada."""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            self._loop.remove_reader(conn.fileno())
+        except Exception:
+            pass
+        conn.close()
+        logger.info(f"Canal {self.canal}: LISTEN encerrado")
+    
+    async def _iniciar(self) -> None:
+        """Abre a conexão dedicada e executa LISTEN no canal."""
+        conn = await run_in_threadpool(get_connection)
+        # Notificações só chegam fora de transação aberta
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.canal}")
+        
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(conn.fileno(), self._ler_notificacoes)
+        self._conn = conn
+        logger.info(f"Canal {self.canal}: LISTEN iniciado")
+    
+    def _ler_notificacoes(self) -> None:
+        """Callback do event loop: distribui as notificações recebidas."""
+        conn = self._conn
+        if conn is None:
+            return
+        
+        try:
+            conn.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Canal {self.canal}: conexao perdida: {e}")
+            for fila in list(self._assinantes):
+                self._entregar(fila, None)
+            self._assinantes.clear()
+            self.fechar()
+            return
+        
+        while conn.notifies:
+            notificacao = conn.notifies.pop(0)
+            for fila in list(self._assinantes):
+                self._entregar(fila, notificacao.payload)
+    
+    def _entregar(self, fila: asyncio.Queue, payload: Optional[str]) -> None:
+        """Coloca o payload na fila do assinante, descartando se estiver cheia."""
+        try:
+            fila.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.warning(f"Canal {self.canal}: assinante lento, evento descartado")
+
+
+canal_divergencias = CanalNotificacoes(CANAL_DIVERGENCIAS)
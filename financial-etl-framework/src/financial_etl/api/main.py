@@ -16,16 +16,19 @@ Data: 2026-01-08
 Versão: 1.0.0
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Query, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from typing import List, Optional
 from datetime import datetime, date
 import logging
+import os
+import time
 
-from ..conn import db_connection
-from ..services import AuditLogger, DivergenceProcessor, NotificationService
+from ..conn import db_connection, close_pool, executar_preparado, tempo_sql
 from .routers import divergences, audit, reports
+from .cache import TTLCache
+from .eventos import canal_divergencias
 
 # Configuração de logging
 logging.basicConfig(
@@ -34,6 +37,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Cache das métricas resumidas (consultadas com frequência pelo Looker Studio)
+METRICAS_CACHE_TTL = int(os.getenv('METRICAS_CACHE_TTL', '60'))
+METRICAS_CACHE_STALE = int(os.getenv('METRICAS_CACHE_STALE', '30'))
+metricas_cache = TTLCache(
+    ttl=METRICAS_CACHE_TTL,
+    stale_ttl=METRICAS_CACHE_STALE,
+    tags=('metricas',)
+)
+
 # Inicialização da aplicação FastAPI
 app = FastAPI(
     title="Financial ETL API",
@@ -45,7 +57,9 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    # orjson serializa os payloads de métricas bem mais rápido que o json padrão
+    default_response_class=ORJSONResponse
 )
 
 # Configuração CORS para permitir acesso do Looker Studio
@@ -61,6 +75,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def adicionar_server_timing(request: Request, call_next):
+    """
+    Adiciona o cabeçalho Server-Timing com o tempo gasto em SQL (db), no
+    restante do processamento, incluindo a serialização (app), e o total.
+    
+    O tempo de SQL é somado pelo CursorCronometrado das conexões; a leitura
+    fica visível na aba Network do navegador e em qualquer proxy HTTP.
+    """
+    acumulador = [0]
+    token = tempo_sql.set(acumulador)
+    inicio = time.perf_counter_ns()
+    try:
+        response = await call_next(request)
+    finally:
+        tempo_sql.reset(token)
+    
+    total_ms = (time.perf_counter_ns() - inicio) / 1_000_000
+    db_ms = acumulador[0] / 1_000_000
+    response.headers["Server-Timing"] = (
+        f"db;dur={db_ms:.1f}, app;dur={max(total_ms - db_ms, 0):.1f}, total;dur={total_ms:.1f}"
+    )
+    return response
+
+
 # Inclui routers das diferentes seções
 app.include_router(
     divergences.router,
@@ -79,6 +119,13 @@ app.include_router(
 )
 
 
+@app.on_event("shutdown")
+async def fechar_pool_conexoes():
+    """Devolve as conexões do pool e fecha a conexão em LISTEN ao encerrar."""
+    canal_divergencias.fechar()
+    close_pool()
+
+
 @app.get("/", tags=["Health"])
 async def root():
     """
@@ -91,13 +138,13 @@ async def root():
         "service": "Financial ETL API",
         "version": "1.0.0",
         "status": "operational",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now(),
         "documentation": "/api/docs"
     }
 
 
 @app.get("/api/health", tags=["Health"])
-async def health_check():
+def health_check():
     """
     Verificação de saúde da API e conexão com banco de dados.
     
@@ -107,7 +154,7 @@ async def health_check():
     status_checks = {
         "api": "healthy",
         "database": "unknown",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now()
     }
     
     # Testa conexão com banco de dados
@@ -134,6 +181,7 @@ async def health_check():
 
 @app.get("/api/v1/metricas/resumo", tags=["Métricas"])
 async def obter_metricas_resumo(
+    response: Response,
     data_inicio: Optional[date] = Query(None, description="Data início filtro"),
     data_fim: Optional[date] = Query(None, description="Data fim filtro")
 ):
@@ -141,7 +189,9 @@ async def obter_metricas_resumo(
     Retorna métricas resumidas do sistema para dashboards.
     
     Endpoint otimizado para integração com Looker Studio e outras
-    ferramentas de BI.
+    ferramentas de BI. A resposta fica em cache por METRICAS_CACHE_TTL
+    segundos por período consultado; após expirar, ainda é servida por
+    METRICAS_CACHE_STALE segundos enquanto é recalculada em segundo plano.
     
     Query Parameters:
         data_inicio: Filtrar métricas a partir desta data
@@ -155,52 +205,88 @@ async def obter_metricas_resumo(
         - tempo_medio_resolucao
         - operacoes_por_status
     """
+    response.headers["Cache-Control"] = (
+        f"public, max-age={METRICAS_CACHE_TTL}, "
+        f"stale-while-revalidate={METRICAS_CACHE_STALE}"
+    )
+    return await metricas_cache.get_or_compute(
+        (data_inicio, data_fim),
+        lambda: _calcular_metricas_resumo(data_inicio, data_fim)
+    )
+
+
+def _calcular_metricas_resumo(data_inicio: Optional[date], data_fim: Optional[date]) -> dict:
+    """
+    Consulta o banco e monta a resposta de /api/v1/metricas/resumo.
+    
+    Raises:
+        HTTPException: 500 em caso de erro na consulta
+    """
     try:
         with db_connection() as conn:
             cursor = conn.cursor()
             
-            # Condição de filtro por data
+            # Condição de filtro por data (uma variante preparada para cada caso)
             date_condition = ""
+            operacoes_condition = ""
             params = []
+            statement = "metricas_resumo"
             if data_inicio and data_fim:
-                date_condition = "WHERE detectado_em BETWEEN %s AND %s"
+                date_condition = "WHERE detectado_em BETWEEN $1 AND $2"
+                operacoes_condition = "WHERE timestamp_inicio BETWEEN $3 AND $4"
                 params = [data_inicio, data_fim]
+                statement = "metricas_resumo_periodo"
             
-            # Divergências por tipo
-            query_tipos = f"""
-            SELECT 
-                tipo_divergencia,
-                COUNT(*) as total,
-                COUNT(CASE WHEN status_processamento = 'AUTO_APPLIED' THEN 1 END) as resolvidas
-            FROM audit.divergencias_processadas
-            {date_condition}
-            GROUP BY tipo_divergencia
-            """
-            cursor.execute(query_tipos, params)
-            divergencias_por_tipo = [
-                {
-                    "tipo": row[0],
-                    "total": row[1],
-                    "resolvidas": row[2],
-                    "taxa_resolucao": round((row[2] / row[1] * 100) if row[1] > 0 else 0, 2)
-                }
-                for row in cursor.fetchall()
-            ]
-            
-            # Métricas gerais
-            query_geral = f"""
+            # Uma única consulta: a CTE de divergências é lida uma vez e
+            # alimenta as métricas gerais e o agrupamento por tipo; as
+            # operações por status vêm agregadas em JSON na mesma linha
+            query = f"""
+            WITH div AS (
+                SELECT tipo_divergencia, status_processamento,
+                       detectado_em, processado_em
+                FROM audit.divergencias_processadas
+                {date_condition}
+            ),
+            por_tipo AS (
+                SELECT 
+                    tipo_divergencia,
+                    COUNT(*) as total,
+                    COUNT(CASE WHEN status_processamento = 'AUTO_APPLIED' THEN 1 END) as resolvidas
+                FROM div
+                GROUP BY tipo_divergencia
+            ),
+            operacoes AS (
+                SELECT 
+                    status,
+                    COUNT(*) as total
+                FROM audit.operacoes
+                {operacoes_condition}
+                GROUP BY status
+            )
             SELECT 
                 COUNT(*) as total,
-                AVG(EXTRACT(DAY FROM processado_em - detectado_em)) as tempo_medio_dias,
-                COUNT(CASE WHEN status_processamento IN ('AUTO_APPLIED', 'APPROVED') THEN 1 END) as resolvidas
-            FROM audit.divergencias_processadas
-            {date_condition}
+                AVG(EXTRACT(DAY FROM processado_em - detectado_em))::float8 as tempo_medio_dias,
+                COUNT(CASE WHEN status_processamento IN ('AUTO_APPLIED', 'APPROVED') THEN 1 END) as resolvidas,
+                (
+                    SELECT COALESCE(json_agg(json_build_object(
+                        'tipo', tipo_divergencia, 'total', total, 'resolvidas', resolvidas
+                    )), '[]'::json)
+                    FROM por_tipo
+                ) as por_tipo,
+                (
+                    SELECT COALESCE(json_agg(json_build_object(
+                        'status', status, 'total', total
+                    )), '[]'::json)
+                    FROM operacoes
+                ) as operacoes
+            FROM div
             """
-            cursor.execute(query_geral, params)
+            # Prepared statement por conexão do pool: parse/plan só na 1ª vez
+            executar_preparado(cursor, statement, query, params * 2)
             row = cursor.fetchone()
             
             total_divergencias = row[0]
-            tempo_medio_dias = float(row[1]) if row[1] else 0.0
+            tempo_medio_dias = row[1] or 0.0
             total_resolvidas = row[2]
             
             taxa_resolucao = (
@@ -208,25 +294,26 @@ async def obter_metricas_resumo(
                 if total_divergencias > 0 else 0.0
             )
             
-            # Operações por status
-            query_operacoes = f"""
-            SELECT 
-                status,
-                COUNT(*) as total
-            FROM audit.operacoes
-            {date_condition.replace('detectado_em', 'timestamp_inicio')}
-            GROUP BY status
-            """
-            cursor.execute(query_operacoes, params)
-            operacoes_por_status = [
-                {"status": row[0], "total": row[1]}
-                for row in cursor.fetchall()
+            # Divergências por tipo
+            divergencias_por_tipo = [
+                {
+                    "tipo": item["tipo"],
+                    "total": item["total"],
+                    "resolvidas": item["resolvidas"],
+                    "taxa_resolucao": round(
+                        (item["resolvidas"] / item["total"] * 100) if item["total"] > 0 else 0, 2
+                    )
+                }
+                for item in row[3]
             ]
             
+            # Operações por status
+            operacoes_por_status = row[4]
+            
             return {
                 "periodo": {
-                    "data_inicio": data_inicio.isoformat() if data_inicio else None,
-                    "data_fim": data_fim.isoformat() if data_fim else None
+                    "data_inicio": data_inicio,
+                    "data_fim": data_fim
                 },
                 "metricas_gerais": {
                     "total_divergencias": total_divergencias,
@@ -236,7 +323,7 @@ async def obter_metricas_resumo(
                 },
                 "divergencias_por_tipo": divergencias_por_tipo,
                 "operacoes_por_status": operacoes_por_status,
-                "timestamp_consulta": datetime.now().isoformat()
+                "timestamp_consulta": datetime.now()
             }
             
     except Exception as e:
@@ -253,11 +340,11 @@ async def global_exception_handler(request, exc):
     Handler global para exceções não tratadas.
     """
     logger.error(f"Erro nao tratado: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={
             "detail": "Erro interno do servidor",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
     )
 
@@ -3,25 +3,83 @@ Router de Auditoria
 
 Endpoints para consulta de histórico e rastreabilidade de operações.
 
+Os handlers são síncronos (def) e rodam no threadpool do FastAPI, sem
+bloquear o event loop durante as consultas. A listagem de sessões fica em
+cache (TTLCache), calculada também no threadpool.
+
 Autor: Financial ETL Framework
 Data: 2026-01-08
 """
 
-from fastapi import APIRouter, HTTPException, Query, status
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse
 from typing import List, Optional
 from datetime import date, datetime
 from pydantic import BaseModel
 import logging
+import os
 
-from ...conn import db_connection
+from ...conn import db_connection, executar_preparado, variantes_consulta
+from ..cache import TTLCache, resposta_condicional
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Cache da listagem de sessões, atualizada só ao fim de cada processamento
+SESSOES_CACHE_TTL = int(os.getenv('SESSOES_CACHE_TTL', '60'))
+sessoes_cache = TTLCache(
+    ttl=SESSOES_CACHE_TTL,
+    maxsize=64,
+    jitter=0.2,
+    tags=('metricas',)
+)
+
+# Campos de OperacaoResponse, na ordem do SELECT
+CAMPOS_OPERACAO = (
+    'id', 'tipo_operacao', 'descricao', 'usuario', 'origem',
+    'tabela_afetada', 'registros_afetados', 'timestamp_inicio',
+    'timestamp_fim', 'duracao_segundos', 'status'
+)
+
+# Versão dos dados listados, usada na ETag
+VERSAO_OPERACOES = """
+            SELECT COUNT(*), MAX(timestamp_inicio), MAX(timestamp_fim)
+            FROM audit.operacoes
+            """
+
+# Variantes pré-geradas da listagem, uma por combinação de filtros
+# (usuario, tabela, status, data_inicio, data_fim, keyset)
+CONSULTAS_OPERACOES = variantes_consulta(
+    'listar_operacoes',
+    """
+            SELECT 
+                id, tipo_operacao, descricao, usuario, origem,
+                tabela_afetada, registros_afetados, timestamp_inicio,
+                timestamp_fim, duracao_segundos::float8, status
+            FROM audit.operacoes
+            WHERE {where}
+            ORDER BY timestamp_inicio DESC, id DESC
+            LIMIT $ OFFSET $
+            """,
+    [
+        "usuario = $",
+        "tabela_afetada = $",
+        "status = $",
+        "timestamp_inicio >= $",
+        "timestamp_inicio <= $",
+        "(timestamp_inicio, id) < ($, $)",
+    ]
+)
 
 
 class OperacaoResponse(BaseModel):
-    """Modelo de resposta para operação de auditoria."""
+    """
+    Modelo de resposta para operação de auditoria.
+    
+    Usado apenas no schema OpenAPI: as linhas são devolvidas como dict
+    (response_model=None), sem revalidação Pydantic de cada item.
+    """
     id: int
     tipo_operacao: str
     descricao: str
@@ -37,86 +95,64 @@ class OperacaoResponse(BaseModel):
 
 @router.get(
     "/operacoes",
-    response_model=List[OperacaoResponse],
+    response_model=None,
+    responses={200: {"model": List[OperacaoResponse]}},
     summary="Listar operações",
     description="Retorna histórico de operações executadas no sistema"
 )
-async def listar_operacoes(
+def listar_operacoes(
+    request: Request,
+    response: Response,
     usuario: Optional[str] = Query(None, description="Filtrar por usuário"),
     tabela: Optional[str] = Query(None, description="Filtrar por tabela afetada"),
     status: Optional[str] = Query(None, description="Filtrar por status"),
     data_inicio: Optional[date] = Query(None, description="Data início"),
     data_fim: Optional[date] = Query(None, description="Data fim"),
     limit: int = Query(100, le=1000),
-    offset: int = Query(0)
+    offset: int = Query(0),
+    after_ts: Optional[datetime] = Query(
+        None,
+        description="Paginação por keyset: timestamp_inicio do último item da página anterior"
+    ),
+    after_id: Optional[int] = Query(
+        None,
+        description="Paginação por keyset: id do último item da página anterior"
+    )
 ):
     """
     Lista histórico de operações com filtros.
     
-    Útil para auditoria e rastreamento de ações no sistema.
+    Útil para auditoria e rastreamento de ações no sistema. Para páginas
+    profundas, prefira after_ts/after_id (keyset) ao offset.
     """
     try:
         with db_connection() as conn:
             cursor = conn.cursor()
             
-            conditions = []
-            params = []
-            
-            if usuario:
-                conditions.append("usuario = %s")
-                params.append(usuario)
-            
-            if tabela:
-                conditions.append("tabela_afetada = %s")
-                params.append(tabela)
-            
-            if status:
-                conditions.append("status = %s")
-                params.append(status)
-            
-            if data_inicio:
-                conditions.append("timestamp_inicio >= %s")
-                params.append(data_inicio)
-            
-            if data_fim:
-                conditions.append("timestamp_inicio <= %s")
-                params.append(data_fim)
-            
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            # ETag: responde 304 se o cliente já tem esta versão
+            cursor.execute(VERSAO_OPERACOES)
+            nao_modificado = resposta_condicional(request, response, cursor.fetchone())
+            if nao_modificado is not None:
+                return nao_modificado
+            
+            # Keyset: continua após o último item, sem varrer o OFFSET
+            usar_keyset = after_ts is not None and after_id is not None
+            filtros = (
+                (usuario, [usuario]),
+                (tabela, [tabela]),
+                (status, [status]),
+                (data_inicio, [data_inicio]),
+                (data_fim, [data_fim]),
+                (usar_keyset, [after_ts, after_id]),
+            )
+            statement, query = CONSULTAS_OPERACOES[tuple(bool(ativo) for ativo, _ in filtros)]
+            params = [valor for ativo, valores in filtros if ativo for valor in valores]
             params.extend([limit, offset])
             
-            query = f"""
-            SELECT 
-                id, tipo_operacao, descricao, usuario, origem,
-                tabela_afetada, registros_afetados, timestamp_inicio,
-                timestamp_fim, duracao_segundos, status
-            FROM audit.operacoes
-            WHERE {where_clause}
-            ORDER BY timestamp_inicio DESC
-            LIMIT %s OFFSET %s
-            """
-            
-            cursor.execute(query, params)
+            executar_preparado(cursor, statement, query, params)
             rows = cursor.fetchall()
             
-            operacoes = [
-                OperacaoResponse(
-                    id=row[0],
-                    tipo_operacao=row[1],
-                    descricao=row[2],
-                    usuario=row[3],
-                    origem=row[4],
-                    tabela_afetada=row[5],
-                    registros_afetados=row[6],
-                    timestamp_inicio=row[7],
-                    timestamp_fim=row[8],
-                    duracao_segundos=float(row[9]) if row[9] else None,
-                    status=row[10]
-                )
-                for row in rows
-            ]
-            
-            return operacoes
+            return [dict(zip(CAMPOS_OPERACAO, row)) for row in rows]
             
     except Exception as e:
         logger.error(f"Erro ao listar operacoes: {e}")
@@ -138,6 +174,21 @@ async def listar_sessoes(
 ):
     """
     Lista sessões de processamento diário e manual.
+    
+    Em cache por SESSOES_CACHE_TTL segundos (±20%) por combinação de filtros.
+    """
+    return await sessoes_cache.get_or_compute(
+        (tipo_sessao, status, limit),
+        lambda: _consultar_sessoes(tipo_sessao, status, limit)
+    )
+
+
+def _consultar_sessoes(tipo_sessao: Optional[str], status_sessao: Optional[str], limit: int) -> list:
+    """
+    Consulta o banco e monta a resposta de /sessoes.
+    
+    Raises:
+        HTTPException: 500 em caso de erro na consulta
     """
     try:
         with db_connection() as conn:
@@ -150,9 +201,9 @@ async def listar_sessoes(
                 conditions.append("tipo_sessao = %s")
                 params.append(tipo_sessao)
             
-            if status:
+            if status_sessao:
                 conditions.append("status = %s")
-                params.append(status)
+                params.append(status_sessao)
             
             where_clause = " AND ".join(conditions) if conditions else "1=1"
             params.append(limit)
@@ -176,8 +227,8 @@ async def listar_sessoes(
                 {
                     "id": row[0],
                     "tipo_sessao": row[1],
-                    "inicio_processamento": row[2].isoformat() if row[2] else None,
-                    "fim_processamento": row[3].isoformat() if row[3] else None,
+                    "inicio_processamento": row[2],
+                    "fim_processamento": row[3],
                     "duracao_total_segundos": row[4],
                     "status": row[5],
                     "metricas": {
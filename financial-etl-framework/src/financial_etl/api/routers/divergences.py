@@ -3,26 +3,86 @@ Router de Divergências
 
 Endpoints para gestão de divergências detectadas pelo sistema.
 
+Os handlers que acessam o banco são síncronos (def): o FastAPI os executa
+no threadpool, sem bloquear o event loop durante as consultas psycopg2.
+Novas divergências também são enviadas em tempo real pelo WebSocket /ws.
+
 Autor: Financial ETL Framework
 Data: 2026-01-08
 """
 
-from fastapi import APIRouter, HTTPException, Query, status, Body
+from fastapi import (
+    APIRouter, HTTPException, Query, Request, Response, status, Body,
+    WebSocket, WebSocketDisconnect
+)
+from fastapi.responses import ORJSONResponse
 from typing import List, Optional
 from datetime import date, datetime
 from pydantic import BaseModel, Field
 import logging
 
-from ...conn import db_connection
+import psycopg2
+from psycopg2.extras import execute_values
+
+from ...conn import db_connection, executar_preparado, variantes_consulta
 from ...services import DivergenceProcessor, Divergencia
+from ..cache import invalidar_tag, resposta_condicional
+from ..eventos import canal_divergencias
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Campos de DivergenciaResponse, na ordem do SELECT
+CAMPOS_DIVERGENCIA = (
+    'id', 'idnfsexterno', 'tipo_divergencia', 'campo_afetado',
+    'valor_anterior', 'valor_sugerido', 'valor_aplicado',
+    'competencia', 'status_processamento', 'confidence_score',
+    'detectado_em', 'processado_em'
+)
+
+# Colunas NUMERIC já saem como float8: o driver entrega float/None
+# em vez de Decimal, sem conversão linha a linha em Python
+COLUNAS_DIVERGENCIA = """
+                id, idnfsexterno, tipo_divergencia, campo_afetado,
+                valor_anterior::float8, valor_sugerido::float8, valor_aplicado::float8,
+                competencia, status_processamento, confidence_score::float8,
+                detectado_em, processado_em"""
+
+# Versão dos dados listados, usada na ETag
+VERSAO_DIVERGENCIAS = """
+            SELECT COUNT(*), MAX(detectado_em), MAX(processado_em)
+            FROM audit.divergencias_processadas
+            """
+
+# Variantes pré-geradas da listagem, uma por combinação de filtros
+# (status, tipo, data_inicio, data_fim, keyset)
+CONSULTAS_LISTAR = variantes_consulta(
+    'listar_divergencias',
+    f"""
+            SELECT {COLUNAS_DIVERGENCIA}
+            FROM audit.divergencias_processadas
+            WHERE {{where}}
+            ORDER BY detectado_em DESC, id DESC
+            LIMIT $ OFFSET $
+            """,
+    [
+        "status_processamento = $",
+        "tipo_divergencia = $",
+        "detectado_em >= $",
+        "detectado_em <= $",
+        "(detectado_em, id) < ($, $)",
+    ]
+)
 
 
 class DivergenciaResponse(BaseModel):
-    """Modelo de resposta para divergência."""
+    """
+    Modelo de resposta para divergência.
+    
+    Documenta a resposta no OpenAPI; as rotas devolvem dicts montados do
+    cursor com response_model=None.
+    """
     id: int
     idnfsexterno: str
     tipo_divergencia: str
@@ -59,11 +119,14 @@ class ProcessarDivergenciasRequest(BaseModel):
 
 @router.get(
     "",
-    response_model=List[DivergenciaResponse],
+    response_model=None,
+    responses={200: {"model": List[DivergenciaResponse]}},
     summary="Listar divergências",
     description="Retorna lista de divergências detectadas com filtros opcionais"
 )
-async def listar_divergencias(
+def listar_divergencias(
+    request: Request,
+    response: Response,
     status_processamento: Optional[str] = Query(
         None,
         description="Filtrar por status (DETECTED, APPROVED, REJECTED, AUTO_APPLIED)"
@@ -81,73 +144,50 @@ async def listar_divergencias(
         description="Data fim (detectado_em <= data)"
     ),
     limit: int = Query(100, le=1000, description="Limite de resultados"),
-    offset: int = Query(0, description="Offset para paginação")
+    offset: int = Query(0, description="Offset para paginação"),
+    after_ts: Optional[datetime] = Query(
+        None,
+        description="Paginação por keyset: detectado_em do último item da página anterior"
+    ),
+    after_id: Optional[int] = Query(
+        None,
+        description="Paginação por keyset: id do último item da página anterior"
+    )
 ):
     """
     Lista divergências com filtros e paginação.
     
-    Útil para dashboards e interfaces de aprovação.
+    Útil para dashboards e interfaces de aprovação. Para páginas profundas,
+    prefira after_ts/after_id (keyset) ao offset.
     """
     try:
         with db_connection() as conn:
             cursor = conn.cursor()
             
-            conditions = []
-            params = []
-            
-            if status_processamento:
-                conditions.append("status_processamento = %s")
-                params.append(status_processamento)
-            
-            if tipo_divergencia:
-                conditions.append("tipo_divergencia = %s")
-                params.append(tipo_divergencia)
+            # Dados inalterados desde a última consulta do cliente: 304
+            # sem executar a listagem nem serializar a resposta
+            cursor.execute(VERSAO_DIVERGENCIAS)
+            nao_modificado = resposta_condicional(request, response, cursor.fetchone())
+            if nao_modificado is not None:
+                return nao_modificado
             
-            if data_inicio:
-                conditions.append("detectado_em >= %s")
-                params.append(data_inicio)
-            
-            if data_fim:
-                conditions.append("detectado_em <= %s")
-                params.append(data_fim)
-            
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            # Keyset: continua após o último item, sem varrer o OFFSET
+            usar_keyset = after_ts is not None and after_id is not None
+            filtros = (
+                (status_processamento, [status_processamento]),
+                (tipo_divergencia, [tipo_divergencia]),
+                (data_inicio, [data_inicio]),
+                (data_fim, [data_fim]),
+                (usar_keyset, [after_ts, after_id]),
+            )
+            statement, query = CONSULTAS_LISTAR[tuple(bool(ativo) for ativo, _ in filtros)]
+            params = [valor for ativo, valores in filtros if ativo for valor in valores]
             params.extend([limit, offset])
             
-            query = f"""
-            SELECT 
-                id, idnfsexterno, tipo_divergencia, campo_afetado,
-                valor_anterior, valor_sugerido, valor_aplicado,
-                competencia, status_processamento, confidence_score,
-                detectado_em, processado_em
-            FROM audit.divergencias_processadas
-            WHERE {where_clause}
-            ORDER BY detectado_em DESC
-            LIMIT %s OFFSET %s
-            """
-            
-            cursor.execute(query, params)
+            executar_preparado(cursor, statement, query, params)
             rows = cursor.fetchall()
             
-            divergencias = [
-                DivergenciaResponse(
-                    id=row[0],
-                    idnfsexterno=row[1],
-                    tipo_divergencia=row[2],
-                    campo_afetado=row[3],
-                    valor_anterior=float(row[4]) if row[4] else None,
-                    valor_sugerido=float(row[5]) if row[5] else None,
-                    valor_aplicado=float(row[6]) if row[6] else None,
-                    competencia=row[7],
-                    status_processamento=row[8],
-                    confidence_score=float(row[9]) if row[9] else None,
-                    detectado_em=row[10],
-                    processado_em=row[11]
-                )
-                for row in rows
-            ]
-            
-            return divergencias
+            return [dict(zip(CAMPOS_DIVERGENCIA, row)) for row in rows]
             
     except Exception as e:
         logger.error(f"Erro ao listar divergencias: {e}")
@@ -157,24 +197,54 @@ async def listar_divergencias(
         )
 
 
+@router.websocket("/ws")
+async def acompanhar_divergencias(websocket: WebSocket):
+    """
+    Envia cada nova divergência registrada assim que é confirmada no banco.
+    
+    Alternativa ao polling de GET /divergencias?status_processamento=DETECTED:
+    o AuditLogger publica um NOTIFY no canal divergencia_new a cada registro e
+    o payload JSON (id, idnfsexterno, tipo_divergencia, campo_afetado,
+    competencia) é repassado como mensagem de texto. Se a conexão com o banco
+    cair, o WebSocket é fechado com 1011 e o cliente deve reconectar.
+    """
+    await websocket.accept()
+    
+    try:
+        fila = await canal_divergencias.assinar()
+    except Exception as e:
+        logger.error(f"Erro ao assinar canal de divergencias: {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+    
+    try:
+        while True:
+            payload = await fila.get()
+            if payload is None:
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+                break
+            await websocket.send_text(payload)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        canal_divergencias.cancelar(fila)
+
+
 @router.get(
     "/{divergencia_id}",
-    response_model=DivergenciaResponse,
+    response_model=None,
+    responses={200: {"model": DivergenciaResponse}},
     summary="Obter divergência específica",
     description="Retorna detalhes completos de uma divergência pelo ID"
 )
-async def obter_divergencia(divergencia_id: int):
+def obter_divergencia(divergencia_id: int):
     """Obtém detalhes de uma divergência específica."""
     try:
         with db_connection() as conn:
             cursor = conn.cursor()
             
-            query = """
-            SELECT 
-                id, idnfsexterno, tipo_divergencia, campo_afetado,
-                valor_anterior, valor_sugerido, valor_aplicado,
-                competencia, status_processamento, confidence_score,
-                detectado_em, processado_em
+            query = f"""
+            SELECT {COLUNAS_DIVERGENCIA}
             FROM audit.divergencias_processadas
             WHERE id = %s
             """
@@ -188,20 +258,7 @@ async def obter_divergencia(divergencia_id: int):
                     detail=f"Divergencia {divergencia_id} nao encontrada"
                 )
             
-            return DivergenciaResponse(
-                id=row[0],
-                idnfsexterno=row[1],
-                tipo_divergencia=row[2],
-                campo_afetado=row[3],
-                valor_anterior=float(row[4]) if row[4] else None,
-                valor_sugerido=float(row[5]) if row[5] else None,
-                valor_aplicado=float(row[6]) if row[6] else None,
-                competencia=row[7],
-                status_processamento=row[8],
-                confidence_score=float(row[9]) if row[9] else None,
-                detectado_em=row[10],
-                processado_em=row[11]
-            )
+            return dict(zip(CAMPOS_DIVERGENCIA, row))
             
     except HTTPException:
         raise
@@ -218,7 +275,7 @@ async def obter_divergencia(divergencia_id: int):
     summary="Processar divergências",
     description="Detecta e processa divergências no período especificado"
 )
-async def processar_divergencias(request: ProcessarDivergenciasRequest):
+def processar_divergencias(request: ProcessarDivergenciasRequest):
     """
     Executa detecção e processamento de divergências.
     
@@ -245,6 +302,9 @@ async def processar_divergencias(request: ProcessarDivergenciasRequest):
                 usuario=request.usuario
             )
             
+            # Métricas e sessões em cache refletem o estado anterior
+            invalidar_tag('metricas')
+            
             return {
                 "status": "completed",
                 "periodo": {
@@ -253,7 +313,7 @@ async def processar_divergencias(request: ProcessarDivergenciasRequest):
                 },
                 "modo_processamento": request.modo,
                 "resultado": resultado,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
             
     except Exception as e:
@@ -269,11 +329,16 @@ async def processar_divergencias(request: ProcessarDivergenciasRequest):
     summary="Aprovar correções",
     description="Aprova e aplica correções para divergências selecionadas"
 )
-async def aprovar_correcoes(request: AprovarCorrecaoRequest):
+def aprovar_correcoes(request: AprovarCorrecaoRequest):
     """
     Aprova e aplica correções para divergências pendentes.
     
-    Permite aprovação em lote e customização de valores.
+    Permite aprovação em lote e customização de valores. O lote inteiro é
+    aplicado em uma única transação com poucos round-trips: um SELECT das
+    divergências (travadas com FOR UPDATE), um UPDATE ... FROM (VALUES ...)
+    por campo afetado e um UPDATE em massa dos status, registrados em uma
+    única operação de auditoria. Cada UPDATE por campo roda em um SAVEPOINT:
+    se um deles falhar, só as divergências daquele campo voltam como erro.
     """
     try:
         with db_connection() as conn:
@@ -281,90 +346,122 @@ async def aprovar_correcoes(request: AprovarCorrecaoRequest):
             audit = AuditLogger(conn)
             cursor = conn.cursor()
             
-            resultados = []
+            op_id = audit.iniciar_operacao(
+                tipo_operacao='BULK_UPDATE',
+                descricao=f'Aprovacao manual: {len(request.divergencia_ids)} divergencias',
+                usuario=request.usuario,
+                origem='API',
+                tabela_afetada='byd.controladoria',
+                filtros_aplicados={'divergencia_ids': request.divergencia_ids}
+            )
             
-            for div_id in request.divergencia_ids:
-                try:
-                    # Obtém dados da divergência
-                    cursor.execute(
-                        """
-                        SELECT idnfsexterno, tipo_divergencia, campo_afetado,
-                               valor_sugerido
-                        FROM audit.divergencias_processadas
-                        WHERE id = %s AND status_processamento = 'DETECTED'
-                        """,
-                        (div_id,)
-                    )
-                    row = cursor.fetchone()
-                    
-                    if not row:
-                        resultados.append({
-                            "divergencia_id": div_id,
-                            "status": "erro",
-                            "mensagem": "Divergencia nao encontrada ou ja processada"
-                        })
-                        continue
-                    
-                    idnfsexterno, tipo_div, campo, valor_sugerido = row
+            try:
+                # Obtém todas as divergências pendentes do lote de uma vez
+                cursor.execute(
+                    """
+                    SELECT id, idnfsexterno, campo_afetado, valor_sugerido
+                    FROM audit.divergencias_processadas
+                    WHERE id = ANY(%s) AND status_processamento = 'DETECTED'
+                    FOR UPDATE
+                    """,
+                    (list(request.divergencia_ids),)
+                )
                     
+                # Agrupa por campo: o nome da coluna não pode ser parâmetro
+                valores_por_campo = {}
+                ids_por_campo = {}
+                aplicados = {}
+                for div_id, idnfsexterno, campo, valor_sugerido in cursor.fetchall():
                     # Define valor a aplicar
                     valor_aplicar = (
                         request.valor_customizado
                         if request.valor_customizado is not None
                         else valor_sugerido
                     )
+                    valores_por_campo.setdefault(campo, []).append((idnfsexterno, valor_aplicar))
+                    ids_por_campo.setdefault(campo, []).append(div_id)
+                    aplicados[div_id] = valor_aplicar
                     
-                    # Inicia operação auditada
-                    op_id = audit.iniciar_operacao(
-                        tipo_operacao='UPDATE',
-                        descricao=f'Aprovacao manual: {tipo_div}',
-                        usuario=request.usuario,
-                        origem='API',
-                        tabela_afetada='byd.controladoria'
-                    )
+                # Aplica correções: um UPDATE por campo afetado, cada um em
+                # um SAVEPOINT. Um grupo com erro é desfeito sozinho e não
+                # deixa a transação abortada para os grupos seguintes
+                falhas = {}
+                for campo, valores in valores_por_campo.items():
+                    cursor.execute("SAVEPOINT aprovar_campo")
+                    try:
+                        execute_values(
+                            cursor,
+                            f"""
+                            UPDATE byd.controladoria c
+                            SET {campo} = v.val
+                            FROM (VALUES %s) AS v(idnfsexterno, val)
+                            WHERE c.idnfsexterno = v.idnfsexterno
+                            """,
+                            valores
+                        )
+                    except psycopg2.Error as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT aprovar_campo")
+                        logger.warning(f"Falha ao aplicar correcoes em {campo}: {e}")
+                        for div_id in ids_por_campo[campo]:
+                            falhas[div_id] = f"Erro ao atualizar {campo}: {str(e).strip()}"
+                            del aplicados[div_id]
+                    else:
+                        cursor.execute("RELEASE SAVEPOINT aprovar_campo")
                     
-                    # Aplica correção
-                    cursor.execute(
-                        f"""
-                        UPDATE byd.controladoria
-                        SET {campo} = %s
-                        WHERE idnfsexterno = %s
-                        """,
-                        (valor_aplicar, idnfsexterno)
-                    )
+                # Atualiza status de todas as divergências aprovadas
+                audit.atualizar_status_divergencia_batch(
+                    list(aplicados.items()),
+                    novo_status='APPROVED',
+                    processado_por=request.usuario
+                )
                     
-                    # Atualiza status da divergência
-                    audit.atualizar_status_divergencia(
-                        divergencia_id=div_id,
-                        novo_status='APPROVED',
-                        valor_aplicado=valor_aplicar,
-                        processado_por=request.usuario
+                audit.finalizar_operacao(
+                    op_id,
+                    status='SUCCESS',
+                    registros_afetados=len(aplicados),
+                    erro_mensagem=(
+                        f"{len(falhas)} divergencias nao aplicadas" if falhas else None
                     )
+                )
                     
-                    audit.finalizar_operacao(op_id, status='SUCCESS')
+            except Exception as e:
+                conn.rollback()
+                audit.finalizar_operacao(
+                    op_id,
+                    status='FAILED',
+                    erro_mensagem=f"{type(e).__name__}: {str(e)}"
+                )
+                raise
                     
+            resultados = []
+            for div_id in request.divergencia_ids:
+                if div_id in aplicados:
                     resultados.append({
                         "divergencia_id": div_id,
                         "status": "aprovado",
-                        "valor_aplicado": valor_aplicar
+                        "valor_aplicado": aplicados[div_id]
                     })
-                    
-                except Exception as e:
-                    logger.error(f"Erro ao aprovar divergencia {div_id}: {e}")
+                elif div_id in falhas:
+                    resultados.append({
+                        "divergencia_id": div_id,
+                        "status": "erro",
+                        "mensagem": falhas[div_id]
+                    })
+                else:
                     resultados.append({
                         "divergencia_id": div_id,
                         "status": "erro",
-                        "mensagem": str(e)
+                        "mensagem": "Divergencia nao encontrada ou ja processada"
                     })
             
-            conn.commit()
+            invalidar_tag('metricas')
             
             return {
                 "total_processado": len(request.divergencia_ids),
-                "aprovados": len([r for r in resultados if r["status"] == "aprovado"]),
-                "erros": len([r for r in resultados if r["status"] == "erro"]),
+                "aprovados": len(aplicados),
+                "erros": len(resultados) - len(aplicados),
                 "detalhes": resultados,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
             
     except Exception as e:
@@ -380,7 +477,7 @@ async def aprovar_correcoes(request: AprovarCorrecaoRequest):
     summary="Rejeitar divergência",
     description="Marca uma divergência como rejeitada com motivo"
 )
-async def rejeitar_divergencia(
+def rejeitar_divergencia(
     divergencia_id: int,
     motivo: str = Body(..., embed=True),
     usuario: str = Body(..., embed=True)
@@ -400,11 +497,13 @@ async def rejeitar_divergencia(
                 motivo_rejeicao=motivo
             )
             
+            invalidar_tag('metricas')
+            
             return {
                 "divergencia_id": divergencia_id,
                 "status": "rejeitado",
                 "motivo": motivo,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
             
     except Exception as e:
@@ -3,23 +3,155 @@ Router de Relatórios
 
 Endpoints para geração de relatórios e exportação de dados.
 
+Os handlers são síncronos (def) e rodam no threadpool do FastAPI, sem
+bloquear o event loop durante consultas e geração de arquivos. As métricas
+de performance ficam em cache (TTLCache), calculadas também no threadpool.
+
 Autor: Financial ETL Framework
 Data: 2026-01-08
 """
 
 from fastapi import APIRouter, HTTPException, Query, status
-from fastapi.responses import StreamingResponse
-from typing import Optional
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import List, Optional
 from datetime import date
 import logging
+import os
+import codecs
+import csv
 import io
-import pandas as pd
+import itertools
+import tempfile
+
+import psycopg2
 
 from ...conn import db_connection
+from ..cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Cache das métricas de performance: os PERCENTILE_CONT varrem audit.operacoes
+# e o resultado tolera alguns minutos de atraso nos dashboards
+PERFORMANCE_CACHE_TTL = int(os.getenv('PERFORMANCE_CACHE_TTL', '300'))
+performance_cache = TTLCache(
+    ttl=PERFORMANCE_CACHE_TTL,
+    stale_ttl=PERFORMANCE_CACHE_TTL // 2,
+    maxsize=64,
+    jitter=0.2,
+    tags=('metricas',)
+)
+
+
+# Colunas exportadas, na ordem do arquivo
+COLUNAS_EXPORT = [
+    'idnfsexterno',
+    'tipo_divergencia',
+    'campo_afetado',
+    'valor_anterior',
+    'valor_sugerido',
+    'valor_aplicado',
+    'competencia',
+    'status_processamento',
+    'confidence_score',
+    'detectado_em',
+    'processado_em',
+    'processado_por',
+    'motivo_rejeicao',
+]
+
+# Colunas de data formatadas como texto no arquivo exportado
+COLUNAS_DATA = {COLUNAS_EXPORT.index('detectado_em'), COLUNAS_EXPORT.index('processado_em')}
+
+# Linhas trazidas do servidor a cada round-trip do cursor nomeado
+EXPORT_ITERSIZE = 5000
+
+# Tamanho dos blocos do .xlsx transmitidos na resposta
+EXCEL_CHUNK_SIZE = 1 << 16
+
+
+def _formatar_linha(row):
+    """Formata as colunas de data da linha exportada."""
+    return [
+        valor.strftime('%Y-%m-%d %H:%M:%S') if i in COLUNAS_DATA and valor else valor
+        for i, valor in enumerate(row)
+    ]
+
+
+def _linhas_divergencias(query, params):
+    """
+    Gera as linhas da exportação a partir de um cursor nomeado (server-side).
+    
+    A conexão fica aberta enquanto o gerador é consumido; apenas
+    EXPORT_ITERSIZE linhas ficam em memória por vez.
+    
+    Yields:
+        list: Linha já formatada
+    """
+    with db_connection() as conn:
+        with conn.cursor(name='export_div') as cursor:
+            cursor.itersize = EXPORT_ITERSIZE
+            cursor.execute(query, params)
+            
+            while True:
+                rows = cursor.fetchmany(EXPORT_ITERSIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _formatar_linha(row)
+
+
+def _gerar_csv(linhas):
+    """
+    Serializa as linhas em CSV em blocos (um por lote do cursor).
+    
+    Yields:
+        bytes: Bloco CSV em UTF-8; o primeiro bloco leva o BOM (Excel)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUNAS_EXPORT)
+    
+    # Cabeçalho sai junto do primeiro lote: a consulta roda antes do
+    # primeiro yield, então erros de banco ainda viram HTTP 500
+    for i, linha in enumerate(linhas, start=1):
+        writer.writerow(linha)
+        if i % EXPORT_ITERSIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _gerar_excel(linhas):
+    """
+    Monta a planilha com xlsxwriter em modo constant_memory.
+    
+    Cada linha é gravada em disco assim que escrita, e o .xlsx final fica
+    num arquivo temporário transmitido em blocos: a memória não cresce com
+    o tamanho da exportação.
+    
+    Yields:
+        bytes: Blocos do arquivo .xlsx
+    """
+    import xlsxwriter
+    
+    with tempfile.TemporaryFile() as output:
+        wb = xlsxwriter.Workbook(output, {'constant_memory': True})
+        ws = wb.add_worksheet()
+        ws.write_row(0, 0, COLUNAS_EXPORT)
+        for i, linha in enumerate(linhas, start=1):
+            ws.write_row(i, 0, linha)
+        wb.close()
+        
+        output.seek(0)
+        while True:
+            bloco = output.read(EXCEL_CHUNK_SIZE)
+            if not bloco:
+                break
+            yield bloco
 
 
 @router.get(
@@ -27,7 +159,7 @@ router = APIRouter()
     summary="Exportar divergências",
     description="Exporta divergências para CSV ou Excel"
 )
-async def exportar_divergencias(
+def exportar_divergencias(
     formato: str = Query("csv", regex="^(csv|excel)$"),
     status_processamento: Optional[str] = Query(None),
     data_inicio: Optional[date] = Query(None),
@@ -35,73 +167,56 @@ async def exportar_divergencias(
 ):
     """
     Exporta relatório de divergências no formato especificado.
+    
+    O CSV é transmitido em streaming direto do cursor do banco; o Excel é
+    montado com xlsxwriter (constant_memory) e transmitido em blocos.
     """
     try:
-        with db_connection() as conn:
-            conditions = []
-            params = []
-            
-            if status_processamento:
-                conditions.append("status_processamento = %s")
-                params.append(status_processamento)
-            
-            if data_inicio:
-                conditions.append("detectado_em >= %s")
-                params.append(data_inicio)
-            
-            if data_fim:
-                conditions.append("detectado_em <= %s")
-                params.append(data_fim)
-            
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
-            
-            query = f"""
-            SELECT 
-                idnfsexterno,
-                tipo_divergencia,
-                campo_afetado,
-                valor_anterior,
-                valor_sugerido,
-                valor_aplicado,
-                competencia,
-                status_processamento,
-                confidence_score,
-                detectado_em,
-                processado_em,
-                processado_por,
-                motivo_rejeicao
-            FROM audit.divergencias_processadas
-            WHERE {where_clause}
-            ORDER BY detectado_em DESC
-            """
-            
-            df = pd.read_sql_query(query, conn, params=params)
-            
-            # Formata datas
-            for col in ['detectado_em', 'processado_em']:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Gera arquivo
-            output = io.BytesIO()
-            
-            if formato == "csv":
-                df.to_csv(output, index=False, encoding='utf-8-sig')
-                media_type = "text/csv"
-                filename = f"divergencias_{date.today().isoformat()}.csv"
-            else:  # excel
-                df.to_excel(output, index=False, engine='openpyxl')
-                media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                filename = f"divergencias_{date.today().isoformat()}.xlsx"
-            
-            output.seek(0)
-            
-            return StreamingResponse(
-                output,
-                media_type=media_type,
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-            
+        conditions = []
+        params = []
+        
+        if status_processamento:
+            conditions.append("status_processamento = %s")
+            params.append(status_processamento)
+        
+        if data_inicio:
+            conditions.append("detectado_em >= %s")
+            params.append(data_inicio)
+        
+        if data_fim:
+            conditions.append("detectado_em <= %s")
+            params.append(data_fim)
+        
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
+        
+        query = f"""
+        SELECT {', '.join(COLUNAS_EXPORT)}
+        FROM audit.divergencias_processadas
+        WHERE {where_clause}
+        ORDER BY detectado_em DESC
+        """
+        
+        linhas = _linhas_divergencias(query, params)
+        
+        if formato == "csv":
+            blocos = _gerar_csv(linhas)
+            primeiro_bloco = codecs.BOM_UTF8 + next(blocos)
+            conteudo = itertools.chain([primeiro_bloco], blocos)
+            media_type = "text/csv"
+            filename = f"divergencias_{date.today().isoformat()}.csv"
+        else:  # excel
+            # Planilha montada aqui, no threadpool; erros ainda viram HTTP 500
+            blocos = _gerar_excel(linhas)
+            conteudo = itertools.chain([next(blocos, b'')], blocos)
+            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            filename = f"divergencias_{date.today().isoformat()}.xlsx"
+        
+        return StreamingResponse(
+            conteudo,
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+        
     except Exception as e:
         logger.error(f"Erro ao exportar divergencias: {e}")
         raise HTTPException(
@@ -117,10 +232,78 @@ async def exportar_divergencias(
 )
 async def obter_metricas_performance(
     data_inicio: Optional[date] = Query(None),
-    data_fim: Optional[date] = Query(None)
+    data_fim: Optional[date] = Query(None),
+    top_consultas: int = Query(
+        0, ge=0, le=50,
+        description="Inclui as N consultas SQL mais lentas (pg_stat_statements)"
+    )
 ):
     """
     Métricas detalhadas de performance e volumetria.
+    
+    Lê o rollup diário audit.mv_operacoes_perf_daily (atualizado pelo
+    DailyProcessor) e fica em cache por PERFORMANCE_CACHE_TTL segundos
+    (±20%) por período consultado.
+    """
+    return await performance_cache.get_or_compute(
+        (data_inicio, data_fim, top_consultas),
+        lambda: _calcular_metricas_performance(data_inicio, data_fim, top_consultas)
+    )
+
+
+def _consultas_mais_lentas(conn, limite: int) -> List[dict]:
+    """
+    Retorna as consultas com maior tempo médio segundo pg_stat_statements.
+    
+    O texto vem normalizado pela extensão (constantes trocadas por $n).
+    Sem a extensão instalada, retorna lista vazia.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT
+                queryid,
+                LEFT(query, 500) as query,
+                calls,
+                total_exec_time::float8,
+                mean_exec_time::float8,
+                rows
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ORDER BY mean_exec_time DESC
+            LIMIT %s
+            """,
+            (limite,)
+        )
+    except psycopg2.Error as e:
+        logger.warning(f"pg_stat_statements indisponivel: {e}")
+        conn.rollback()
+        return []
+    
+    return [
+        {
+            "queryid": row[0],
+            "query": row[1],
+            "chamadas": row[2],
+            "tempo_total_ms": round(row[3], 2),
+            "tempo_medio_ms": round(row[4], 2),
+            "linhas": row[5]
+        }
+        for row in cursor.fetchall()
+    ]
+
+
+def _calcular_metricas_performance(
+    data_inicio: Optional[date],
+    data_fim: Optional[date],
+    top_consultas: int = 0
+) -> dict:
+    """
+    Consulta o banco e monta a resposta de /metricas/performance.
+    
+    Raises:
+        HTTPException: 500 em caso de erro na consulta
     """
     try:
         with db_connection() as conn:
@@ -129,74 +312,68 @@ async def obter_metricas_performance(
             date_condition = ""
             params = []
             if data_inicio and data_fim:
-                date_condition = "WHERE timestamp_inicio BETWEEN %s AND %s"
+                date_condition = "WHERE dia BETWEEN %s AND %s"
                 params = [data_inicio, data_fim]
             
-            # Tempo médio por tipo de operação
-            query_performance = f"""
+            # Duração e taxa de sucesso por tipo de operação em uma única
+            # leitura do rollup diário (mv_operacoes_perf_daily); mediana e
+            # p95 do período são a média dos valores diários ponderada pelo
+            # volume de cada dia
+            query = f"""
             SELECT 
                 tipo_operacao,
-                COUNT(*) as total_operacoes,
-                AVG(duracao_segundos) as duracao_media,
-                MIN(duracao_segundos) as duracao_minima,
-                MAX(duracao_segundos) as duracao_maxima,
-                PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY duracao_segundos) as mediana,
-                PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY duracao_segundos) as p95
-            FROM audit.operacoes
+                SUM(total_operacoes)::bigint as total_operacoes,
+                COALESCE(ROUND(SUM(duracao_total) / NULLIF(SUM(total_com_duracao), 0), 3), 0)::float8 as duracao_media,
+                COALESCE(MIN(duracao_minima), 0)::float8 as duracao_minima,
+                COALESCE(MAX(duracao_maxima), 0)::float8 as duracao_maxima,
+                COALESCE(ROUND(SUM(mediana * total_com_duracao) / NULLIF(SUM(total_com_duracao), 0), 3), 0)::float8 as mediana,
+                COALESCE(ROUND(SUM(p95 * total_com_duracao) / NULLIF(SUM(total_com_duracao), 0), 3), 0)::float8 as p95,
+                SUM(sucessos)::bigint as sucessos,
+                SUM(falhas)::bigint as falhas
+            FROM audit.mv_operacoes_perf_daily
             {date_condition}
             GROUP BY tipo_operacao
             """
             
-            cursor.execute(query_performance, params)
-            performance_rows = cursor.fetchall()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
             
             performance_por_tipo = [
                 {
                     "tipo_operacao": row[0],
                     "total_operacoes": row[1],
-                    "duracao_media_seg": round(float(row[2]), 3) if row[2] else 0,
-                    "duracao_minima_seg": round(float(row[3]), 3) if row[3] else 0,
-                    "duracao_maxima_seg": round(float(row[4]), 3) if row[4] else 0,
-                    "mediana_seg": round(float(row[5]), 3) if row[5] else 0,
-                    "percentil_95_seg": round(float(row[6]), 3) if row[6] else 0
+                    "duracao_media_seg": row[2],
+                    "duracao_minima_seg": row[3],
+                    "duracao_maxima_seg": row[4],
+                    "mediana_seg": row[5],
+                    "percentil_95_seg": row[6]
                 }
-                for row in performance_rows
+                for row in rows
             ]
             
-            # Taxa de sucesso
-            query_sucesso = f"""
-            SELECT 
-                tipo_operacao,
-                COUNT(*) as total,
-                COUNT(CASE WHEN status = 'SUCCESS' THEN 1 END) as sucessos,
-                COUNT(CASE WHEN status = 'FAILED' THEN 1 END) as falhas
-            FROM audit.operacoes
-            {date_condition}
-            GROUP BY tipo_operacao
-            """
-            
-            cursor.execute(query_sucesso, params)
-            sucesso_rows = cursor.fetchall()
-            
             taxa_sucesso_por_tipo = [
                 {
                     "tipo_operacao": row[0],
                     "total": row[1],
-                    "sucessos": row[2],
-                    "falhas": row[3],
-                    "taxa_sucesso_percentual": round((row[2] / row[1] * 100) if row[1] > 0 else 0, 2)
+                    "sucessos": row[7],
+                    "falhas": row[8],
+                    "taxa_sucesso_percentual": round((row[7] / row[1] * 100) if row[1] > 0 else 0, 2)
                 }
-                for row in sucesso_rows
+                for row in rows
             ]
             
-            return {
+            resultado = {
                 "periodo": {
-                    "data_inicio": data_inicio.isoformat() if data_inicio else None,
-                    "data_fim": data_fim.isoformat() if data_fim else None
+                    "data_inicio": data_inicio,
+                    "data_fim": data_fim
                 },
                 "performance_por_tipo": performance_por_tipo,
                 "taxa_sucesso_por_tipo": taxa_sucesso_por_tipo
             }
+            if top_consultas:
+                resultado["consultas_mais_lentas"] = _consultas_mais_lentas(conn, top_consultas)
+            
+            return resultado
             
     except Exception as e:
         logger.error(f"Erro ao obter metricas performance: {e}")
@@ -0,0 +1,118 @@
+"""
+Carga do Arquivo de Divergências no PostgreSQL
+
+Lê o arquivo append-only escrito por ArquivoDivergencias e grava as
+divergências em audit.divergencias_processadas com COPY em lote, fora do
+caminho crítico de quem as registrou. O offset já carregado fica em
+<arquivo>.offset: ao reiniciar, a carga continua do ponto em que parou.
+
+Requer o pacote instalado (pip install -e . na raiz do projeto).
+
+Uso:
+    python audit_loader.py [--arquivo CAMINHO] [--intervalo SEGUNDOS] [--uma-vez]
+
+Autor: Financial ETL Framework
+Data: 2026-01-08
+Versão: 1.0.0
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import psycopg2
+
+from financial_etl.config import adicionar_arquivo_log, log_dir
+from financial_etl.services.audit_logger import (
+    AUDIT_AOF_LOTE,
+    AUDIT_AOF_PATH,
+    carregar_arquivo_divergencias,
+)
+
+adicionar_arquivo_log(log_dir / 'audit_loader.log')
+logger = logging.getLogger(__name__)
+
+# Segundos entre leituras do arquivo no modo contínuo
+INTERVALO_CARGA = 5.0
+
+
+def executar(
+    arquivo: str = AUDIT_AOF_PATH,
+    intervalo: float = INTERVALO_CARGA,
+    tamanho_lote: int = AUDIT_AOF_LOTE,
+    uma_vez: bool = False
+) -> int:
+    """
+    Carrega o arquivo periodicamente até ser interrompido.
+    
+    Uma falha de banco não encerra o laço: o offset não avança e o mesmo
+    trecho é tentado de novo no próximo ciclo.
+    
+    Args:
+        arquivo: Arquivo escrito por ArquivoDivergencias
+        intervalo: Segundos entre leituras
+        tamanho_lote: Linhas por COPY
+        uma_vez: Carrega o que houver e retorna
+    
+    Returns:
+        int: Total de linhas carregadas
+    """
+    total = 0
+    while True:
+        try:
+            total += carregar_arquivo_divergencias(arquivo, tamanho_lote)
+        except psycopg2.Error as e:
+            logger.error(f"Erro ao carregar arquivo de divergencias: {e}")
+            if uma_vez:
+                raise
+        
+        if uma_vez:
+            return total
+        time.sleep(intervalo)
+
+
+def main():
+    """Função principal de execução do script."""
+    parser = argparse.ArgumentParser(
+        description='Carga do arquivo append-only de divergências no PostgreSQL'
+    )
+    
+    parser.add_argument(
+        '--arquivo',
+        default=AUDIT_AOF_PATH,
+        help=f'Arquivo escrito por ArquivoDivergencias (padrão: {AUDIT_AOF_PATH})'
+    )
+    
+    parser.add_argument(
+        '--intervalo',
+        type=float,
+        default=INTERVALO_CARGA,
+        help=f'Segundos entre leituras do arquivo (padrão: {INTERVALO_CARGA})'
+    )
+    
+    parser.add_argument(
+        '--lote',
+        type=int,
+        default=AUDIT_AOF_LOTE,
+        help=f'Linhas por COPY (padrão: {AUDIT_AOF_LOTE})'
+    )
+    
+    parser.add_argument(
+        '--uma-vez',
+        action='store_true',
+        help='Carrega o que houver no arquivo e encerra'
+    )
+    
+    args = parser.parse_args()
+    
+    try:
+        executar(args.arquivo, args.intervalo, args.lote, args.uma_vez)
+    except KeyboardInterrupt:
+        logger.info("Carga interrompida")
+    except psycopg2.Error:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
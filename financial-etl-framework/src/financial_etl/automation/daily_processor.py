@@ -11,45 +11,110 @@ Funcionalidades:
 - Envio de alertas por email
 - Geração de relatórios
 
+Requer o pacote instalado (pip install -e . na raiz do projeto).
+
 Uso:
-    python daily_processor.py [--data-inicio YYYY-MM-DD] [--data-fim YYYY-MM-DD] [--modo auto|manual]
+    python daily_processor.py [--data-inicio YYYY-MM-DD] [--data-fim YYYY-MM-DD] [--modo auto|manual|detect-only-parallel] [--max-workers N] [--processos]
 
 Autor: Financial ETL Framework
 Data: 2026-01-08
 Versão: 1.0.0
 """
 
+import os
 import sys
 import argparse
+import itertools
 import logging
+import multiprocessing
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from operator import attrgetter
 from datetime import datetime, timedelta, date
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple, Union
+
+# Importa pelo nome do pacote (instalado com `pip install -e .`): sem
+# mexer no sys.path, e o mesmo módulo usado pela API e pelos testes
+from financial_etl.config import adicionar_arquivo_log, log_dir
+from financial_etl.conn import db_connection
+from financial_etl.services import DivergenceProcessor, AuditLogger
 
-# Adiciona path do projeto ao sys.path
+# Raiz do repositório (destino dos relatórios em Datasets/)
 project_root = Path(__file__).parent.parent.parent.parent
-sys.path.insert(0, str(project_root))
 
-from src.financial_etl.conn import db_connection
-from src.financial_etl.services import (
-    DivergenceProcessor,
-    AuditLogger,
-    NotificationService
-)
+# Arquivo de log do processamento, gravado pelo QueueListener de config.py
+adicionar_arquivo_log(log_dir / 'daily_processor.log')
+logger = logging.getLogger(__name__)
 
-# Configuração de logging
-log_dir = Path(__file__).parent.parent / 'logs'
-log_dir.mkdir(exist_ok=True, parents=True)
+# Separadores do log, montados uma vez
+SEPARADOR = "=" * 70
+SEPARADOR_ETAPA = "-" * 70
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_dir / f'daily_processor_{date.today()}.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logger = logging.getLogger(__name__)
+# Confiança a partir da qual uma divergência conta como crítica no alerta.
+# Contagem em Python puro: com a lista de objetos já em memória, montar um
+# array NumPy exige o mesmo laço de atributos e sai mais lento
+LIMITE_ALTA_CONFIANCA = 0.95
+
+# Tamanho das janelas em que períodos longos são divididos na detecção
+DIAS_POR_JANELA = 30
+
+
+def _dividir_periodo(
+    data_inicio: date,
+    data_fim: date,
+    dias: int = DIAS_POR_JANELA
+) -> List[Tuple[date, date]]:
+    """
+    Divide um período em janelas consecutivas de até `dias` dias.
+    
+    As janelas são fechadas nas duas pontas (como o BETWEEN das consultas)
+    e não se sobrepõem.
+    
+    Args:
+        data_inicio: Primeiro dia do período
+        data_fim: Último dia do período
+        dias: Tamanho máximo de cada janela
+    
+    Returns:
+        List[Tuple[date, date]]: Janelas (início, fim) em ordem cronológica
+    
+    Exemplo:
+        >>> _dividir_periodo(date(2025, 12, 1), date(2025, 12, 31), dias=15)
+        [(date(2025, 12, 1), date(2025, 12, 15)),
+         (date(2025, 12, 16), date(2025, 12, 30)),
+         (date(2025, 12, 31), date(2025, 12, 31))]
+    """
+    janelas = []
+    inicio = data_inicio
+    while inicio <= data_fim:
+        fim = min(inicio + timedelta(days=dias - 1), data_fim)
+        janelas.append((inicio, fim))
+        inicio = fim + timedelta(days=1)
+    return janelas
+
+
+def _detectar_janela(janela: Tuple[date, date]) -> list:
+    """
+    Detecta as divergências de uma janela em uma conexão própria do pool.
+    
+    Função de módulo (e não closure) para poder ser enviada a processos
+    filhos; cada processo cria o seu próprio pool de conexões. As regras
+    rodam na conexão da janela: abrir outra conexão do pool por regra com
+    esta presa poderia esgotar o pool e travar as threads.
+    
+    Args:
+        janela: Período (início, fim) da janela
+    
+    Returns:
+        list: Divergências da janela
+    """
+    with db_connection() as conn:
+        return DivergenceProcessor(conn).detectar_divergencias(
+            data_inicio=janela[0],
+            data_fim=janela[1]
+        )
 
 
 class DailyProcessor:
@@ -61,43 +126,78 @@ class DailyProcessor:
     
     def __init__(
         self,
-        data_inicio: Optional[str] = None,
-        data_fim: Optional[str] = None,
-        modo: str = 'auto'
+        data_inicio: Optional[Union[str, date]] = None,
+        data_fim: Optional[Union[str, date]] = None,
+        modo: str = 'auto',
+        max_workers: Optional[int] = None,
+        usar_processos: bool = False
     ):
         """
         Inicializa o processador diário.
         
         Args:
-            data_inicio: Data início no formato YYYY-MM-DD (padrão: ontem)
-            data_fim: Data fim no formato YYYY-MM-DD (padrão: hoje)
-            modo: 'auto' para aplicação automática, 'manual' apenas detecta
+            data_inicio: Data início, date ou YYYY-MM-DD (padrão: ontem)
+            data_fim: Data fim, date ou YYYY-MM-DD (padrão: hoje)
+            modo: 'auto' para aplicação automática, 'manual' apenas detecta,
+                'detect-only-parallel' como 'manual' com as regras de detecção
+                consultadas em paralelo
+            max_workers: Janelas detectadas em paralelo em períodos longos
+                (padrão: min(janelas, CPUs))
+            usar_processos: Detecta as janelas em processos em vez de threads,
+                para quando o processamento Python das linhas pesar mais que
+                a espera pelo banco
         """
         # Define período padrão se não fornecido
         if data_inicio is None:
-            data_inicio = (date.today() - timedelta(days=1)).isoformat()
+            data_inicio = date.today() - timedelta(days=1)
+        elif isinstance(data_inicio, str):
+            data_inicio = date.fromisoformat(data_inicio)
         if data_fim is None:
-            data_fim = date.today().isoformat()
+            data_fim = date.today()
+        elif isinstance(data_fim, str):
+            data_fim = date.fromisoformat(data_fim)
         
-        self.data_inicio = data_inicio
-        self.data_fim = data_fim
+        # Mantidas como date: o psycopg2 as envia como tipo date nativo;
+        # texto ISO só nos limites (JSON de auditoria e resultado)
+        self.data_inicio: date = data_inicio
+        self.data_fim: date = data_fim
         self.modo = modo
-        self.notifier = NotificationService()
+        self.deteccao_paralela = modo == 'detect-only-parallel'
+        self.max_workers = max_workers
+        self.usar_processos = usar_processos
+        
+        # Sem credenciais SMTP (mesmo critério do NotificationService) o
+        # serviço de notificação nem é carregado
+        self.notifier = None
+        if os.getenv('SMTP_USER') and os.getenv('SMTP_PASSWORD'):
+            from financial_etl.services import NotificationService
+            self.notifier = NotificationService()
+        else:
+            logger.warning("SMTP nao configurado: alertas por email desabilitados")
         
         logger.info(
-            f"Processador inicializado: periodo={data_inicio} ate {data_fim}, modo={modo}"
+            "Processador inicializado: periodo=%s ate %s, modo=%s",
+            data_inicio, data_fim, modo
         )
     
     def executar(self) -> dict:
         """
         Executa o processamento completo.
         
+        O alerta de divergências e um eventual alerta de falha crítica
+        compartilham a mesma conexão SMTP.
+        
         Returns:
             dict: Resultado do processamento com métricas
         """
-        logger.info("="*70)
+        with self.notifier or nullcontext():
+            return self._executar()
+    
+    def _executar(self) -> dict:
+        """Etapas do processamento; ver executar()."""
+        logger.info(SEPARADOR)
         logger.info("INICIANDO PROCESSAMENTO DIÁRIO DE DIVERGÊNCIAS")
-        logger.info("="*70)
+        logger.info(SEPARADOR)
         
         inicio_execucao = datetime.now()
         resultado = {
@@ -106,147 +206,163 @@ class DailyProcessor:
             'erros': []
         }
         
+        # Decisões que dependem só do modo, resolvidas uma vez
+        modo = self.modo
+        tipo_sessao = 'DAILY_AUTO' if modo == 'auto' else 'MANUAL_RUN'
+        limite_alta_confianca = LIMITE_ALTA_CONFIANCA
+        
         try:
-            with db_connection() as conn:
-                audit = AuditLogger(conn)
-                processor = DivergenceProcessor(conn)
+            # Auditoria em conexão própria: seus commits não confirmam nem
+            # desfazem as correções em andamento na conexão do ETL
+            with db_connection() as conn, AuditLogger.conexao_dedicada() as audit:
+                processor = DivergenceProcessor(conn, audit=audit)
                 
-                # Inicia sessão de processamento
-                sessao_id = audit.iniciar_sessao_processamento(
-                    tipo_sessao='DAILY_AUTO' if self.modo == 'auto' else 'MANUAL_RUN',
-                    parametros_execucao={
-                        'data_inicio': self.data_inicio,
-                        'data_fim': self.data_fim,
-                        'modo': self.modo
-                    }
-                )
-                
-                logger.info(f"Sessao de processamento iniciada: ID={sessao_id}")
-                
-                # ETAPA 1: Detecção de divergências
-                logger.info("-" * 70)
-                logger.info("ETAPA 1: Detectando divergencias")
-                logger.info("-" * 70)
+                # A detecção não depende do ID da sessão: a reserva do ID
+                # roda na conexão da auditoria enquanto as consultas de
+                # detecção já estão em andamento na conexão do ETL
+                with ThreadPoolExecutor(max_workers=1, thread_name_prefix='sessao') as pool:
+                    sessao_future = pool.submit(self._iniciar_sessao, audit, tipo_sessao, modo)
+                    
+                    # ETAPA 1: Detecção de divergências
+                    logger.info(SEPARADOR_ETAPA)
+                    logger.info("ETAPA 1: Detectando divergencias")
+                    logger.info(SEPARADOR_ETAPA)
+                    
+                    divergencias = self._detectar_divergencias(processor)
+                    
+                    sessao_id = sessao_future.result()
                 
-                divergencias = processor.detectar_divergencias(
-                    data_inicio=self.data_inicio,
-                    data_fim=self.data_fim
-                )
+                logger.info("Sessao de processamento iniciada: ID=%s", sessao_id)
                 
                 total_divergencias = len(divergencias)
-                divergencias_alta_confianca = len([
-                    d for d in divergencias if d.confianca >= 0.95
-                ])
-                
-                logger.info(f"Total de divergencias detectadas: {total_divergencias}")
-                logger.info(f"Alta confianca (>=0.95): {divergencias_alta_confianca}")
-                
-                # Resumo por tipo
-                tipos_count = {}
-                for div in divergencias:
-                    tipos_count[div.tipo] = tipos_count.get(div.tipo, 0) + 1
+                divergencias_alta_confianca = sum(
+                    1 for d in divergencias if d.confianca >= limite_alta_confianca
+                )
                 
-                logger.info("Divergencias por tipo:")
-                for tipo, count in sorted(tipos_count.items()):
-                    logger.info(f"  - {tipo}: {count}")
+                logger.info("Total de divergencias detectadas: %d", total_divergencias)
+                logger.info(
+                    "Alta confianca (>=%.2f): %d",
+                    limite_alta_confianca, divergencias_alta_confianca
+                )
                 
-                # ETAPA 2: Aplicação de correções
-                logger.info("-" * 70)
-                logger.info("ETAPA 2: Aplicando correcoes")
-                logger.info("-" * 70)
+                # Resumo por tipo (só montado se o INFO estiver habilitado)
+                if logger.isEnabledFor(logging.INFO):
+                    tipos_count = Counter(map(attrgetter('tipo'), divergencias))
                 
-                resultado_correcoes = processor.aplicar_correcoes(
-                    divergencias=divergencias,
-                    modo=self.modo,
-                    usuario='sistema_automatico'
-                )
+                    logger.info("Divergencias por tipo:")
+                    for tipo, count in sorted(tipos_count.items()):
+                        logger.info("  - %s: %d", tipo, count)
                 
-                logger.info(f"Correcoes automaticas aplicadas: {resultado_correcoes['corrigidas_automaticamente']}")
-                logger.info(f"Pendentes de aprovacao: {resultado_correcoes['pendentes_aprovacao']}")
-                logger.info(f"Erros: {resultado_correcoes['erros']}")
+                # Dia limpo: sem correções, relatório ou alerta a produzir
+                if total_divergencias == 0:
+                    logger.info("Nenhuma divergencia detectada; etapas 2 a 4 ignoradas")
+                    return self._finalizar_sem_divergencias(
+                        audit, conn, sessao_id, inicio_execucao, resultado['erros']
+                    )
                 
-                # ETAPA 3: Geração de relatório
-                logger.info("-" * 70)
-                logger.info("ETAPA 3: Gerando relatorio")
-                logger.info("-" * 70)
+                # Correções vão demorar: a sessão fica visível (RUNNING) até o fim
+                audit.gravar_inicio_sessao(sessao_id)
                 
-                relatorio_path = None
-                if divergencias:
+                # Relatório e notificação não usam a conexão: rodam em threads,
+                # sobrepondo a escrita do CSV e o SMTP às consultas das correções
+                with ThreadPoolExecutor(max_workers=2, thread_name_prefix='daily_processor') as pool:
+                    relatorio_future = pool.submit(self._gerar_relatorio, processor, divergencias)
+                    
+                    # ETAPA 2: Aplicação de correções
+                    logger.info(SEPARADOR_ETAPA)
+                    logger.info("ETAPA 2: Aplicando correcoes")
+                    logger.info(SEPARADOR_ETAPA)
+                    
+                    resultado_correcoes = processor.aplicar_correcoes(
+                        divergencias=divergencias,
+                        modo=modo,
+                        usuario='sistema_automatico'
+                    )
+                    
+                    logger.info("Correcoes automaticas aplicadas: %d", resultado_correcoes['corrigidas_automaticamente'])
+                    logger.info("Pendentes de aprovacao: %d", resultado_correcoes['pendentes_aprovacao'])
+                    logger.info("Erros: %d", resultado_correcoes['erros'])
+                    
+                    # ETAPA 3: Geração de relatório (iniciada junto com a ETAPA 2)
+                    logger.info(SEPARADOR_ETAPA)
+                    logger.info("ETAPA 3: Gerando relatorio")
+                    logger.info(SEPARADOR_ETAPA)
+                    
+                    relatorio_path = None
                     try:
-                        datasets_dir = project_root / 'Datasets'
-                        datasets_dir.mkdir(exist_ok=True)
-                        
-                        relatorio_path = processor.gerar_relatorio_divergencias(
-                            divergencias=divergencias,
-                            formato='csv',
-                            caminho_saida=str(
-                                datasets_dir / f'divergencias_{date.today()}.csv'
-                            )
-                        )
-                        logger.info(f"Relatorio gerado: {relatorio_path}")
+                        relatorio_path = relatorio_future.result()
+                        logger.info("Relatorio gerado: %s", relatorio_path)
                     except Exception as e:
-                        logger.error(f"Erro ao gerar relatorio: {e}")
+                        logger.error("Erro ao gerar relatorio: %s", e)
                         resultado['erros'].append(f"Erro ao gerar relatorio: {str(e)}")
-                
-                # ETAPA 4: Envio de notificações
-                logger.info("-" * 70)
-                logger.info("ETAPA 4: Enviando notificacoes")
-                logger.info("-" * 70)
-                
-                if total_divergencias > 0:
-                    try:
-                        sucesso_notificacao = self.notifier.enviar_alerta_divergencias(
+                    
+                    # ETAPA 4: Envio de notificações (concluída após a sessão)
+                    logger.info(SEPARADOR_ETAPA)
+                    logger.info("ETAPA 4: Enviando notificacoes")
+                    logger.info(SEPARADOR_ETAPA)
+                    
+                    notificacao_future = None
+                    if self.notifier is not None:
+                        notificacao_future = pool.submit(
+                            self.notifier.enviar_alerta_divergencias,
                             total_divergencias=total_divergencias,
                             divergencias_criticas=divergencias_alta_confianca,
                             divergencias_pendentes=resultado_correcoes['pendentes_aprovacao'],
                             data_processamento=datetime.now().strftime('%d/%m/%Y %H:%M'),
                             relatorio_anexo=relatorio_path
                         )
-                        
-                        if sucesso_notificacao:
-                            logger.info("Alerta de divergencias enviado com sucesso")
-                        else:
-                            logger.warning("Alerta nao enviado (SMTP nao configurado ou sem destinatarios)")
-                            
-                    except Exception as e:
-                        logger.error(f"Erro ao enviar notificacao: {e}")
-                        resultado['erros'].append(f"Erro ao enviar notificacao: {str(e)}")
-                
-                # Finaliza sessão
-                fim_execucao = datetime.now()
-                duracao = (fim_execucao - inicio_execucao).total_seconds()
-                
-                metricas = {
-                    'total_registros_analisados': total_divergencias,
-                    'divergencias_detectadas': total_divergencias,
-                    'correcoes_aplicadas': resultado_correcoes['corrigidas_automaticamente'],
-                    'correcoes_pendentes': resultado_correcoes['pendentes_aprovacao'],
-                    'erros_encontrados': resultado_correcoes['erros']
-                }
-                
-                status_final = (
-                    'COMPLETED' if resultado_correcoes['erros'] == 0
-                    else 'PARTIAL'
-                )
-                
-                audit.finalizar_sessao_processamento(
-                    sessao_id=sessao_id,
-                    status=status_final,
-                    metricas=metricas,
-                    resultado_geral=(
-                        f"Processamento concluido com sucesso. "
-                        f"{resultado_correcoes['corrigidas_automaticamente']} correcoes aplicadas, "
-                        f"{resultado_correcoes['pendentes_aprovacao']} pendentes."
+                    
+                    # Finaliza sessão
+                    fim_execucao = datetime.now()
+                    duracao = (fim_execucao - inicio_execucao).total_seconds()
+                    
+                    metricas = {
+                        'total_registros_analisados': total_divergencias,
+                        'divergencias_detectadas': total_divergencias,
+                        'correcoes_aplicadas': resultado_correcoes['corrigidas_automaticamente'],
+                        'correcoes_pendentes': resultado_correcoes['pendentes_aprovacao'],
+                        'erros_encontrados': resultado_correcoes['erros']
+                    }
+                    
+                    status_final = (
+                        'COMPLETED' if resultado_correcoes['erros'] == 0
+                        else 'PARTIAL'
                     )
-                )
+                    
+                    audit.finalizar_sessao_processamento(
+                        sessao_id=sessao_id,
+                        status=status_final,
+                        metricas=metricas,
+                        resultado_geral=(
+                            f"Processamento concluido com sucesso. "
+                            f"{resultado_correcoes['corrigidas_automaticamente']} correcoes aplicadas, "
+                            f"{resultado_correcoes['pendentes_aprovacao']} pendentes."
+                        )
+                    )
+                    
+                    # Rollup usado por /metricas/performance; falha não interrompe
+                    self._atualizar_rollup_performance(conn)
+                    self._rotacionar_particoes(audit)
+                    
+                    if notificacao_future is None:
+                        logger.warning("Alerta nao enviado (SMTP nao configurado)")
+                    else:
+                        try:
+                            if notificacao_future.result():
+                                logger.info("Alerta de divergencias enviado com sucesso")
+                            else:
+                                logger.warning("Alerta nao enviado (sem destinatarios ou falha no envio)")
+                        except Exception as e:
+                            logger.error("Erro ao enviar notificacao: %s", e)
+                            resultado['erros'].append(f"Erro ao enviar notificacao: {str(e)}")
                 
                 # Prepara resultado final
                 resultado = {
                     'status': status_final,
                     'sessao_id': sessao_id,
                     'periodo': {
-                        'data_inicio': self.data_inicio,
-                        'data_fim': self.data_fim
+                        'data_inicio': self.data_inicio.isoformat(),
+                        'data_fim': self.data_fim.isoformat()
                     },
                     'duracao_segundos': int(duracao),
                     'metricas': metricas,
@@ -255,29 +371,230 @@ class DailyProcessor:
                     'erros': resultado['erros']
                 }
                 
-                logger.info("="*70)
-                logger.info(f"PROCESSAMENTO CONCLUÍDO - Status: {status_final}")
-                logger.info(f"Duracao: {int(duracao)} segundos")
-                logger.info("="*70)
+                logger.info(SEPARADOR)
+                logger.info("PROCESSAMENTO CONCLUÍDO - Status: %s", status_final)
+                logger.info("Duracao: %d segundos", duracao)
+                logger.info(SEPARADOR)
                 
                 return resultado
                 
         except Exception as e:
-            logger.error(f"ERRO CRÍTICO no processamento: {e}", exc_info=True)
+            logger.error("ERRO CRÍTICO no processamento: %s", e, exc_info=True)
             
             # Tenta enviar alerta de falha crítica
-            try:
-                self.notifier.enviar_alerta_falha_critica(
-                    componente='DailyProcessor',
-                    erro_mensagem=str(e),
-                    stack_trace=None
-                )
-            except:
-                pass
+            if self.notifier is not None:
+                try:
+                    self.notifier.enviar_alerta_falha_critica(
+                        componente='DailyProcessor',
+                        erro_mensagem=str(e),
+                        stack_trace=None
+                    )
+                except:
+                    pass
             
             resultado['status'] = 'FAILED'
             resultado['erros'].append(str(e))
             return resultado
+    
+    def _iniciar_sessao(self, audit: AuditLogger, tipo_sessao: str, modo: str) -> int:
+        """
+        Reserva o ID da sessão de processamento, sem gravar a linha.
+        
+        Um dia sem divergências grava a sessão inteira em um único INSERT
+        ao finalizar; com correções a aplicar, a linha RUNNING é gravada
+        antes delas (AuditLogger.gravar_inicio_sessao).
+        
+        Args:
+            audit: AuditLogger da execução (conexão dedicada)
+            tipo_sessao: DAILY_AUTO ou MANUAL_RUN
+            modo: Modo de processamento
+        
+        Returns:
+            int: ID reservado da sessão
+        """
+        return audit.iniciar_sessao_processamento(
+            tipo_sessao=tipo_sessao,
+            parametros_execucao={
+                'data_inicio': self.data_inicio.isoformat(),
+                'data_fim': self.data_fim.isoformat(),
+                'modo': modo
+            },
+            adiar=True
+        )
+    
+    def _finalizar_sem_divergencias(
+        self,
+        audit: AuditLogger,
+        conn,
+        sessao_id: int,
+        inicio_execucao: datetime,
+        erros: list
+    ) -> dict:
+        """
+        Encerra a sessão quando a detecção não encontra divergências.
+        
+        Args:
+            audit: AuditLogger da conexão principal
+            conn: Conexão psycopg2 ativa
+            sessao_id: ID da sessão de processamento
+            inicio_execucao: Início da execução (para a duração)
+            erros: Erros acumulados até aqui
+        
+        Returns:
+            dict: Resultado no mesmo formato de executar()
+        """
+        metricas = {
+            'total_registros_analisados': 0,
+            'divergencias_detectadas': 0,
+            'correcoes_aplicadas': 0,
+            'correcoes_pendentes': 0,
+            'erros_encontrados': 0
+        }
+        
+        audit.finalizar_sessao_processamento(
+            sessao_id=sessao_id,
+            status='COMPLETED',
+            metricas=metricas,
+            resultado_geral="Processamento concluido sem divergencias."
+        )
+        
+        # O rollup também cobre operações feitas fora do processador
+        self._atualizar_rollup_performance(conn)
+        self._rotacionar_particoes(audit)
+        
+        duracao = (datetime.now() - inicio_execucao).total_seconds()
+        
+        logger.info(SEPARADOR)
+        logger.info("PROCESSAMENTO CONCLUÍDO - Status: COMPLETED")
+        logger.info("Duracao: %d segundos", duracao)
+        logger.info(SEPARADOR)
+        
+        return {
+            'status': 'COMPLETED',
+            'sessao_id': sessao_id,
+            'periodo': {
+                'data_inicio': self.data_inicio.isoformat(),
+                'data_fim': self.data_fim.isoformat()
+            },
+            'duracao_segundos': int(duracao),
+            'metricas': metricas,
+            'resultado_correcoes': {
+                'total_divergencias': 0,
+                'corrigidas_automaticamente': 0,
+                'pendentes_aprovacao': 0,
+                'erros': 0,
+                'detalhes': []
+            },
+            'relatorio_gerado': None,
+            'erros': erros
+        }
+    
+    def _detectar_divergencias(self, processor: DivergenceProcessor) -> list:
+        """
+        Detecta divergências do período, em paralelo quando ele é longo.
+        
+        Períodos de até DIAS_POR_JANELA dias usam a conexão do processador.
+        Períodos maiores são divididos em janelas e cada janela roda em uma
+        thread (ou processo, com usar_processos) com sua própria conexão do
+        pool; as listas são concatenadas na ordem cronológica das janelas.
+        
+        No modo detect-only-parallel as regras são consultadas ao mesmo
+        tempo, uma conexão por regra, apenas no período de uma janela; com
+        várias janelas o paralelismo fica entre as janelas.
+        
+        Args:
+            processor: Processador da conexão principal
+        
+        Returns:
+            list: Divergências detectadas
+        """
+        janelas = _dividir_periodo(self.data_inicio, self.data_fim)
+        
+        if len(janelas) <= 1:
+            return processor.detectar_divergencias(
+                data_inicio=self.data_inicio,
+                data_fim=self.data_fim,
+                paralelo=self.deteccao_paralela
+            )
+        
+        max_workers = self.max_workers or min(len(janelas), os.cpu_count() or 1)
+        logger.info(
+            "Periodo dividido em %d janelas de ate %d dias (%d %s em paralelo)",
+            len(janelas), DIAS_POR_JANELA, max_workers,
+            'processos' if self.usar_processos else 'threads'
+        )
+        
+        if self.usar_processos:
+            # spawn: um fork herdaria as conexões abertas do pool do processo pai
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='deteccao')
+        
+        with executor as pool:
+            resultados = itertools.chain.from_iterable(pool.map(_detectar_janela, janelas))
+            
+            # Regras sem filtro de data (ex.: pendentes de verificação) voltam
+            # em todas as janelas: mantém só a primeira ocorrência
+            unicas = {}
+            for div in resultados:
+                unicas.setdefault((div.idnfsexterno, div.tipo, div.campo_afetado), div)
+        
+        return list(unicas.values())
+    
+    def _gerar_relatorio(self, processor: DivergenceProcessor, divergencias: list) -> str:
+        """
+        Gera o CSV de divergências do dia em Datasets/.
+        
+        Args:
+            processor: Processador usado na detecção
+            divergencias: Divergências detectadas
+        
+        Returns:
+            str: Caminho do relatório gerado
+        """
+        datasets_dir = project_root / 'Datasets'
+        datasets_dir.mkdir(exist_ok=True)
+        
+        return processor.gerar_relatorio_divergencias(
+            divergencias=divergencias,
+            formato='csv',
+            caminho_saida=str(
+                datasets_dir / f'divergencias_{date.today()}.csv'
+            )
+        )
+    
+    def _atualizar_rollup_performance(self, conn) -> None:
+        """
+        Atualiza audit.mv_operacoes_perf_daily sem bloquear leituras.
+        
+        Args:
+            conn: Conexão psycopg2 ativa
+        """
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "REFRESH MATERIALIZED VIEW CONCURRENTLY audit.mv_operacoes_perf_daily"
+                )
+            conn.commit()
+            logger.info("Rollup de performance atualizado")
+        except Exception as e:
+            conn.rollback()
+            logger.warning("Rollup de performance nao atualizado: %s", e)
+
+    def _rotacionar_particoes(self, audit: AuditLogger) -> None:
+        """
+        Prepara as partições dos próximos meses e descarta as expiradas.
+        
+        Args:
+            audit: AuditLogger da execução
+        """
+        try:
+            audit.rotacionar_particoes()
+        except Exception as e:
+            logger.warning("Rotacao de particoes nao executada: %s", e)
 
 
 def main():
@@ -297,29 +614,50 @@ Exemplos de uso:
   Apenas detectar sem aplicar correções:
     python daily_processor.py --modo manual
   
+  Apenas detectar, com as regras consultadas em paralelo:
+    python daily_processor.py --modo detect-only-parallel
+  
   Reprocessar mês completo:
     python daily_processor.py --data-inicio 2025-12-01 --data-fim 2025-12-31
+  
+  Reprocessar período longo com 4 janelas de detecção em paralelo:
+    python daily_processor.py --data-inicio 2025-08-01 --data-fim 2025-12-31 --max-workers 4
         """
     )
     
     parser.add_argument(
         '--data-inicio',
-        type=str,
+        type=date.fromisoformat,
         help='Data início no formato YYYY-MM-DD (padrão: ontem)'
     )
     
     parser.add_argument(
         '--data-fim',
-        type=str,
+        type=date.fromisoformat,
         help='Data fim no formato YYYY-MM-DD (padrão: hoje)'
     )
     
     parser.add_argument(
         '--modo',
         type=str,
-        choices=['auto', 'manual'],
+        choices=['auto', 'manual', 'detect-only-parallel'],
         default='auto',
-        help='Modo de processamento: auto (aplica correções) ou manual (apenas detecta)'
+        help=(
+            'Modo de processamento: auto (aplica correções), manual (apenas detecta) '
+            'ou detect-only-parallel (apenas detecta, uma conexão por regra de detecção)'
+        )
+    )
+    
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        help=f'Janelas de {DIAS_POR_JANELA} dias detectadas em paralelo (padrão: min(janelas, CPUs))'
+    )
+    
+    parser.add_argument(
+        '--processos',
+        action='store_true',
+        help='Detecta as janelas em processos separados em vez de threads'
     )
     
     args = parser.parse_args()
@@ -328,7 +666,9 @@ Exemplos de uso:
     processor = DailyProcessor(
         data_inicio=args.data_inicio,
         data_fim=args.data_fim,
-        modo=args.modo
+        modo=args.modo,
+        max_workers=args.max_workers,
+        usar_processos=args.processos
     )
     
     resultado = processor.executar()
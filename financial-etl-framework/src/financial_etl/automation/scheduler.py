@@ -15,6 +15,7 @@ Versão: 1.0.0
 import os
 import sys
 import platform
+import subprocess
 from pathlib import Path
 from datetime import time as dtime
 
@@ -22,6 +23,10 @@ from datetime import time as dtime
 PROJECT_ROOT = Path(__file__).parent.parent.parent.parent
 DAILY_PROCESSOR_SCRIPT = PROJECT_ROOT / 'src' / 'financial_etl' / 'automation' / 'daily_processor.py'
 
+# Interpretador e script resolvidos uma única vez na importação
+_PYTHON_EXE = sys.executable
+_SCRIPT_PATH = str(DAILY_PROCESSOR_SCRIPT.resolve(strict=False))
+
 
 def criar_task_windows(
     nome_task: str = 'FinancialETL_DailyProcessor',
@@ -46,26 +51,31 @@ def criar_task_windows(
         print("Este método é apenas para Windows")
         return False
     
-    python_exe = sys.executable
-    script_path = str(DAILY_PROCESSOR_SCRIPT)
-    
     # Obtém usuário atual se não fornecido
     if usuario is None:
         usuario = os.environ.get('USERNAME', 'SYSTEM')
     
-    # Comando para criar tarefa usando schtasks
-    comando = f'''schtasks /Create /SC DAILY /TN "{nome_task}" /TR "{python_exe} {script_path}" /ST {horario.strftime("%H:%M")} /RU {usuario} /F'''
+    # Argumentos do schtasks em lista: sem shell intermediário e sem
+    # problemas de aspas com caminhos que contêm espaços
+    comando = [
+        'schtasks', '/Create', '/SC', 'DAILY',
+        '/TN', nome_task,
+        '/TR', f'"{_PYTHON_EXE}" "{_SCRIPT_PATH}"',
+        '/ST', horario.strftime('%H:%M'),
+        '/RU', usuario,
+        '/F'
+    ]
     
     print(f"Criando tarefa agendada: {nome_task}")
     print(f"Horário: {horario.strftime('%H:%M')}")
-    print(f"Python: {python_exe}")
-    print(f"Script: {script_path}")
+    print(f"Python: {_PYTHON_EXE}")
+    print(f"Script: {_SCRIPT_PATH}")
     print()
     
     try:
-        resultado = os.system(comando)
+        resultado = subprocess.run(comando, capture_output=True, text=True)
         
-        if resultado == 0:
+        if resultado.returncode == 0:
             print(f"✓ Tarefa '{nome_task}' criada com sucesso")
             print(f"  Executará diariamente às {horario.strftime('%H:%M')}")
             print()
@@ -75,7 +85,9 @@ def criar_task_windows(
             print(f"  Deletar: schtasks /Delete /TN {nome_task} /F")
             return True
         else:
-            print(f"✗ Erro ao criar tarefa (código: {resultado})")
+            print(f"✗ Erro ao criar tarefa (código: {resultado.returncode})")
+            if resultado.stderr:
+                print(f"  {resultado.stderr.strip()}")
             print("  Nota: Pode requerer permissões de administrador")
             return False
             
@@ -103,14 +115,12 @@ def criar_cron_linux(
         2. Adicione a linha retornada por esta função
         3. Salve e saia
     """
-    python_exe = sys.executable
-    script_path = str(DAILY_PROCESSOR_SCRIPT)
     log_path = PROJECT_ROOT / 'src' / 'financial_etl' / 'logs' / 'cron.log'
     
     # Formato: minuto hora dia mês dia_semana comando
     cron_line = (
         f"{horario.minute} {horario.hour} * * * "
-        f"{python_exe} {script_path} >> {log_path} 2>&1"
+        f"{_PYTHON_EXE} {_SCRIPT_PATH} >> {log_path} 2>&1"
     )
     
     print("="*70)
@@ -150,14 +160,14 @@ def remover_task_windows(nome_task: str = 'FinancialETL_DailyProcessor') -> bool
         print("Este método é apenas para Windows")
         return False
     
-    comando = f'schtasks /Delete /TN "{nome_task}" /F'
+    comando = ['schtasks', '/Delete', '/TN', nome_task, '/F']
     
     print(f"Removendo tarefa: {nome_task}")
     
     try:
-        resultado = os.system(comando)
+        resultado = subprocess.run(comando, capture_output=True, text=True)
         
-        if resultado == 0:
+        if resultado.returncode == 0:
             print(f"✓ Tarefa '{nome_task}' removida com sucesso")
             return True
         else:
@@ -176,15 +186,11 @@ def executar_agora() -> int:
     Returns:
         int: Código de saída do processo
     """
-    python_exe = sys.executable
-    script_path = str(DAILY_PROCESSOR_SCRIPT)
-    
     print("Executando processamento imediatamente...")
-    print(f"Script: {script_path}")
+    print(f"Script: {_SCRIPT_PATH}")
     print()
     
-    comando = f'"{python_exe}" "{script_path}"'
-    return os.system(comando)
+    return subprocess.run([_PYTHON_EXE, _SCRIPT_PATH]).returncode
 
 
 def main():
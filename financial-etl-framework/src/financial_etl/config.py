@@ -1,22 +1,80 @@
 """
 Configuração de logging para o projeto.
+
+Os handlers de arquivo e console rodam em uma thread própria
+(QueueHandler + QueueListener), para que a escrita em disco não
+bloqueie o processamento.
 """
 
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 from pathlib import Path
 from typing import Optional
 
 log_dir = Path(__file__).parent / 'logs'
 log_dir.mkdir(exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_dir / 'app.log'),
-        logging.StreamHandler()
-    ]
+_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+_file_handler = logging.FileHandler(log_dir / 'app.log')
+_file_handler.setFormatter(_formatter)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(_formatter)
+
+log_queue = queue.Queue(-1)
+_queue_handler = logging.handlers.QueueHandler(log_queue)
+# A formatação final fica com os handlers do listener
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
+_root = logging.getLogger()
+_root.setLevel(logging.INFO)
+_root.addHandler(_queue_handler)
+
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    _file_handler,
+    _stream_handler,
+    respect_handler_level=True
 )
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger(__name__)
+
 
-logger = logging.getLogger(__name__)
\ No newline at end of file
+def adicionar_arquivo_log(
+    caminho: Path,
+    nivel: int = logging.INFO,
+    dias_retidos: int = 30
+) -> logging.Handler:
+    """
+    Adiciona um arquivo de log atendido pelo mesmo QueueListener.
+    
+    Scripts com log próprio (ex: DailyProcessor) usam esta função em vez de
+    logging.basicConfig: a escrita continua fora da thread que loga.
+    
+    O arquivo é rotacionado à meia-noite (o do dia anterior recebe o sufixo
+    .YYYY-MM-DD) e só é aberto no primeiro registro gravado.
+    
+    Args:
+        caminho: Arquivo de log
+        nivel: Nível mínimo dos registros gravados no arquivo
+        dias_retidos: Quantidade de arquivos rotacionados mantidos
+    
+    Returns:
+        logging.Handler: Handler criado (para remoção, se necessário)
+    """
+    handler = logging.handlers.TimedRotatingFileHandler(
+        caminho,
+        when='midnight',
+        backupCount=dias_retidos,
+        encoding='utf-8',
+        delay=True
+    )
+    handler.setLevel(nivel)
+    handler.setFormatter(_formatter)
+    log_listener.handlers = log_listener.handlers + (handler,)
+    return handler
\ No newline at end of file
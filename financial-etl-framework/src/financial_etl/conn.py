@@ -3,27 +3,128 @@ Módulo de conexão com banco de dados PostgreSQL.
 Utiliza variáveis de ambiente para segurança das credenciais.
 """
 
+import atexit
+import itertools
+import logging
 import os
+import re
+import threading
+import time
+import weakref
 import psycopg2
 from contextlib import contextmanager
-from typing import Generator, Dict, Any, Optional
+from contextvars import ContextVar
+from typing import Generator, Dict, Any, List, Optional, Sequence, Tuple
 from dotenv import load_dotenv
 from pathlib import Path
-from psycopg2.extensions import connection as Connection
+from psycopg2.extensions import connection as Connection, cursor as Cursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 # Carrega variáveis de ambiente do arquivo .env
 # Define o caminho do .env na raiz do projeto (2 níveis acima)
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+logger = logging.getLogger(__name__)
+
+# Consultas acima deste tempo são registradas no log (sem os parâmetros)
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 100))
+
+# Acumulador do tempo de SQL (ns) do contexto atual; a API define um por
+# requisição para montar o cabeçalho Server-Timing
+tempo_sql: ContextVar[Optional[List[int]]] = ContextVar('tempo_sql', default=None)
+
+
+class CursorCronometrado(Cursor):
+    """
+    Cursor que mede o tempo de cada execute/executemany.
+    
+    O tempo é somado ao acumulador de tempo_sql, quando houver, e consultas
+    mais lentas que DB_SLOW_QUERY_MS (padrão: 100 ms) são registradas com
+    o texto SQL apenas, sem os valores dos parâmetros.
+    """
+    
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter_ns()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._registrar_tempo(query, time.perf_counter_ns() - inicio)
+    
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter_ns()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._registrar_tempo(query, time.perf_counter_ns() - inicio)
+    
+    @staticmethod
+    def _registrar_tempo(query, duracao_ns: int) -> None:
+        acumulador = tempo_sql.get()
+        if acumulador is not None:
+            acumulador[0] += duracao_ns
+        
+        duracao_ms = duracao_ns / 1_000_000
+        if duracao_ms >= SLOW_QUERY_MS:
+            texto = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+            logger.warning("Consulta lenta (%.0f ms): %s", duracao_ms, ' '.join(texto.split())[:500])
+
+
+def _montar_config() -> Dict[str, Any]:
+    """
+    Monta os parâmetros de conexão a partir das variáveis de ambiente.
+    
+    Com DB_USE_UNIX_SOCKET=1 e DB_HOST local, a conexão usa o socket UNIX
+    do PostgreSQL (DB_SOCKET_DIR, padrão /var/run/postgresql) e dispensa
+    TLS, evitando a pilha TCP de loopback e a negociação SSL. Os cursores
+    criados são CursorCronometrado.
+    
+    Returns:
+        Dict[str, Any]: Argumentos para psycopg2.connect
+    """
+    cfg = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'database': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'cursor_factory': CursorCronometrado
+    }
+    
+    if os.getenv('DB_USE_UNIX_SOCKET') == '1' and cfg['host'] in ('localhost', '127.0.0.1'):
+        cfg['host'] = os.getenv('DB_SOCKET_DIR', '/var/run/postgresql')
+        cfg['sslmode'] = 'disable'
+    
+    return cfg
+
+
 # Configurações de conexão usando variáveis de ambiente
-config = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'database': os.getenv('DB_NAME'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'port': int(os.getenv('DB_PORT', 5432))
-}
+config = _montar_config()
+
+# Pool compartilhado pelo processo (API e scripts), criado sob demanda
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+# Limita os empréstimos simultâneos ao maxconn: com a API atendendo em
+# threadpool, threads excedentes aguardam uma conexão em vez de receber
+# PoolError imediato do ThreadedConnectionPool
+_pool_semaforo: Optional[threading.BoundedSemaphore] = None
+
+# Prepared statements já criados em cada conexão (PREPARE vale para a sessão).
+# None indica estado desconhecido após erro: a sessão é limpa no próximo uso.
+_preparados: "weakref.WeakKeyDictionary[Connection, Optional[set]]" = weakref.WeakKeyDictionary()
+_preparados_lock = threading.Lock()
+
+
+def _validar_credenciais() -> None:
+    """Garante que as credenciais obrigatórias estão definidas no ambiente."""
+    required_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
+    missing_vars = [var for var in required_vars if not os.getenv(var)]
+    
+    if missing_vars:
+        raise ValueError(
+            f"❌ Variáveis de ambiente obrigatórias não definidas: {', '.join(missing_vars)}\n"
+            f"Certifique-se de ter um arquivo .env na raiz do projeto com todas as credenciais."
+        )
 
 def get_connection() -> Connection:
     """
@@ -52,14 +153,7 @@ def get_connection() -> Connection:
                 conn.close()
     """
     # Validação de credenciais obrigatórias
-    required_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
-    
-    if missing_vars:
-        raise ValueError(
-            f"❌ Variáveis de ambiente obrigatórias não definidas: {', '.join(missing_vars)}\n"
-            f"Certifique-se de ter um arquivo .env na raiz do projeto com todas as credenciais."
-        )
+    _validar_credenciais()
     
     try:
         return psycopg2.connect(**config)
@@ -70,24 +164,189 @@ def get_connection() -> Connection:
         )
 
 
+def get_pool() -> ThreadedConnectionPool:
+    """
+    Retorna o pool de conexões do processo, criando-o na primeira chamada.
+    
+    O tamanho do pool é configurável via DB_POOL_MINCONN (padrão: 2) e
+    DB_POOL_MAXCONN (padrão: 20). Com todas as conexões emprestadas,
+    db_connection aguarda até DB_POOL_TIMEOUT segundos (padrão: 30).
+    
+    Returns:
+        ThreadedConnectionPool: Pool compartilhado entre threads.
+    
+    Raises:
+        psycopg2.Error: Se houver erro ao abrir as conexões iniciais.
+        ValueError: Se credenciais obrigatórias não estiverem definidas.
+    """
+    global _pool, _pool_semaforo
+    
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _validar_credenciais()
+                maxconn = int(os.getenv('DB_POOL_MAXCONN', 20))
+                try:
+                    _pool = ThreadedConnectionPool(
+                        minconn=int(os.getenv('DB_POOL_MINCONN', 2)),
+                        maxconn=maxconn,
+                        **config
+                    )
+                    _pool_semaforo = threading.BoundedSemaphore(maxconn)
+                except psycopg2.Error as e:
+                    raise psycopg2.Error(
+                        f"❌ Erro ao criar pool de conexões: {e}\n"
+                        f"Verifique suas credenciais no arquivo .env"
+                    )
+    
+    return _pool
+
+
+def close_pool() -> None:
+    """Fecha todas as conexões do pool (encerramento da aplicação/testes)."""
+    global _pool
+    
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+# Scripts agendados (DailyProcessor, relatórios) encerram sem chamar
+# close_pool: as conexões são fechadas de forma ordenada na saída
+atexit.register(close_pool)
+
+
 @contextmanager
 def db_connection() -> Generator[Connection, None, None]:
     """
     Context manager para gerenciar conexões de forma segura.
     Garante commit em caso de sucesso e rollback em caso de erro.
     
+    A conexão é emprestada do pool e devolvida ao final, evitando o
+    handshake TCP + autenticação a cada uso.
+    
     Yields:
         Connection: Conexão ativa com o banco de dados
     """
-    conn = None
+    pool = get_pool()
+    semaforo = _pool_semaforo
+    
+    if not semaforo.acquire(timeout=float(os.getenv('DB_POOL_TIMEOUT', 30))):
+        raise PoolError("❌ Nenhuma conexão livre no pool dentro do tempo limite")
+    
     try:
-        conn = get_connection()
-        yield conn
-        conn.commit()
-    except Exception:
-        if conn:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
             conn.rollback()
-        raise
+            raise
+        finally:
+            # Conexões quebradas são descartadas em vez de voltar ao pool
+            pool.putconn(conn, close=bool(conn.closed))
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        semaforo.release()
+
+
+def executar_preparado(
+    cursor,
+    nome: str,
+    sql: str,
+    params: Optional[Sequence[Any]] = None
+) -> None:
+    """
+    Executa uma consulta recorrente como prepared statement da sessão.
+    
+    Na primeira execução em cada conexão o PREPARE segue junto com o
+    EXECUTE (um único round-trip); nas seguintes, apenas o EXECUTE é
+    enviado. Como as conexões do pool são reaproveitadas, o parse e o
+    planejamento da consulta acontecem uma vez por conexão.
+    
+    Args:
+        cursor: Cursor psycopg2 (o resultado fica disponível nele)
+        nome: Nome do statement, único para cada texto SQL
+        sql: Consulta com parâmetros posicionais $1, $2, ...
+        params: Valores dos parâmetros, na mesma ordem
+    
+    Exemplo de uso:
+        executar_preparado(
+            cursor, 'divergencias_periodo',
+            "SELECT COUNT(*) FROM audit.divergencias_processadas "
+            "WHERE detectado_em BETWEEN $1 AND $2",
+            (data_inicio, data_fim)
+        )
+        total = cursor.fetchone()[0]
+    """
+    conn = cursor.connection
+    
+    with _preparados_lock:
+        preparados = _preparados.get(conn)
+        limpar_sessao = conn in _preparados and preparados is None
+        if preparados is None:
+            preparados = set()
+            _preparados[conn] = preparados
+    
+    comando = f"EXECUTE {nome}"
+    if params:
+        comando += "(" + ", ".join(["%s"] * len(params)) + ")"
+    
+    if nome not in preparados:
+        # Com parâmetros o texto passa pelo mogrify, então '%' é escapado
+        corpo = sql.replace('%', '%%') if params else sql
+        comando = f"PREPARE {nome} AS {corpo};\n{comando}"
+        if limpar_sessao:
+            comando = f"DEALLOCATE ALL;\n{comando}"
+    
+    try:
+        cursor.execute(comando, params or None)
+    except Exception:
+        # PREPARE não é desfeito pelo rollback: após um erro não se sabe
+        # quais statements existem na sessão
+        with _preparados_lock:
+            _preparados[conn] = None
+        raise
+    
+    preparados.add(nome)
+
+
+def variantes_consulta(
+    nome: str,
+    sql: str,
+    filtros: Sequence[str]
+) -> Dict[Tuple[bool, ...], Tuple[str, str]]:
+    """
+    Pré-gera as variantes de uma consulta com filtros opcionais.
+    
+    Cada combinação de filtros presentes vira um texto SQL fixo com nome
+    próprio, para ser executado com executar_preparado(): o texto não é
+    remontado a cada requisição e o plano de cada variante é reaproveitado
+    na conexão. Os parâmetros são marcados com '$' sem número e numerados
+    na ordem em que aparecem.
+    
+    Args:
+        nome: Prefixo do nome dos statements
+        sql: Consulta com o marcador {where} para as condições
+        filtros: Condições opcionais, na ordem dos parâmetros
+    
+    Returns:
+        Dict: (nome_statement, sql) indexado pela tupla de filtros ativos
+    
+    Exemplo de uso:
+        CONSULTAS = variantes_consulta(
+            'listar_sessoes',
+            "SELECT * FROM audit.sessoes_processamento WHERE {where} LIMIT $",
+            ["tipo_sessao = $", "status = $"]
+        )
+        statement, query = CONSULTAS[(bool(tipo_sessao), bool(status))]
+    """
+    variantes = {}
+    for indice, mascara in enumerate(itertools.product((False, True), repeat=len(filtros))):
+        ativos = [filtro for filtro, ativo in zip(filtros, mascara) if ativo]
+        texto = sql.format(where=" AND ".join(ativos) or "TRUE")
+        contador = itertools.count(1)
+        texto = re.sub(r'\$(?!\d)', lambda _: f"${next(contador)}", texto)
+        variantes[mascara] = (f"{nome}_{indice}", texto)
+    return variantes
+
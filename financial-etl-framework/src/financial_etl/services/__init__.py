@@ -10,13 +10,30 @@ Módulos:
     notification_service: Alertas e notificações via email
 """
 
-from .audit_logger import AuditLogger
-from .divergence_processor import DivergenceProcessor, Divergencia
-from .notification_service import NotificationService
-
-__all__ = [
-    'AuditLogger',
-    'DivergenceProcessor',
-    'Divergencia',
-    'NotificationService',
-]
+from importlib import import_module
+
+# Classes exportadas -> módulo que as define. Importadas sob demanda
+# (PEP 562): quem usa só a auditoria não carrega pandas nem smtplib/email
+_EXPORTS = {
+    'AuditLogger': '.audit_logger',
+    'ArquivoDivergencias': '.audit_logger',
+    'BufferDivergencias': '.audit_logger',
+    'DivergenceProcessor': '.divergence_processor',
+    'Divergencia': '.divergence_processor',
+    'NotificationService': '.notification_service',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    modulo = _EXPORTS.get(name)
+    if modulo is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    valor = getattr(import_module(modulo, __name__), name)
+    globals()[name] = valor
+    return valor
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -13,16 +13,278 @@ Data: 2026-01-08
 Versão: 1.0.0
 """
 
-import json
+import io
 import logging
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import os
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import date, datetime
+from typing import Optional, Dict, Any, List, Tuple, Union
 from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+import orjson
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extensions import AsIs
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from ..config import log_dir
+from ..conn import db_connection, executar_preparado, variantes_consulta
 
 logger = logging.getLogger(__name__)
 
+# Canal NOTIFY publicado a cada divergência registrada
+CANAL_DIVERGENCIAS = 'divergencia_new'
+
+# Buffer de divergências: gravação ao atingir o tamanho ou a cada intervalo
+AUDIT_BUFFER_MAX_SIZE = int(os.getenv('AUDIT_BUFFER_MAX_SIZE', 500))
+AUDIT_BUFFER_FLUSH_INTERVAL = float(os.getenv('AUDIT_BUFFER_FLUSH_INTERVAL', 2.0))
+# Limite de linhas em memória: acima dele registrar() espera a gravação por
+# até AUDIT_BUFFER_MAX_BLOCK_SECONDS e então grava a linha diretamente
+AUDIT_BUFFER_HIGH_WATER = int(os.getenv('AUDIT_BUFFER_HIGH_WATER', 5000))
+AUDIT_BUFFER_MAX_BLOCK_SECONDS = float(os.getenv('AUDIT_BUFFER_MAX_BLOCK_SECONDS', 5.0))
+# IDs reservados da sequência a cada ida ao banco
+AUDIT_BUFFER_BLOCO_IDS = 1000
+AUDIT_OPERACOES_BLOCO_IDS = 1000
+
+# Arquivo append-only de ArquivoDivergencias: sincronização em disco e linhas
+# por COPY na carga (carregar_arquivo_divergencias)
+AUDIT_AOF_PATH = os.getenv('AUDIT_AOF_PATH', str(log_dir / 'audit_divergencias.aof'))
+AUDIT_AOF_FSYNC_INTERVAL = float(os.getenv('AUDIT_AOF_FSYNC_INTERVAL', 1.0))
+AUDIT_AOF_LOTE = int(os.getenv('AUDIT_AOF_LOTE', 5000))
+
+# Modos de commit do AuditLogger e chamadas acumuladas por commit no 'group'
+COMMIT_MODES = ('immediate', 'group')
+AUDIT_COMMIT_A_CADA = int(os.getenv('AUDIT_COMMIT_A_CADA', 50))
+
+# Filtro de registrar_divergencia: 'all' grava todas; 'high_confidence_only'
+# só as com confidence_score >= AUDIT_DIVERGENCE_MIN_CONFIDENCE. A amostragem
+# (0.0 a 1.0) é determinística por idnfsexterno
+NIVEIS_DIVERGENCIA = ('all', 'high_confidence_only')
+AUDIT_DIVERGENCE_LEVEL = os.getenv('AUDIT_DIVERGENCE_LEVEL', 'all')
+AUDIT_DIVERGENCE_MIN_CONFIDENCE = float(os.getenv('AUDIT_DIVERGENCE_MIN_CONFIDENCE', 0.9))
+AUDIT_DIVERGENCE_SAMPLE_RATE = float(os.getenv('AUDIT_DIVERGENCE_SAMPLE_RATE', 1.0))
+
+# Linhas por comando nos INSERT em lote (execute_values)
+TAMANHO_PAGINA_LOTE = 500
+# Acima deste volume registrar_divergencias_batch usa COPY FROM STDIN
+LIMITE_LOTE_COPY = 1000
+
+# Partições mensais de audit.divergencias_processadas (divergencias_processadas_YYYYMM)
+# e meses completos mantidos antes do mês corrente
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', 24))
+_PREFIXO_PARTICAO = 'divergencias_processadas_'
+_RE_PARTICAO = re.compile(_PREFIXO_PARTICAO + r'(\d{4})(\d{2})')
+
+# Escapes do formato texto do COPY
+_ESCAPES_COPY = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+# Histórico de operações: uma variante preparada por combinação de filtros.
+# O PostgreSQL monta o JSON da lista inteira: uma linha de texto volta e é
+# decodificada de uma vez pelo orjson. O LIMIT fica na CTE para que o
+# json_agg veja apenas as linhas selecionadas
+CONSULTAS_HISTORICO = variantes_consulta(
+    'audit_historico_operacoes',
+    """
+    WITH ops AS (
+        SELECT 
+            id, tipo_operacao, descricao, usuario, origem,
+            tabela_afetada, registros_afetados, timestamp_inicio,
+            timestamp_fim, status
+        FROM audit.operacoes
+        WHERE {where}
+        ORDER BY timestamp_inicio DESC
+        LIMIT $
+    )
+    SELECT COALESCE(
+        json_agg(json_build_object(
+            'id', id,
+            'tipo_operacao', tipo_operacao,
+            'descricao', descricao,
+            'usuario', usuario,
+            'origem', origem,
+            'tabela_afetada', tabela_afetada,
+            'registros_afetados', registros_afetados,
+            'timestamp_inicio', timestamp_inicio,
+            'timestamp_fim', timestamp_fim,
+            'status', status
+        ) ORDER BY timestamp_inicio DESC),
+        '[]'
+    )::text
+    FROM ops
+    """,
+    [
+        "usuario = $",
+        "tabela_afetada = $",
+        "timestamp_inicio >= $",
+        "timestamp_inicio <= $",
+    ]
+)
+
+
+def _json_default(obj: Any) -> Any:
+    """Tipos que o orjson não serializa sozinho (NUMERIC chega como Decimal)."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Tipo nao serializavel em JSON: {type(obj).__name__}")
+
+
+def _dumps_json_bytes(obj: Any) -> bytes:
+    """Serializa com orjson (UTF-8), aceitando chaves não-string e Decimal."""
+    return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _dumps_json(obj: Any) -> str:
+    """Como _dumps_json_bytes, devolvendo str."""
+    return _dumps_json_bytes(obj).decode()
+
+
+class JsonRapido(Json):
+    """
+    Adaptador JSON do psycopg2 serializado com orjson.
+    
+    O literal gerado fica guardado na instância: a mesma instância usada
+    em várias linhas de um lote é serializada uma única vez.
+    
+    Em conexões UTF8 com standard_conforming_strings (o padrão), o literal
+    é montado direto dos bytes do orjson: sem decodificar para str,
+    recodificar e passar pelo escape da libpq, que dominam o custo em
+    payloads grandes como dados_anteriores.
+    """
+    
+    _literal: Optional[bytes] = None
+    
+    def dumps(self, obj: Any) -> str:
+        return _dumps_json(obj)
+    
+    def getquoted(self) -> bytes:
+        if self._literal is None:
+            if self._literal_direto():
+                # orjson escapa os caracteres de controle: só resta dobrar as aspas
+                self._literal = b"'" + _dumps_json_bytes(self.adapted).replace(b"'", b"''") + b"'"
+            else:
+                self._literal = super().getquoted()
+        return self._literal
+    
+    def _literal_direto(self) -> bool:
+        """Se a conexão aceita o literal UTF-8 sem escapes além das aspas."""
+        conn = self._conn
+        return (
+            isinstance(conn, psycopg2.extensions.connection)
+            and conn.encoding == 'UTF8'
+            and conn.info.parameter_status('standard_conforming_strings') == 'on'
+        )
+
+
+def _json_memo(cache: Dict[int, JsonRapido], obj: Any) -> Optional[JsonRapido]:
+    """
+    JsonRapido por objeto dentro de um lote (chave id(), válida enquanto o
+    lote existir): payloads compartilhados entre linhas são serializados uma vez.
+    """
+    if not obj:
+        return None
+    adaptado = cache.get(id(obj))
+    if adaptado is None:
+        adaptado = cache[id(obj)] = JsonRapido(obj)
+    return adaptado
+
+
+@lru_cache(maxsize=256)
+def _literal_regras_cache(regras: Tuple[str, ...]) -> AsIs:
+    """Literal ARRAY[...]::text[] de um conjunto de regras."""
+    return AsIs(
+        "ARRAY[" + ",".join("'" + regra.replace("'", "''") + "'" for regra in regras) + "]::text[]"
+    )
+
+
+def _literal_regras(regras: Optional[List[str]]) -> Any:
+    """
+    regras_aplicadas já adaptada para o SQL.
+    
+    As divergências de uma mesma regra repetem o mesmo conjunto de nomes:
+    o literal do array é montado uma vez por conjunto, em vez de o
+    psycopg2 adaptar a lista a cada linha. Nomes com barra invertida
+    seguem pela adaptação padrão.
+    """
+    if not regras:
+        return regras
+    chave = tuple(regras)
+    if any('\\' in regra for regra in chave):
+        return regras
+    return _literal_regras_cache(chave)
+
+
+def _reservar_ids(
+    cursor,
+    quantidade: int,
+    tabela: str = 'audit.divergencias_processadas'
+) -> List[int]:
+    """Reserva IDs da sequência de uma tabela em um único round-trip."""
+    cursor.execute(
+        """
+        SELECT nextval(pg_get_serial_sequence(%s, 'id'))
+        FROM generate_series(1, %s)
+        """,
+        (tabela, quantidade)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _proximo_id_reservado(ids: deque, lock: threading.Lock) -> int:
+    """
+    Entrega o próximo ID de audit.divergencias_processadas de um bloco
+    reservado, reservando outro bloco (conexão do pool) quando ele acaba.
+    """
+    with lock:
+        if not ids:
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    ids.extend(_reservar_ids(cursor, AUDIT_BUFFER_BLOCO_IDS))
+        return ids.popleft()
+
+
+def _inicio_mes(referencia: date, deslocamento: int = 0) -> date:
+    """Primeiro dia do mês de referencia deslocado em N meses."""
+    indice = referencia.year * 12 + referencia.month - 1 + deslocamento
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _campo_copy(valor: Any) -> str:
+    """Formata um valor como campo do COPY em formato texto."""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, dict):
+        valor = _dumps_json(valor)
+    elif isinstance(valor, (list, tuple)):
+        # Literal de array do PostgreSQL com os elementos entre aspas
+        valor = '{' + ','.join(
+            '"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for item in valor
+        ) + '}'
+    return str(valor).translate(_ESCAPES_COPY)
+
+
+def _payload_divergencia(
+    divergencia_id: int,
+    idnfsexterno: str,
+    tipo_divergencia: str,
+    campo_afetado: str,
+    competencia: Optional[str]
+) -> str:
+    """Payload JSON do NOTIFY de uma divergência registrada."""
+    return _dumps_json({
+        'id': divergencia_id,
+        'idnfsexterno': idnfsexterno,
+        'tipo_divergencia': tipo_divergencia,
+        'campo_afetado': campo_afetado,
+        'competencia': competencia
+    })
+
 
 class AuditLogger:
     """
@@ -46,15 +308,180 @@ class AuditLogger:
         >>> audit.finalizar_operacao(op_id, status='SUCCESS')
     """
     
-    def __init__(self, connection):
+    def __init__(
+        self,
+        connection,
+        buffer: Optional[Union['BufferDivergencias', 'ArquivoDivergencias']] = None,
+        commit_mode: str = 'immediate',
+        commit_a_cada: int = AUDIT_COMMIT_A_CADA,
+        adiar_inicio: bool = False,
+        nivel_divergencias: str = AUDIT_DIVERGENCE_LEVEL,
+        confianca_minima: float = AUDIT_DIVERGENCE_MIN_CONFIDENCE,
+        taxa_amostragem: float = AUDIT_DIVERGENCE_SAMPLE_RATE
+    ):
         """
         Inicializa o sistema de auditoria.
         
         Args:
             connection: Conexão psycopg2 ativa com o banco de dados
+            buffer: BufferDivergencias ou ArquivoDivergencias opcional; quando
+                informado, registrar_divergencia() delega a ele em vez de
+                gravar na hora
+            commit_mode: 'immediate' confirma cada chamada; 'group' confirma
+                a cada commit_a_cada chamadas, ao fim de operacao_auditada,
+                em finalizar_sessao_processamento ou em commit()
+            commit_a_cada: Chamadas acumuladas por commit no modo 'group'
+            adiar_inicio: iniciar_operacao() devolve um ID já reservado sem ir
+                ao banco; o INSERT segue junto com a próxima chamada de
+                escrita deste logger (timestamp_inicio vem do relógio local)
+            nivel_divergencias: Divergências gravadas por registrar_divergencia
+                ('all' ou 'high_confidence_only')
+            confianca_minima: Corte de confidence_score do 'high_confidence_only'
+            taxa_amostragem: Fração das notas cujas divergências são gravadas
+        
+        Raises:
+            ValueError: Se commit_mode ou nivel_divergencias for inválido
         """
+        if commit_mode not in COMMIT_MODES:
+            raise ValueError(
+                f"commit_mode invalido: {commit_mode}. Use um de {COMMIT_MODES}"
+            )
+        if nivel_divergencias not in NIVEIS_DIVERGENCIA:
+            raise ValueError(
+                f"nivel_divergencias invalido: {nivel_divergencias}. "
+                f"Use um de {NIVEIS_DIVERGENCIA}"
+            )
+        
         self.conn = connection
         self.cursor = connection.cursor()
+        self.buffer = buffer
+        self.commit_mode = commit_mode
+        self.commit_a_cada = commit_a_cada
+        self._pendentes = 0
+        self.adiar_inicio = adiar_inicio
+        self._ids_operacoes: deque = deque()
+        self._inicios_pendentes: List[tuple] = []
+        self.nivel_divergencias = nivel_divergencias
+        self.confianca_minima = confianca_minima
+        self.taxa_amostragem = taxa_amostragem
+        self.divergencias_descartadas = 0
+        # Finalizações de operacao_auditada aguardando o próximo combinador
+        self._finalizacoes: List[Dict[str, Any]] = []
+        self._combinador = threading.Lock()
+        self._finalizacoes_cond = threading.Condition()
+        # Sessões iniciadas com adiar=True ainda sem linha no banco
+        self._sessoes_adiadas: Dict[int, tuple] = {}
+    
+    @classmethod
+    @contextmanager
+    def conexao_dedicada(cls, **kwargs):
+        """
+        AuditLogger com uma conexão própria, emprestada do pool.
+        
+        Os commits e rollbacks da auditoria não afetam a transação do ETL
+        (e vice-versa): uma falha no ETL não apaga o registro da operação,
+        e o commit da auditoria não confirma alterações pela metade.
+        
+        Args:
+            **kwargs: Argumentos adicionais do construtor (buffer, commit_mode, ...)
+        
+        Yields:
+            AuditLogger: Instância ligada à conexão dedicada
+        
+        Exemplo:
+            >>> with db_connection() as conn, AuditLogger.conexao_dedicada() as audit:
+            ...     processor = DivergenceProcessor(conn, audit=audit)
+        """
+        with db_connection() as conn:
+            audit = cls(conn, **kwargs)
+            yield audit
+            audit.commit()
+    
+    def commit(self) -> None:
+        """Confirma as chamadas de auditoria ainda pendentes."""
+        self._gravar_inicios_pendentes()
+        self.conn.commit()
+        self._pendentes = 0
+    
+    def _abrir_chamada(self) -> None:
+        """
+        Prepara uma chamada de escrita: grava os inícios de operação
+        adiados e, no modo 'group', isola a chamada em um SAVEPOINT.
+        """
+        self._gravar_inicios_pendentes()
+        if self.commit_mode == 'group':
+            self.cursor.execute("SAVEPOINT audit_chamada")
+    
+    def _gravar_inicios_pendentes(self) -> None:
+        """INSERT único das operações iniciadas com adiar_inicio."""
+        if not self._inicios_pendentes:
+            return
+        
+        pendentes, self._inicios_pendentes = self._inicios_pendentes, []
+        execute_values(
+            self.cursor,
+            """
+            INSERT INTO audit.operacoes (
+                id, tipo_operacao, descricao, usuario, origem,
+                tabela_afetada, filtros_aplicados, query_executada,
+                timestamp_inicio, status, metadata
+            ) VALUES %s
+            """,
+            pendentes,
+            template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, 'PENDING', %s)",
+            page_size=TAMANHO_PAGINA_LOTE
+        )
+    
+    def _proximo_id_operacao(self) -> int:
+        """Entrega um ID reservado de audit.operacoes, reservando um novo bloco se preciso."""
+        if not self._ids_operacoes:
+            self._ids_operacoes.extend(
+                _reservar_ids(self.cursor, AUDIT_OPERACOES_BLOCO_IDS, 'audit.operacoes')
+            )
+        return self._ids_operacoes.popleft()
+    
+    def _deve_registrar(self, idnfsexterno: str, confidence_score: Optional[float]) -> bool:
+        """Aplica nível e amostragem a uma divergência, contando as descartadas."""
+        registrar = (
+            self.nivel_divergencias == 'all'
+            or (confidence_score is not None and confidence_score >= self.confianca_minima)
+        )
+        if registrar and self.taxa_amostragem < 1.0:
+            # Mesma nota, mesma decisão em todas as execuções
+            registrar = zlib.crc32(idnfsexterno.encode()) / 2**32 < self.taxa_amostragem
+        if not registrar:
+            self.divergencias_descartadas += 1
+        return registrar
+    
+    def _confirmar(self) -> None:
+        """Confirma a chamada agora ou a acumula para o próximo commit."""
+        if self.commit_mode == 'immediate':
+            self.conn.commit()
+            return
+        
+        self._pendentes += 1
+        if self._pendentes >= self.commit_a_cada:
+            self.commit()
+    
+    def _desfazer(self) -> None:
+        """
+        Desfaz a chamada que falhou.
+        
+        No modo 'group' volta só até o SAVEPOINT, preservando as chamadas
+        pendentes; se nem isso for possível, desfaz a transação inteira.
+        """
+        if self.commit_mode == 'group':
+            try:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT audit_chamada")
+                return
+            except psycopg2.Error:
+                logger.warning(
+                    "Transacao de auditoria abortada: %s chamadas pendentes descartadas",
+                    self._pendentes
+                )
+        
+        self.conn.rollback()
+        self._pendentes = 0
     
     def iniciar_operacao(
         self,
@@ -86,37 +513,122 @@ class AuditLogger:
         Raises:
             psycopg2.Error: Se houver erro ao registrar a operação
         """
+        if self.adiar_inicio:
+            operacao_id = self._proximo_id_operacao()
+            self._inicios_pendentes.append((
+                operacao_id,
+                tipo_operacao,
+                descricao,
+                usuario,
+                origem,
+                tabela_afetada,
+                JsonRapido(filtros_aplicados) if filtros_aplicados else None,
+                query_executada,
+                datetime.now(),
+                JsonRapido(metadata) if metadata else None
+            ))
+            logger.info("Operacao iniciada: ID=%s, tipo=%s", operacao_id, tipo_operacao)
+            return operacao_id
+        
         try:
+            self._abrir_chamada()
             query = """
             INSERT INTO audit.operacoes (
                 tipo_operacao, descricao, usuario, origem,
                 tabela_afetada, filtros_aplicados, query_executada,
                 timestamp_inicio, status, metadata
             ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, NOW(), 'PENDING', %s
+                $1, $2, $3, $4, $5, $6, $7, NOW(), 'PENDING', $8
             ) RETURNING id
             """
             
-            self.cursor.execute(query, (
+            executar_preparado(self.cursor, 'audit_iniciar_operacao', query, (
                 tipo_operacao,
                 descricao,
                 usuario,
                 origem,
                 tabela_afetada,
-                Json(filtros_aplicados) if filtros_aplicados else None,
+                JsonRapido(filtros_aplicados) if filtros_aplicados else None,
                 query_executada,
-                Json(metadata) if metadata else None
+                JsonRapido(metadata) if metadata else None
             ))
             
             operacao_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            self._confirmar()
             
-            logger.info(f"Operacao iniciada: ID={operacao_id}, tipo={tipo_operacao}")
+            logger.info("Operacao iniciada: ID=%s, tipo=%s", operacao_id, tipo_operacao)
             return operacao_id
             
         except psycopg2.Error as e:
-            logger.error(f"Erro ao iniciar operacao de auditoria: {e}")
-            self.conn.rollback()
+            logger.error("Erro ao iniciar operacao de auditoria: %s", e)
+            self._desfazer()
+            raise
+    
+    def iniciar_operacoes_batch(
+        self,
+        operacoes: List[Dict[str, Any]]
+    ) -> List[int]:
+        """
+        Inicia várias operações em um único INSERT (execute_values).
+        
+        Args:
+            operacoes: Lista de dicionários com os mesmos argumentos de
+                iniciar_operacao() (tipo_operacao, descricao, usuario,
+                origem e, opcionalmente, tabela_afetada, filtros_aplicados,
+                query_executada, metadata)
+        
+        Returns:
+            List[int]: IDs das operações criadas, na ordem recebida
+        
+        Raises:
+            psycopg2.Error: Se houver erro ao registrar as operações
+        """
+        if not operacoes:
+            return []
+        
+        try:
+            self._abrir_chamada()
+            query = """
+            INSERT INTO audit.operacoes (
+                tipo_operacao, descricao, usuario, origem,
+                tabela_afetada, filtros_aplicados, query_executada,
+                timestamp_inicio, status, metadata
+            ) VALUES %s
+            RETURNING id
+            """
+            
+            jsons = {}
+            valores = [
+                (
+                    op['tipo_operacao'],
+                    op['descricao'],
+                    op['usuario'],
+                    op['origem'],
+                    op.get('tabela_afetada'),
+                    _json_memo(jsons, op.get('filtros_aplicados')),
+                    op.get('query_executada'),
+                    _json_memo(jsons, op.get('metadata'))
+                )
+                for op in operacoes
+            ]
+            
+            # RETURNING preserva a ordem dos VALUES e execute_values
+            # concatena as páginas na ordem em que foram enviadas
+            rows = execute_values(
+                self.cursor, query, valores,
+                template="(%s, %s, %s, %s, %s, %s, %s, NOW(), 'PENDING', %s)",
+                page_size=TAMANHO_PAGINA_LOTE,
+                fetch=True
+            )
+            self._confirmar()
+            
+            operacao_ids = [row[0] for row in rows]
+            logger.info("Operacoes iniciadas em lote: %d", len(operacao_ids))
+            return operacao_ids
+        
+        except psycopg2.Error as e:
+            logger.error("Erro ao iniciar operacoes em lote: %s", e)
+            self._desfazer()
             raise
     
     def finalizar_operacao(
@@ -135,7 +647,8 @@ class AuditLogger:
             operacao_id: ID da operação retornado por iniciar_operacao()
             status: Status final (SUCCESS, FAILED, ROLLED_BACK)
             registros_afetados: Quantidade de registros modificados
-            dados_anteriores: Lista com estado anterior dos dados (para rollback)
+            dados_anteriores: Lista com estado anterior dos dados (para rollback);
+                se omitido, mantém o que gravar_dados_por_consulta() registrou
             dados_posteriores: Lista com estado posterior dos dados
             erro_mensagem: Mensagem de erro se status = FAILED
         
@@ -143,38 +656,148 @@ class AuditLogger:
             psycopg2.Error: Se houver erro ao finalizar a operação
         """
         try:
+            self._abrir_chamada()
             query = """
             UPDATE audit.operacoes
             SET 
                 timestamp_fim = NOW(),
-                duracao_segundos = EXTRACT(EPOCH FROM (NOW() - timestamp_inicio)),
-                status = %s,
-                registros_afetados = %s,
-                dados_anteriores = %s,
-                dados_posteriores = %s,
-                erro_mensagem = %s
-            WHERE id = %s
+                status = $1,
+                registros_afetados = $2,
+                dados_anteriores = COALESCE($3, dados_anteriores),
+                dados_posteriores = COALESCE($4, dados_posteriores),
+                erro_mensagem = $5
+            WHERE id = $6
             """
             
-            self.cursor.execute(query, (
+            executar_preparado(self.cursor, 'audit_finalizar_operacao', query, (
                 status,
                 registros_afetados,
-                Json(dados_anteriores) if dados_anteriores else None,
-                Json(dados_posteriores) if dados_posteriores else None,
+                JsonRapido(dados_anteriores) if dados_anteriores else None,
+                JsonRapido(dados_posteriores) if dados_posteriores else None,
                 erro_mensagem,
                 operacao_id
             ))
             
-            self.conn.commit()
+            self._confirmar()
             
             logger.info(
-                f"Operacao finalizada: ID={operacao_id}, status={status}, "
-                f"registros={registros_afetados}"
+                "Operacao finalizada: ID=%s, status=%s, registros=%s",
+                operacao_id, status, registros_afetados
+            )
+            
+        except psycopg2.Error as e:
+            logger.error("Erro ao finalizar operacao %s: %s", operacao_id, e)
+            self._desfazer()
+            raise
+    
+    def gravar_dados_por_consulta(
+        self,
+        operacao_id: int,
+        sql: str,
+        params: Optional[Tuple] = None,
+        coluna: str = 'dados_anteriores'
+    ) -> None:
+        """
+        Grava em dados_anteriores/dados_posteriores o resultado de uma consulta.
+        
+        As linhas são convertidas em JSONB pelo próprio PostgreSQL
+        (jsonb_agg), sem trazer o estado para o Python e serializá-lo de
+        volta. Para dados_anteriores, chame antes de alterar os dados.
+        
+        Args:
+            operacao_id: ID da operação retornado por iniciar_operacao()
+            sql: SELECT com as linhas a registrar (parâmetros %s)
+            params: Parâmetros do SELECT
+            coluna: 'dados_anteriores' ou 'dados_posteriores'
+        
+        Raises:
+            ValueError: Se a coluna for inválida
+            psycopg2.Error: Se houver erro ao gravar os dados
+        """
+        if coluna not in ('dados_anteriores', 'dados_posteriores'):
+            raise ValueError(f"Coluna invalida: {coluna}")
+        
+        try:
+            self._abrir_chamada()
+            self.cursor.execute(
+                f"""
+                UPDATE audit.operacoes
+                SET {coluna} = (SELECT jsonb_agg(to_jsonb(t)) FROM ({sql}) t)
+                WHERE id = %s
+                """,
+                (*(params or ()), operacao_id)
+            )
+            self._confirmar()
+        
+        except psycopg2.Error as e:
+            logger.error("Erro ao gravar %s da operacao %s: %s", coluna, operacao_id, e)
+            self._desfazer()
+            raise
+    
+    def finalizar_operacoes_batch(
+        self,
+        finalizacoes: List[Dict[str, Any]]
+    ) -> int:
+        """
+        Finaliza várias operações em um único UPDATE (execute_values).
+        
+        Args:
+            finalizacoes: Lista de dicionários com os mesmos argumentos de
+                finalizar_operacao() (operacao_id, status e, opcionalmente,
+                registros_afetados, dados_anteriores, dados_posteriores,
+                erro_mensagem)
+        
+        Returns:
+            int: Quantidade de operações finalizadas
+        
+        Raises:
+            psycopg2.Error: Se houver erro ao finalizar as operações
+        """
+        if not finalizacoes:
+            return 0
+        
+        try:
+            self._abrir_chamada()
+            query = """
+            UPDATE audit.operacoes o
+            SET 
+                timestamp_fim = NOW(),
+                status = v.status,
+                registros_afetados = v.registros,
+                dados_anteriores = COALESCE(v.anteriores, o.dados_anteriores),
+                dados_posteriores = COALESCE(v.posteriores, o.dados_posteriores),
+                erro_mensagem = v.erro
+            FROM (VALUES %s) AS v(id, status, registros, anteriores, posteriores, erro)
+            WHERE o.id = v.id
+            """
+            
+            jsons = {}
+            execute_values(
+                self.cursor, query,
+                [
+                    (
+                        fin['operacao_id'],
+                        fin['status'],
+                        fin.get('registros_afetados', 0),
+                        _json_memo(jsons, fin.get('dados_anteriores')),
+                        _json_memo(jsons, fin.get('dados_posteriores')),
+                        fin.get('erro_mensagem')
+                    )
+                    for fin in finalizacoes
+                ],
+                template="(%s::integer, %s, %s::integer, %s::jsonb, %s::jsonb, %s::text)",
+                page_size=len(finalizacoes)
             )
+            finalizadas = self.cursor.rowcount
             
+            self._confirmar()
+            
+            logger.info("Operacoes finalizadas em lote: %s", finalizadas)
+            return finalizadas
+        
         except psycopg2.Error as e:
-            logger.error(f"Erro ao finalizar operacao {operacao_id}: {e}")
-            self.conn.rollback()
+            logger.error("Erro ao finalizar operacoes em lote: %s", e)
+            self._desfazer()
             raise
     
     @contextmanager
@@ -192,6 +815,10 @@ class AuditLogger:
         Garante que a operação seja iniciada, executada e finalizada
         corretamente, mesmo em caso de exceções.
         
+        Com várias threads usando o mesmo logger, as finalizações são
+        combinadas: a thread que obtém a vez finaliza as operações de todas
+        as que estão esperando em um único UPDATE e um único commit.
+        
         Args:
             tipo_operacao: Tipo da operação (INSERT, UPDATE, DELETE, etc)
             descricao: Descrição da operação
@@ -214,18 +841,75 @@ class AuditLogger:
         
         try:
             yield operacao_id
-            self.finalizar_operacao(operacao_id, status='SUCCESS')
-            
         except Exception as e:
             erro_msg = f"{type(e).__name__}: {str(e)}"
-            self.finalizar_operacao(
-                operacao_id,
-                status='FAILED',
-                erro_mensagem=erro_msg
-            )
-            logger.error(f"Operacao {operacao_id} falhou: {erro_msg}")
+            self._finalizar_combinado({
+                'operacao_id': operacao_id,
+                'status': 'FAILED',
+                'erro_mensagem': erro_msg
+            })
+            logger.error("Operacao %s falhou: %s", operacao_id, erro_msg)
             raise
     
+        self._finalizar_combinado({'operacao_id': operacao_id, 'status': 'SUCCESS'})
+    
+    def _finalizar_combinado(self, finalizacao: Dict[str, Any]) -> None:
+        """
+        Enfileira a finalização e espera algum combinador gravá-la.
+        
+        Quem obtém o lock de combinação esvazia a fila com
+        finalizar_operacoes_batch() e confirma tudo em um commit (fim da
+        operação é fronteira de transação também no modo 'group'). As demais
+        threads esperam na condição até o seu pedido ser gravado, ou até o
+        lock ficar livre para tentarem combinar elas mesmas.
+        
+        Raises:
+            psycopg2.Error: Se o lote que continha esta finalização falhar
+        """
+        pedido = {'finalizacao': finalizacao, 'feito': False, 'erro': None}
+        with self._finalizacoes_cond:
+            self._finalizacoes.append(pedido)
+        
+        while True:
+            if self._combinador.acquire(blocking=False):
+                try:
+                    self._combinar_finalizacoes()
+                finally:
+                    with self._finalizacoes_cond:
+                        self._combinador.release()
+                        self._finalizacoes_cond.notify_all()
+            
+            with self._finalizacoes_cond:
+                if pedido['feito']:
+                    break
+                # Solto entre o acquire e aqui: tenta combinar de novo
+                if self._combinador.locked():
+                    self._finalizacoes_cond.wait()
+        
+        if pedido['erro'] is not None:
+            raise pedido['erro']
+    
+    def _combinar_finalizacoes(self) -> None:
+        """Grava as finalizações enfileiradas até a fila ficar vazia; chamado com o lock."""
+        while True:
+            with self._finalizacoes_cond:
+                lote, self._finalizacoes = self._finalizacoes, []
+            if not lote:
+                return
+            
+            erro = None
+            try:
+                self.finalizar_operacoes_batch([p['finalizacao'] for p in lote])
+                self.commit()
+            except psycopg2.Error as e:
+                erro = e
+            
+            with self._finalizacoes_cond:
+                for p in lote:
+                    p['feito'] = True
+                    p['erro'] = erro
+                self._finalizacoes_cond.notify_all()
+    
     def registrar_divergencia(
         self,
         operacao_id: int,
@@ -237,7 +921,8 @@ class AuditLogger:
         competencia: Optional[str] = None,
         confidence_score: Optional[float] = None,
         regras_aplicadas: Optional[List[str]] = None,
-        dados_contextuais: Optional[Dict] = None
+        dados_contextuais: Optional[Dict] = None,
+        filtrar: bool = True
     ) -> int:
         """
         Registra uma divergência detectada no sistema.
@@ -253,23 +938,49 @@ class AuditLogger:
             confidence_score: Score de confiança (0.0 a 1.0)
             regras_aplicadas: Lista de regras que detectaram a divergência
             dados_contextuais: Dados adicionais relevantes
+            filtrar: Aplica nivel_divergencias e taxa_amostragem; usar False
+                para divergências que precisam ser gravadas (fila de aprovação)
         
         Returns:
-            int: ID da divergência registrada
+            int: ID da divergência registrada, ou -1 se foi descartada pelo filtro
         """
-        try:
-            query = """
-            INSERT INTO audit.divergencias_processadas (
+        if filtrar and not self._deve_registrar(idnfsexterno, confidence_score):
+            return -1
+        
+        if self.buffer is not None:
+            return self.buffer.registrar(
                 operacao_id, idnfsexterno, tipo_divergencia,
                 valor_anterior, valor_sugerido, campo_afetado,
-                competencia, status_processamento, detectado_em,
-                confidence_score, regras_aplicadas, dados_contextuais
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, 'DETECTED', NOW(), %s, %s, %s
-            ) RETURNING id
+                competencia, confidence_score, regras_aplicadas, dados_contextuais
+            )
+        
+        try:
+            self._abrir_chamada()
+            # O NOTIFY avisa os clientes de /divergencias/ws e sai da linha
+            # inserida no mesmo comando; o PostgreSQL só o entrega se a
+            # transação for confirmada
+            query = f"""
+            WITH inserida AS (
+                INSERT INTO audit.divergencias_processadas (
+                    operacao_id, idnfsexterno, tipo_divergencia,
+                    valor_anterior, valor_sugerido, campo_afetado,
+                    competencia, status_processamento, detectado_em,
+                    confidence_score, regras_aplicadas, dados_contextuais
+                ) VALUES (
+                    $1, $2, $3, $4, $5, $6, $7, 'DETECTED', NOW(), $8, $9, $10
+                ) RETURNING id, idnfsexterno, tipo_divergencia, campo_afetado, competencia
+            )
+            SELECT id, pg_notify('{CANAL_DIVERGENCIAS}', json_build_object(
+                'id', id,
+                'idnfsexterno', idnfsexterno,
+                'tipo_divergencia', tipo_divergencia,
+                'campo_afetado', campo_afetado,
+                'competencia', competencia
+            )::text)
+            FROM inserida
             """
             
-            self.cursor.execute(query, (
+            executar_preparado(self.cursor, 'audit_registrar_divergencia', query, (
                 operacao_id,
                 idnfsexterno,
                 tipo_divergencia,
@@ -278,25 +989,177 @@ class AuditLogger:
                 campo_afetado,
                 competencia,
                 confidence_score,
-                regras_aplicadas,
-                Json(dados_contextuais) if dados_contextuais else None
+                _literal_regras(regras_aplicadas),
+                JsonRapido(dados_contextuais) if dados_contextuais else None
             ))
             
             divergencia_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            self._confirmar()
             
             logger.info(
-                f"Divergencia registrada: ID={divergencia_id}, "
-                f"tipo={tipo_divergencia}, idnf={idnfsexterno}"
+                "Divergencia registrada: ID=%s, tipo=%s, idnf=%s",
+                divergencia_id, tipo_divergencia, idnfsexterno
             )
             
             return divergencia_id
             
         except psycopg2.Error as e:
-            logger.error(f"Erro ao registrar divergencia: {e}")
-            self.conn.rollback()
+            logger.error("Erro ao registrar divergencia: %s", e)
+            self._desfazer()
             raise
     
+    def registrar_divergencias_batch(
+        self,
+        operacao_id: int,
+        divergencias: List[Dict[str, Any]],
+        filtrar: bool = True
+    ) -> List[int]:
+        """
+        Registra várias divergências em um único INSERT (execute_values).
+        
+        Args:
+            operacao_id: ID da operação que detectou as divergências
+            divergencias: Lista de dicionários com os mesmos argumentos de
+                registrar_divergencia() (idnfsexterno, tipo_divergencia,
+                valor_anterior, valor_sugerido, campo_afetado e, opcionalmente,
+                competencia, confidence_score, regras_aplicadas, dados_contextuais)
+            filtrar: Aplica nivel_divergencias e taxa_amostragem (ver registrar_divergencia)
+        
+        Returns:
+            List[int]: IDs das divergências registradas, na ordem recebida
+                (-1 nas descartadas pelo filtro)
+        
+        Raises:
+            psycopg2.Error: Se houver erro ao registrar as divergências
+        """
+        mascara = [
+            not filtrar or self._deve_registrar(div['idnfsexterno'], div.get('confidence_score'))
+            for div in divergencias
+        ]
+        selecionadas = [div for div, registrar in zip(divergencias, mascara) if registrar]
+        if not selecionadas:
+            return [-1] * len(divergencias)
+        
+        try:
+            self._abrir_chamada()
+            if len(selecionadas) > LIMITE_LOTE_COPY:
+                divergencia_ids = self._copiar_divergencias(operacao_id, selecionadas)
+            else:
+                divergencia_ids = self._inserir_divergencias(operacao_id, selecionadas)
+            
+            # Um NOTIFY por divergência, enviados no mesmo round-trip
+            self.cursor.execute(
+                "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                (CANAL_DIVERGENCIAS, [
+                    _payload_divergencia(
+                        divergencia_id, div['idnfsexterno'], div['tipo_divergencia'],
+                        div['campo_afetado'], div.get('competencia')
+                    )
+                    for divergencia_id, div in zip(divergencia_ids, selecionadas)
+                ])
+            )
+            self._confirmar()
+            
+            logger.info(
+                "Divergencias registradas em lote: %d, operacao=%s",
+                len(divergencia_ids), operacao_id
+            )
+            registradas = iter(divergencia_ids)
+            return [next(registradas) if registrar else -1 for registrar in mascara]
+        
+        except psycopg2.Error as e:
+            logger.error("Erro ao registrar divergencias em lote: %s", e)
+            self._desfazer()
+            raise
+    
+    def _inserir_divergencias(
+        self,
+        operacao_id: int,
+        divergencias: List[Dict[str, Any]]
+    ) -> List[int]:
+        """INSERT ... VALUES em páginas (execute_values), sem commit."""
+        query = """
+        INSERT INTO audit.divergencias_processadas (
+            operacao_id, idnfsexterno, tipo_divergencia,
+            valor_anterior, valor_sugerido, campo_afetado,
+            competencia, status_processamento, detectado_em,
+            confidence_score, regras_aplicadas, dados_contextuais
+        ) VALUES %s
+        RETURNING id
+        """
+        
+        jsons = {}
+        valores = [
+            (
+                operacao_id,
+                div['idnfsexterno'],
+                div['tipo_divergencia'],
+                div['valor_anterior'],
+                div['valor_sugerido'],
+                div['campo_afetado'],
+                div.get('competencia'),
+                div.get('confidence_score'),
+                _literal_regras(div.get('regras_aplicadas')),
+                _json_memo(jsons, div.get('dados_contextuais'))
+            )
+            for div in divergencias
+        ]
+        
+        # RETURNING preserva a ordem dos VALUES e execute_values
+        # concatena as páginas na ordem em que foram enviadas
+        rows = execute_values(
+            self.cursor, query, valores,
+            template="(%s, %s, %s, %s, %s, %s, %s, 'DETECTED', NOW(), %s, %s, %s)",
+            page_size=TAMANHO_PAGINA_LOTE,
+            fetch=True
+        )
+        return [row[0] for row in rows]
+    
+    def _copiar_divergencias(
+        self,
+        operacao_id: int,
+        divergencias: List[Dict[str, Any]]
+    ) -> List[int]:
+        """
+        COPY FROM STDIN para lotes grandes, sem commit.
+        
+        COPY não devolve os IDs gerados, então eles são reservados antes
+        na sequência e enviados junto com as linhas.
+        """
+        divergencia_ids = _reservar_ids(self.cursor, len(divergencias))
+        
+        buffer = io.StringIO()
+        for divergencia_id, div in zip(divergencia_ids, divergencias):
+            buffer.write('\t'.join(map(_campo_copy, (
+                divergencia_id,
+                operacao_id,
+                div['idnfsexterno'],
+                div['tipo_divergencia'],
+                div['valor_anterior'],
+                div['valor_sugerido'],
+                div['campo_afetado'],
+                div.get('competencia'),
+                'DETECTED',
+                div.get('confidence_score'),
+                div.get('regras_aplicadas'),
+                div.get('dados_contextuais') or None
+            ))))
+            buffer.write('\n')
+        buffer.seek(0)
+        
+        self.cursor.copy_expert(
+            """
+            COPY audit.divergencias_processadas (
+                id, operacao_id, idnfsexterno, tipo_divergencia,
+                valor_anterior, valor_sugerido, campo_afetado,
+                competencia, status_processamento,
+                confidence_score, regras_aplicadas, dados_contextuais
+            ) FROM STDIN WITH (FORMAT text)
+            """,
+            buffer
+        )
+        return divergencia_ids
+    
     def atualizar_status_divergencia(
         self,
         divergencia_id: int,
@@ -316,18 +1179,19 @@ class AuditLogger:
             motivo_rejeicao: Motivo da rejeição (se aplicável)
         """
         try:
+            self._abrir_chamada()
             query = """
             UPDATE audit.divergencias_processadas
             SET 
-                status_processamento = %s,
-                valor_aplicado = %s,
+                status_processamento = $1,
+                valor_aplicado = $2,
                 processado_em = NOW(),
-                processado_por = %s,
-                motivo_rejeicao = %s
-            WHERE id = %s
+                processado_por = $3,
+                motivo_rejeicao = $4
+            WHERE id = $5
             """
             
-            self.cursor.execute(query, (
+            executar_preparado(self.cursor, 'audit_atualizar_status_divergencia', query, (
                 novo_status,
                 valor_aplicado,
                 processado_por,
@@ -335,23 +1199,86 @@ class AuditLogger:
                 divergencia_id
             ))
             
-            self.conn.commit()
+            self._confirmar()
             
             logger.info(
-                f"Status divergencia atualizado: ID={divergencia_id}, "
-                f"status={novo_status}"
+                "Status divergencia atualizado: ID=%s, status=%s",
+                divergencia_id, novo_status
+            )
+            
+        except psycopg2.Error as e:
+            logger.error("Erro ao atualizar divergencia %s: %s", divergencia_id, e)
+            self._desfazer()
+            raise
+    
+    def atualizar_status_divergencia_batch(
+        self,
+        valores: List[Tuple[int, Optional[float]]],
+        novo_status: str,
+        processado_por: Optional[str] = None,
+        motivo_rejeicao: Optional[str] = None
+    ) -> int:
+        """
+        Atualiza o status de várias divergências em um único UPDATE.
+        
+        Args:
+            valores: Lista de (divergencia_id, valor_aplicado); IDs -1
+                (divergências não registradas) são ignorados
+            novo_status: Novo status (APPROVED, REJECTED, AUTO_APPLIED)
+            processado_por: Identificador de quem processou
+            motivo_rejeicao: Motivo da rejeição (se aplicável)
+        
+        Returns:
+            int: Quantidade de divergências atualizadas
+        """
+        valores = [(divergencia_id, valor) for divergencia_id, valor in valores if divergencia_id >= 0]
+        if not valores:
+            return 0
+        
+        try:
+            self._abrir_chamada()
+            query = """
+            UPDATE audit.divergencias_processadas d
+            SET 
+                status_processamento = v.status,
+                valor_aplicado = v.valor,
+                processado_em = NOW(),
+                processado_por = v.processado_por,
+                motivo_rejeicao = v.motivo
+            FROM (VALUES %s) AS v(id, valor, status, processado_por, motivo)
+            WHERE d.id = v.id
+            """
+            
+            execute_values(
+                self.cursor, query,
+                [
+                    (divergencia_id, valor, novo_status, processado_por, motivo_rejeicao)
+                    for divergencia_id, valor in valores
+                ],
+                template="(%s::integer, %s::numeric, %s, %s, %s)",
+                page_size=len(valores)
             )
+            atualizadas = self.cursor.rowcount
+            
+            self._confirmar()
             
+            logger.info(
+                "Status de %s divergencias atualizado em lote: status=%s",
+                atualizadas, novo_status
+            )
+            return atualizadas
+        
         except psycopg2.Error as e:
-            logger.error(f"Erro ao atualizar divergencia {divergencia_id}: {e}")
-            self.conn.rollback()
+            logger.error("Erro ao atualizar divergencias em lote: %s", e)
+            self._desfazer()
             raise
     
     def iniciar_sessao_processamento(
         self,
         tipo_sessao: str,
         parametros_execucao: Optional[Dict] = None,
-        ambiente: str = 'PRODUCTION'
+        ambiente: str = 'PRODUCTION',
+        adiar: bool = False
     ) -> int:
         """
         Inicia uma nova sessão de processamento automatizado.
@@ -360,11 +1287,27 @@ class AuditLogger:
             tipo_sessao: Tipo (DAILY_AUTO, MANUAL_RUN, REPROCESSING)
             parametros_execucao: Parâmetros utilizados na execução
             ambiente: Ambiente de execução (PRODUCTION, STAGING, DEVELOPMENT)
+            adiar: Só reserva o ID; a linha é gravada por gravar_inicio_sessao()
+                ou, em sessões curtas, por um único INSERT em
+                finalizar_sessao_processamento() (neste mesmo logger)
         
         Returns:
             int: ID da sessão criada
         """
+        if adiar:
+            # nextval não é desfeito nem precisa de commit: nada a confirmar
+            sessao_id = _reservar_ids(self.cursor, 1, 'audit.sessoes_processamento')[0]
+            self._sessoes_adiadas[sessao_id] = (
+                tipo_sessao,
+                datetime.now(),
+                JsonRapido(parametros_execucao) if parametros_execucao else None,
+                ambiente
+            )
+            logger.info("Sessao de processamento reservada: ID=%s", sessao_id)
+            return sessao_id
+        
         try:
+            self._abrir_chamada()
             query = """
             INSERT INTO audit.sessoes_processamento (
                 tipo_sessao, inicio_processamento, status,
@@ -376,19 +1319,54 @@ class AuditLogger:
             
             self.cursor.execute(query, (
                 tipo_sessao,
-                Json(parametros_execucao) if parametros_execucao else None,
+                JsonRapido(parametros_execucao) if parametros_execucao else None,
                 ambiente
             ))
             
             sessao_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            self._confirmar()
             
-            logger.info(f"Sessao de processamento iniciada: ID={sessao_id}")
+            logger.info("Sessao de processamento iniciada: ID=%s", sessao_id)
             return sessao_id
             
         except psycopg2.Error as e:
-            logger.error(f"Erro ao iniciar sessao: {e}")
-            self.conn.rollback()
+            logger.error("Erro ao iniciar sessao: %s", e)
+            self._desfazer()
+            raise
+    
+    def gravar_inicio_sessao(self, sessao_id: int) -> None:
+        """
+        Grava agora a linha RUNNING de uma sessão iniciada com adiar=True.
+        
+        Para sessões que vão demorar (ex.: há correções a aplicar), deixa a
+        sessão visível enquanto roda. Não faz nada se a linha já existe.
+        
+        Args:
+            sessao_id: ID devolvido por iniciar_sessao_processamento()
+        """
+        adiada = self._sessoes_adiadas.get(sessao_id)
+        if adiada is None:
+            return
+        
+        try:
+            self._abrir_chamada()
+            self.cursor.execute(
+                """
+                INSERT INTO audit.sessoes_processamento (
+                    id, tipo_sessao, inicio_processamento, status,
+                    parametros_execucao, ambiente
+                ) VALUES (%s, %s, %s, 'RUNNING', %s, %s)
+                """,
+                (sessao_id, *adiada)
+            )
+            self._confirmar()
+            del self._sessoes_adiadas[sessao_id]
+            
+            logger.info("Sessao de processamento iniciada: ID=%s", sessao_id)
+        
+        except psycopg2.Error as e:
+            logger.error("Erro ao gravar inicio da sessao %s: %s", sessao_id, e)
+            self._desfazer()
             raise
     
     def finalizar_sessao_processamento(
@@ -408,49 +1386,156 @@ class AuditLogger:
             metricas: Dicionário com métricas da sessão
             resultado_geral: Resumo textual do resultado
             log_completo: Log completo da execução
+        
+        As divergências descartadas pelo filtro entram em uma cópia de
+        metricas, como 'divergencias_nao_registradas', e no resultado_geral.
+        Uma sessão adiada ainda sem linha é gravada completa em um INSERT.
         """
+        if self.divergencias_descartadas:
+            metricas = {**metricas, 'divergencias_nao_registradas': self.divergencias_descartadas}
+            resultado_geral = (
+                f"{resultado_geral or ''} {self.divergencias_descartadas} divergencias "
+                f"nao registradas (nivel={self.nivel_divergencias}, "
+                f"amostragem={self.taxa_amostragem})"
+            ).strip()
+        
+        valores = (
+            status,
+            metricas.get('total_registros_analisados', 0),
+            metricas.get('divergencias_detectadas', 0),
+            metricas.get('correcoes_aplicadas', 0),
+            metricas.get('correcoes_pendentes', 0),
+            metricas.get('erros_encontrados', 0),
+            resultado_geral,
+            log_completo
+        )
+        adiada = self._sessoes_adiadas.get(sessao_id)
+        
         try:
-            query = """
-            UPDATE audit.sessoes_processamento
-            SET 
-                fim_processamento = NOW(),
-                duracao_total_segundos = EXTRACT(EPOCH FROM (NOW() - inicio_processamento))::INTEGER,
-                status = %s,
-                total_registros_analisados = %s,
-                divergencias_detectadas = %s,
-                correcoes_aplicadas = %s,
-                correcoes_pendentes = %s,
-                erros_encontrados = %s,
-                resultado_geral = %s,
-                log_completo = %s
-            WHERE id = %s
-            """
+            self._abrir_chamada()
+            if adiada is not None:
+                # Sessão curta: início e fim em um único INSERT
+                self.cursor.execute(
+                    """
+                    INSERT INTO audit.sessoes_processamento (
+                        status, total_registros_analisados, divergencias_detectadas,
+                        correcoes_aplicadas, correcoes_pendentes, erros_encontrados,
+                        resultado_geral, log_completo,
+                        id, tipo_sessao, inicio_processamento,
+                        parametros_execucao, ambiente, fim_processamento
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                    """,
+                    (*valores, sessao_id, *adiada)
+                )
+            else:
+                query = """
+                UPDATE audit.sessoes_processamento
+                SET 
+                    fim_processamento = NOW(),
+                    status = %s,
+                    total_registros_analisados = %s,
+                    divergencias_detectadas = %s,
+                    correcoes_aplicadas = %s,
+                    correcoes_pendentes = %s,
+                    erros_encontrados = %s,
+                    resultado_geral = %s,
+                    log_completo = %s
+                WHERE id = %s
+                """
+                self.cursor.execute(query, (*valores, sessao_id))
             
-            self.cursor.execute(query, (
-                status,
-                metricas.get('total_registros_analisados', 0),
-                metricas.get('divergencias_detectadas', 0),
-                metricas.get('correcoes_aplicadas', 0),
-                metricas.get('correcoes_pendentes', 0),
-                metricas.get('erros_encontrados', 0),
-                resultado_geral,
-                log_completo,
-                sessao_id
-            ))
+            # Fim da sessão confirma tudo o que estiver pendente
+            self.commit()
+            self._sessoes_adiadas.pop(sessao_id, None)
             
-            self.conn.commit()
+            logger.info("Sessao finalizada: ID=%s, status=%s", sessao_id, status)
             
-            logger.info(f"Sessao finalizada: ID={sessao_id}, status={status}")
+        except psycopg2.Error as e:
+            logger.error("Erro ao finalizar sessao %s: %s", sessao_id, e)
+            self._desfazer()
+            raise
+    
+    def rotacionar_particoes(
+        self,
+        meses_a_frente: int = 1,
+        retencao_meses: int = AUDIT_RETENTION_MONTHS
+    ) -> Dict[str, List[str]]:
+        """
+        Cria as partições mensais futuras de audit.divergencias_processadas
+        e remove as que passaram do período de retenção.
+        
+        O descarte é um DROP TABLE da partição inteira, sem DELETE linha a
+        linha. Não faz nada se a tabela ainda não foi convertida por
+        schemas/audit/particionamento_divergencias.sql.
+        
+        Args:
+            meses_a_frente: Meses após o atual com partição garantida
+            retencao_meses: Meses completos mantidos antes do mês atual
+        
+        Returns:
+            Dict com os nomes das partições 'criadas' e 'removidas'
+        """
+        resultado = {'criadas': [], 'removidas': []}
+        
+        try:
+            self._abrir_chamada()
+            self.cursor.execute(
+                "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass",
+                ('audit.divergencias_processadas',)
+            )
+            linha = self.cursor.fetchone()
+            if not linha or not linha[0]:
+                logger.info("audit.divergencias_processadas nao particionada; rotacao ignorada")
+                self._confirmar()
+                return resultado
+            
+            self.cursor.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'audit.divergencias_processadas'::regclass
+            """)
+            existentes = {row[0] for row in self.cursor.fetchall()}
             
+            hoje = date.today()
+            for deslocamento in range(meses_a_frente + 1):
+                inicio = _inicio_mes(hoje, deslocamento)
+                nome = f"{_PREFIXO_PARTICAO}{inicio:%Y%m}"
+                if nome in existentes:
+                    continue
+                self.cursor.execute(
+                    f"CREATE TABLE audit.{nome} "
+                    "PARTITION OF audit.divergencias_processadas "
+                    "FOR VALUES FROM (%s) TO (%s)",
+                    (inicio.isoformat(), _inicio_mes(hoje, deslocamento + 1).isoformat())
+                )
+                resultado['criadas'].append(nome)
+            
+            limite = _inicio_mes(hoje, -retencao_meses)
+            for nome in sorted(existentes):
+                mes = _RE_PARTICAO.fullmatch(nome)
+                if mes and date(int(mes.group(1)), int(mes.group(2)), 1) < limite:
+                    self.cursor.execute(f"DROP TABLE audit.{nome}")
+                    resultado['removidas'].append(nome)
+            
+            # DDL mantém lock exclusivo até o commit
+            self.commit()
+            
+            logger.info(
+                "Particoes rotacionadas: %d criadas, %d removidas",
+                len(resultado['criadas']), len(resultado['removidas'])
+            )
+            return resultado
+        
         except psycopg2.Error as e:
-            logger.error(f"Erro ao finalizar sessao {sessao_id}: {e}")
-            self.conn.rollback()
+            logger.error("Erro ao rotacionar particoes: %s", e)
+            self._desfazer()
             raise
     
     def obter_operacoes_para_rollback(
         self,
         operacao_id: int
-    ) -> List[Dict[str, Any]]:
+    ) -> Dict[str, Any]:
         """
         Obtém dados necessários para realizar rollback de uma operação.
         
@@ -458,9 +1543,14 @@ class AuditLogger:
             operacao_id: ID da operação a ser revertida
         
         Returns:
-            List[Dict]: Lista com dados anteriores para rollback
+            Dict: Operação com os dados anteriores para rollback
+        
+        Raises:
+            ValueError: Se a operação não existir
         """
         try:
+            # Operações com início adiado precisam estar no banco para a consulta
+            self._gravar_inicios_pendentes()
             query = """
             SELECT 
                 id, tipo_operacao, tabela_afetada,
@@ -469,22 +1559,18 @@ class AuditLogger:
             WHERE id = %s
             """
             
-            self.cursor.execute(query, (operacao_id,))
-            row = self.cursor.fetchone()
+            # As linhas já chegam como dict, com as chaves nos nomes das colunas
+            with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, (operacao_id,))
+                row = cursor.fetchone()
             
             if not row:
                 raise ValueError(f"Operacao {operacao_id} nao encontrada")
             
-            return {
-                'id': row[0],
-                'tipo_operacao': row[1],
-                'tabela_afetada': row[2],
-                'dados_anteriores': row[3],
-                'registros_afetados': row[4]
-            }
+            return dict(row)
             
         except psycopg2.Error as e:
-            logger.error(f"Erro ao obter dados para rollback: {e}")
+            logger.error("Erro ao obter dados para rollback: %s", e)
             raise
     
     def obter_historico_operacoes(
@@ -506,61 +1592,492 @@ class AuditLogger:
             limit: Limite de registros retornados
         
         Returns:
-            List[Dict]: Lista com operações encontradas
+            List[Dict]: Lista com operações encontradas (timestamps como
+                strings ISO 8601)
         """
         try:
-            conditions = []
-            params = []
-            
-            if usuario:
-                conditions.append("usuario = %s")
-                params.append(usuario)
-            
-            if tabela:
-                conditions.append("tabela_afetada = %s")
-                params.append(tabela)
-            
-            if data_inicio:
-                conditions.append("timestamp_inicio >= %s")
-                params.append(data_inicio)
-            
-            if data_fim:
-                conditions.append("timestamp_inicio <= %s")
-                params.append(data_fim)
-            
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            # Operações com início adiado precisam estar no banco para a consulta
+            self._gravar_inicios_pendentes()
+            filtros = (usuario, tabela, data_inicio, data_fim)
+            statement, query = CONSULTAS_HISTORICO[tuple(bool(f) for f in filtros)]
+            params = [f for f in filtros if f]
             params.append(limit)
             
-            query = f"""
-            SELECT 
-                id, tipo_operacao, descricao, usuario, origem,
-                tabela_afetada, registros_afetados, timestamp_inicio,
-                timestamp_fim, status
-            FROM audit.operacoes
-            WHERE {where_clause}
-            ORDER BY timestamp_inicio DESC
-            LIMIT %s
-            """
+            # Texto fixo por combinação de filtros: parse/plan uma vez por conexão
+            executar_preparado(self.cursor, statement, query, params)
             
-            self.cursor.execute(query, params)
-            rows = self.cursor.fetchall()
-            
-            return [
-                {
-                    'id': row[0],
-                    'tipo_operacao': row[1],
-                    'descricao': row[2],
-                    'usuario': row[3],
-                    'origem': row[4],
-                    'tabela_afetada': row[5],
-                    'registros_afetados': row[6],
-                    'timestamp_inicio': row[7],
-                    'timestamp_fim': row[8],
-                    'status': row[9]
-                }
-                for row in rows
-            ]
+            return orjson.loads(self.cursor.fetchone()[0])
             
         except psycopg2.Error as e:
-            logger.error(f"Erro ao obter historico: {e}")
+            logger.error("Erro ao obter historico: %s", e)
+            raise
+
+
+class BufferDivergencias:
+    """
+    Registro bufferizado de divergências para cargas de alto volume.
+    
+    registrar() apenas enfileira a linha em memória e devolve o ID na hora:
+    os IDs são reservados da sequência de audit.divergencias_processadas em
+    blocos de AUDIT_BUFFER_BLOCO_IDS. Uma thread em segundo plano grava a
+    fila com um único execute_values (mais os NOTIFY) quando ela atinge
+    max_size ou a cada intervalo, em uma conexão própria do pool, sem
+    ocupar a conexão do ETL.
+    
+    Diferente de AuditLogger.registrar_divergencia, a gravação não faz parte
+    da transação de quem registra: a operação (operacao_id) precisa já estar
+    confirmada. Se uma gravação falhar, o lote volta para a fila e é tentado
+    de novo no próximo ciclo.
+    
+    A fila é limitada: com limite linhas pendentes, registrar() espera a
+    thread esvaziá-la por até espera_maxima segundos; se ela não conseguir,
+    a linha é gravada de forma síncrona, sem crescer a memória.
+    
+    Exemplos de uso:
+        >>> buffer = BufferDivergencias()
+        >>> div_id = buffer.registrar(op_id, 'NF-1', 'TRADE_MARKETING', 0, 10, 'trade')
+        >>> buffer.close()  # grava o que restou e encerra a thread
+    """
+    
+    def __init__(
+        self,
+        max_size: int = AUDIT_BUFFER_MAX_SIZE,
+        intervalo: float = AUDIT_BUFFER_FLUSH_INTERVAL,
+        limite: int = AUDIT_BUFFER_HIGH_WATER,
+        espera_maxima: float = AUDIT_BUFFER_MAX_BLOCK_SECONDS
+    ):
+        """
+        Args:
+            max_size: Linhas na fila que disparam a gravação imediata
+            intervalo: Segundos máximos entre gravações
+            limite: Máximo de linhas pendentes em memória
+            espera_maxima: Segundos que registrar() espera com a fila cheia
+        """
+        self.max_size = max_size
+        self.intervalo = intervalo
+        self.limite = limite
+        self.espera_maxima = espera_maxima
+        self.gravacoes_sincronas = 0
+        self._duracoes_ms: deque = deque(maxlen=1000)
+        self._fila: deque = deque()
+        self._ids: deque = deque()
+        self._cond = threading.Condition()
+        self._ids_lock = threading.Lock()
+        self._gravacao_lock = threading.Lock()
+        self._fechado = False
+        self._thread = threading.Thread(
+            target=self._executar, name='audit_buffer', daemon=True
+        )
+        self._thread.start()
+    
+    def registrar(
+        self,
+        operacao_id: int,
+        idnfsexterno: str,
+        tipo_divergencia: str,
+        valor_anterior: Optional[float],
+        valor_sugerido: Optional[float],
+        campo_afetado: str,
+        competencia: Optional[str] = None,
+        confidence_score: Optional[float] = None,
+        regras_aplicadas: Optional[List[str]] = None,
+        dados_contextuais: Optional[Dict] = None
+    ) -> int:
+        """
+        Enfileira uma divergência (mesmos argumentos de registrar_divergencia).
+        
+        Returns:
+            int: ID que a divergência terá ao ser gravada
+        
+        Raises:
+            RuntimeError: Se o buffer já foi fechado
+            psycopg2.Error: Se a gravação síncrona (fila cheia) falhar
+        """
+        if self._fechado:
+            raise RuntimeError("BufferDivergencias fechado")
+        divergencia_id = self._proximo_id()
+        linha = (
+            divergencia_id, operacao_id, idnfsexterno, tipo_divergencia,
+            valor_anterior, valor_sugerido, campo_afetado, competencia,
+            confidence_score, _literal_regras(regras_aplicadas),
+            JsonRapido(dados_contextuais) if dados_contextuais else None
+        )
+        
+        with self._cond:
+            if len(self._fila) >= self.limite:
+                # Fila cheia: acorda a thread e espera ela abrir espaço
+                self._cond.notify_all()
+                self._cond.wait_for(
+                    lambda: self._fechado or len(self._fila) < self.limite,
+                    timeout=self.espera_maxima
+                )
+            enfileirada = len(self._fila) < self.limite
+            if enfileirada:
+                self._fila.append(linha)
+                if len(self._fila) >= self.max_size:
+                    self._cond.notify_all()
+        
+        if not enfileirada:
+            logger.warning(
+                "Buffer de divergencias cheio (%s): "
+                "gravando divergencia %s diretamente",
+                self.limite, divergencia_id
+            )
+            self._gravar([linha], reenfileirar=False)
+            self.gravacoes_sincronas += 1
+        
+        return divergencia_id
+    
+    def metricas(self) -> Dict[str, Any]:
+        """
+        Situação do buffer.
+        
+        Returns:
+            Dict: pendentes (linhas na fila), gravacoes_sincronas (linhas
+                gravadas direto por fila cheia) e flush_p99_ms (p99 da
+                duração das últimas gravações em lote)
+        """
+        duracoes = sorted(self._duracoes_ms)
+        return {
+            'pendentes': len(self._fila),
+            'gravacoes_sincronas': self.gravacoes_sincronas,
+            'flush_p99_ms': (
+                duracoes[min(len(duracoes) - 1, int(len(duracoes) * 0.99))]
+                if duracoes else 0.0
+            )
+        }
+    
+    def flush(self) -> int:
+        """
+        Grava imediatamente tudo o que está na fila.
+        
+        Returns:
+            int: Quantidade de divergências gravadas
+        
+        Raises:
+            psycopg2.Error: Se a gravação falhar (o lote volta para a fila)
+        """
+        with self._gravacao_lock:
+            lote = self._retirar_lote()
+            if lote:
+                inicio = time.perf_counter()
+                self._gravar(lote)
+                self._duracoes_ms.append((time.perf_counter() - inicio) * 1000)
+            return len(lote)
+    
+    def close(self) -> None:
+        """Para a thread de gravação e grava o que restou na fila."""
+        with self._cond:
+            if self._fechado:
+                return
+            self._fechado = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+    
+    def _executar(self) -> None:
+        """Laço da thread: espera tamanho ou intervalo e grava o lote."""
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._fechado or len(self._fila) >= self.max_size,
+                    timeout=self.intervalo
+                )
+                if self._fechado:
+                    return
+            try:
+                self.flush()
+            except psycopg2.Error as e:
+                logger.error("Erro ao gravar buffer de divergencias: %s", e)
+    
+    def _retirar_lote(self) -> List[tuple]:
+        """Esvazia a fila, devolvendo as linhas na ordem de registro."""
+        with self._cond:
+            lote = list(self._fila)
+            self._fila.clear()
+            # Libera quem está esperando espaço na fila
+            self._cond.notify_all()
+        return lote
+    
+    def _gravar(self, lote: List[tuple], reenfileirar: bool = True) -> None:
+        """
+        Insere o lote e publica os NOTIFY em uma transação própria.
+        
+        Com reenfileirar, um lote que falhar volta para a fila; sem ele,
+        o erro fica só com quem chamou.
+        """
+        # Os payloads do NOTIFY saem das linhas inseridas (RETURNING), no
+        # mesmo comando: o lote é adaptado uma única vez, sem montar o JSON
+        # de cada linha no Python nem uma segunda ida ao banco
+        query = f"""
+        WITH inseridas AS (
+            INSERT INTO audit.divergencias_processadas (
+                id, operacao_id, idnfsexterno, tipo_divergencia,
+                valor_anterior, valor_sugerido, campo_afetado,
+                competencia, confidence_score, regras_aplicadas, dados_contextuais,
+                status_processamento, detectado_em
+            ) VALUES %s
+            RETURNING id, idnfsexterno, tipo_divergencia, campo_afetado, competencia
+        )
+        SELECT pg_notify('{CANAL_DIVERGENCIAS}', json_build_object(
+            'id', id,
+            'idnfsexterno', idnfsexterno,
+            'tipo_divergencia', tipo_divergencia,
+            'campo_afetado', campo_afetado,
+            'competencia', competencia
+        )::text)
+        FROM inseridas
+        """
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    execute_values(
+                        cursor, query, lote,
+                        template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'DETECTED', NOW())",
+                        page_size=TAMANHO_PAGINA_LOTE
+                    )
+        except psycopg2.Error:
+            if reenfileirar:
+                # Devolve o lote à frente da fila, preservando a ordem
+                with self._cond:
+                    self._fila.extendleft(reversed(lote))
             raise
+        
+        logger.info("Buffer de divergencias gravado: %d registros", len(lote))
+    
+    def _proximo_id(self) -> int:
+        """Entrega o próximo ID reservado, buscando um novo bloco se preciso."""
+        return _proximo_id_reservado(self._ids, self._ids_lock)
+
+class ArquivoDivergencias:
+    """
+    Registro de divergências em um arquivo append-only (JSON por linha).
+    
+    registrar() serializa a divergência com orjson e acrescenta uma linha
+    ao arquivo: o caminho crítico é uma escrita sequencial local, sem ida ao
+    PostgreSQL. O arquivo é sincronizado em disco (fdatasync) no máximo a
+    cada intervalo_fsync segundos, e sempre em flush() e close(). Os IDs
+    são reservados da sequência em blocos, como em BufferDivergencias.
+    
+    A carga no banco fica fora do caminho crítico:
+    carregar_arquivo_divergencias() (executado por automation/audit_loader.py)
+    lê o arquivo a partir do último offset carregado e grava em lote com COPY.
+    
+    Um arquivo deve ter um único processo escrevendo nele.
+    
+    Exemplos de uso:
+        >>> arquivo = ArquivoDivergencias()
+        >>> audit = AuditLogger(conn, buffer=arquivo)
+        >>> audit.registrar_divergencia(op_id, 'NF-1', 'TRADE_MARKETING', 0, 10, 'trade')
+        >>> arquivo.close()
+    """
+    
+    def __init__(
+        self,
+        caminho: Union[str, Path] = AUDIT_AOF_PATH,
+        intervalo_fsync: float = AUDIT_AOF_FSYNC_INTERVAL
+    ):
+        """
+        Args:
+            caminho: Arquivo de destino (criado se não existir)
+            intervalo_fsync: Segundos máximos entre sincronizações em disco
+        """
+        self.caminho = Path(caminho)
+        self.intervalo_fsync = intervalo_fsync
+        self._arquivo = open(self.caminho, 'ab')
+        self._lock = threading.Lock()
+        self._ids: deque = deque()
+        self._ids_lock = threading.Lock()
+        self._ultimo_fsync = time.monotonic()
+        self._fechado = False
+    
+    def registrar(
+        self,
+        operacao_id: int,
+        idnfsexterno: str,
+        tipo_divergencia: str,
+        valor_anterior: Optional[float],
+        valor_sugerido: Optional[float],
+        campo_afetado: str,
+        competencia: Optional[str] = None,
+        confidence_score: Optional[float] = None,
+        regras_aplicadas: Optional[List[str]] = None,
+        dados_contextuais: Optional[Dict] = None
+    ) -> int:
+        """
+        Acrescenta uma divergência ao arquivo (mesmos argumentos de registrar_divergencia).
+        
+        Returns:
+            int: ID que a divergência terá ao ser carregada
+        
+        Raises:
+            RuntimeError: Se o arquivo já foi fechado
+        """
+        if self._fechado:
+            raise RuntimeError("ArquivoDivergencias fechado")
+        divergencia_id = _proximo_id_reservado(self._ids, self._ids_lock)
+        evento = orjson.dumps(
+            {
+                'id': divergencia_id,
+                'operacao_id': operacao_id,
+                'idnfsexterno': idnfsexterno,
+                'tipo_divergencia': tipo_divergencia,
+                'valor_anterior': valor_anterior,
+                'valor_sugerido': valor_sugerido,
+                'campo_afetado': campo_afetado,
+                'competencia': competencia,
+                'detectado_em': datetime.now(),
+                'confidence_score': confidence_score,
+                'regras_aplicadas': regras_aplicadas,
+                'dados_contextuais': dados_contextuais or None
+            },
+            default=_json_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        )
+        
+        with self._lock:
+            self._arquivo.write(evento)
+            if time.monotonic() - self._ultimo_fsync >= self.intervalo_fsync:
+                self._sincronizar()
+        
+        return divergencia_id
+    
+    def flush(self) -> None:
+        """Grava o buffer do arquivo e sincroniza em disco."""
+        with self._lock:
+            if not self._arquivo.closed:
+                self._sincronizar()
+    
+    def close(self) -> None:
+        """Sincroniza e fecha o arquivo."""
+        with self._lock:
+            if self._fechado:
+                return
+            self._fechado = True
+            self._sincronizar()
+            self._arquivo.close()
+    
+    def _sincronizar(self) -> None:
+        """flush + fdatasync; chamado com self._lock."""
+        self._arquivo.flush()
+        os.fdatasync(self._arquivo.fileno())
+        self._ultimo_fsync = time.monotonic()
+
+
+def carregar_arquivo_divergencias(
+    caminho: Union[str, Path] = AUDIT_AOF_PATH,
+    tamanho_lote: int = AUDIT_AOF_LOTE
+) -> int:
+    """
+    Carrega no PostgreSQL as divergências ainda não carregadas de um
+    arquivo de ArquivoDivergencias.
+    
+    O offset já carregado fica em <caminho>.offset e só avança depois do
+    commit de cada lote. Se o processo cair entre o commit e a gravação do
+    offset, o lote é lido de novo na próxima execução: as linhas já
+    existentes são ignoradas (ON CONFLICT DO NOTHING) e não geram NOTIFY
+    duplicado. Uma última linha incompleta (ainda sendo escrita) fica para
+    a próxima execução.
+    
+    Args:
+        caminho: Arquivo escrito por ArquivoDivergencias
+        tamanho_lote: Linhas por transação (um COPY por lote)
+    
+    Returns:
+        int: Quantidade de linhas lidas do arquivo nesta execução
+    
+    Raises:
+        psycopg2.Error: Se a carga de um lote falhar (o offset não avança)
+    """
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return 0
+    
+    controle = caminho.with_name(caminho.name + '.offset')
+    offset = int(controle.read_text()) if controle.exists() else 0
+    total = 0
+    
+    with open(caminho, 'rb') as arquivo:
+        arquivo.seek(offset)
+        while True:
+            linhas = []
+            while len(linhas) < tamanho_lote:
+                linha = arquivo.readline()
+                if not linha.endswith(b'\n'):
+                    break
+                linhas.append(linha)
+            if not linhas:
+                break
+            
+            _carregar_lote([orjson.loads(linha) for linha in linhas])
+            offset += sum(map(len, linhas))
+            temporario = controle.with_name(controle.name + '.tmp')
+            temporario.write_text(str(offset))
+            os.replace(temporario, controle)
+            total += len(linhas)
+            
+            if len(linhas) < tamanho_lote:
+                break
+    
+    if total:
+        logger.info("Arquivo de divergencias carregado: %s registros, offset=%s", total, offset)
+    return total
+
+
+def _carregar_lote(eventos: List[Dict[str, Any]]) -> None:
+    """COPY do lote em uma tabela temporária e INSERT ... ON CONFLICT com NOTIFY."""
+    buffer = io.StringIO()
+    for evento in eventos:
+        buffer.write('\t'.join(map(_campo_copy, (
+            evento['id'],
+            evento['operacao_id'],
+            evento['idnfsexterno'],
+            evento['tipo_divergencia'],
+            evento['valor_anterior'],
+            evento['valor_sugerido'],
+            evento['campo_afetado'],
+            evento['competencia'],
+            'DETECTED',
+            evento['detectado_em'],
+            evento['confidence_score'],
+            evento['regras_aplicadas'],
+            evento['dados_contextuais']
+        ))))
+        buffer.write('\n')
+    buffer.seek(0)
+    
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Tabela temporária da conexão do pool, esvaziada a cada commit
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS aof_divergencias
+                (LIKE audit.divergencias_processadas INCLUDING DEFAULTS)
+                ON COMMIT DELETE ROWS
+            """)
+            cursor.copy_expert(
+                """
+                COPY aof_divergencias (
+                    id, operacao_id, idnfsexterno, tipo_divergencia,
+                    valor_anterior, valor_sugerido, campo_afetado,
+                    competencia, status_processamento, detectado_em,
+                    confidence_score, regras_aplicadas, dados_contextuais
+                ) FROM STDIN WITH (FORMAT text)
+                """,
+                buffer
+            )
+            cursor.execute(f"""
+                WITH inseridas AS (
+                    INSERT INTO audit.divergencias_processadas
+                    SELECT * FROM aof_divergencias
+                    ON CONFLICT DO NOTHING
+                    RETURNING id, idnfsexterno, tipo_divergencia, campo_afetado, competencia
+                )
+                SELECT pg_notify('{CANAL_DIVERGENCIAS}', json_build_object(
+                    'id', id,
+                    'idnfsexterno', idnfsexterno,
+                    'tipo_divergencia', tipo_divergencia,
+                    'campo_afetado', campo_afetado,
+                    'competencia', competencia
+                )::text)
+                FROM inseridas
+            """)
@@ -16,24 +16,85 @@ Data: 2026-01-08
 Versão: 1.0.0
 """
 
+import csv
 import logging
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
 from dataclasses import dataclass
+import numpy as np
 import pandas as pd
 from decimal import Decimal
+import psycopg2
+from psycopg2.extras import execute_values
 
-from ..conn import db_connection
+from ..conn import db_connection, executar_preparado
 from .audit_logger import AuditLogger
 
 logger = logging.getLogger(__name__)
 
+# Regras de detecção, na ordem em que as divergências são concatenadas
+REGRAS_DETECCAO = (
+    '_detectar_divergencias_trade_marketing',
+    '_detectar_pendentes_verificacao',
+    '_detectar_divergencias_valores',
+)
 
-@dataclass
+# Linhas trazidas por ida ao banco nos cursores nomeados da detecção
+DETECCAO_ITERSIZE = 5000
+
+# Confiança atribuída a cada pendente de verificação: abaixo do limite padrão
+# da detecção, as linhas só são montadas quando o limite as deixa passar
+CONFIANCA_PENDENTE = 0.5
+
+# Varreduras da bonus_view guardadas por período (LRU)
+VARREDURAS_EM_CACHE = 4
+
+# Colunas da varredura única da bonus_view (_varrer_bonus_view)
+COLUNAS_VARREDURA = (
+    'idnfsexterno',
+    'des_modelo',
+    'competencia',
+    'bonus_utilizado',
+    'valor_bonus',
+    'trade',
+    'bonus_dpto',
+    'trade_mkt_dpto',
+    'dta_processamento',
+    'dias_pendente',
+    'diverge_bonus',
+    'diverge_trade',
+    'regra_trade',
+    'regra_pendente',
+    'regra_valores',
+)
+
+# Colunas do relatório de divergências, na ordem do arquivo
+COLUNAS_RELATORIO = (
+    'idnfsexterno',
+    'tipo_divergencia',
+    'campo_afetado',
+    'valor_atual',
+    'valor_esperado',
+    'competencia',
+    'confianca',
+    'regras_violadas',
+)
+
+# slots=True no dataclass requer Python 3.10+ (o pacote aceita 3.9)
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class Divergencia:
     """
     Representa uma divergência detectada no sistema.
     
+    Em Python 3.10+ usa __slots__: sem __dict__ por instância, o que reduz
+    a memória quando a detecção gera dezenas de milhares de objetos.
+    
     Attributes:
         idnfsexterno: Identificador único da nota fiscal
         tipo: Tipo de divergência detectada
@@ -87,23 +148,28 @@ class DivergenceProcessor:
         ...     )
     """
     
-    def __init__(self, connection):
+    def __init__(self, connection, audit: Optional[AuditLogger] = None):
         """
         Inicializa o processador de divergências.
         
         Args:
             connection: Conexão psycopg2 ativa com o banco de dados
+            audit: AuditLogger a usar; por padrão, um na mesma conexão. Com
+                AuditLogger.conexao_dedicada() a auditoria não compartilha
+                a transação das correções
         """
         self.conn = connection
         self.cursor = connection.cursor()
-        self.audit = AuditLogger(connection)
+        self.audit = audit if audit is not None else AuditLogger(connection)
+        self._varreduras: "OrderedDict[tuple, pd.DataFrame]" = OrderedDict()
     
     def detectar_divergencias(
         self,
-        data_inicio: Optional[str] = None,
-        data_fim: Optional[str] = None,
+        data_inicio: Optional[Union[str, date]] = None,
+        data_fim: Optional[Union[str, date]] = None,
         tipo_divergencia: Optional[str] = None,
-        limite_confianca: float = 0.8
+        limite_confianca: float = 0.8,
+        paralelo: bool = False
     ) -> List[Divergencia]:
         """
         Detecta divergências nos dados de bônus usando regras de negócio.
@@ -115,13 +181,18 @@ class DivergenceProcessor:
         4. Inconsistências entre tabelas relacionadas
         
         Args:
-            data_inicio: Data inicial no formato 'YYYY-MM-DD'
-            data_fim: Data final no formato 'YYYY-MM-DD'
+            data_inicio: Data inicial (date ou 'YYYY-MM-DD')
+            data_fim: Data final (date ou 'YYYY-MM-DD')
             tipo_divergencia: Filtrar por tipo específico (opcional)
             limite_confianca: Score mínimo de confiança (0.0 a 1.0)
+            paralelo: Se True, as consultas das regras são disparadas ao mesmo
+                tempo, cada uma em uma conexão própria do pool. Por padrão
+                uma única varredura da bonus_view, na conexão do processador,
+                atende as três regras
         
         Returns:
-            List[Divergencia]: Lista de divergências detectadas
+            List[Divergencia]: Lista de divergências detectadas, sem repetir
+            o par (idnfsexterno, campo_afetado)
         """
         logger.info(
             f"Iniciando deteccao de divergencias: "
@@ -130,29 +201,60 @@ class DivergenceProcessor:
         
         divergencias = []
         
-        # Regra 1: Divergências de Trade Marketing
-        divergencias_trade = self._detectar_divergencias_trade_marketing(
-            data_inicio, data_fim
-        )
-        divergencias.extend(divergencias_trade)
+        # Abaixo do limite, as pendentes seriam descartadas: basta contá-las
+        listar_pendentes = limite_confianca <= CONFIANCA_PENDENTE
+        opcoes_regra = {'_detectar_pendentes_verificacao': {'listar': listar_pendentes}}
         
-        # Regra 2: Pendentes de Verificação
-        divergencias_pendentes = self._detectar_pendentes_verificacao(
-            data_inicio, data_fim
-        )
-        divergencias.extend(divergencias_pendentes)
+        if paralelo:
+            with ThreadPoolExecutor(
+                max_workers=len(REGRAS_DETECCAO),
+                thread_name_prefix='regra_deteccao'
+            ) as pool:
+                resultados = pool.map(
+                    lambda regra: self._detectar_em_conexao_propria(
+                        regra, data_inicio, data_fim, **opcoes_regra.get(regra, {})
+                    ),
+                    REGRAS_DETECCAO
+                )
+                for divergencias_regra in resultados:
+                    divergencias.extend(divergencias_regra)
+        else:
+            dados = self._varrer_bonus_view(data_inicio, data_fim)
+            
+            # Regra 1: Divergências de Trade Marketing
+            divergencias_trade = self._detectar_divergencias_trade_marketing(
+                data_inicio, data_fim, dados=dados
+            )
+            divergencias.extend(divergencias_trade)
+            
+            # Regra 2: Pendentes de Verificação
+            divergencias_pendentes = self._detectar_pendentes_verificacao(
+                data_inicio, data_fim, dados=dados, listar=listar_pendentes
+            )
+            divergencias.extend(divergencias_pendentes)
+            
+            # Regra 3: Validações de valores
+            divergencias_valores = self._detectar_divergencias_valores(
+                data_inicio, data_fim, dados=dados
+            )
+            divergencias.extend(divergencias_valores)
         
-        # Regra 3: Validações de valores
-        divergencias_valores = self._detectar_divergencias_valores(
-            data_inicio, data_fim
+        # Filtra por confiança mínima (comparação vetorizada)
+        confiancas = np.fromiter(
+            (d.confianca for d in divergencias), dtype=float, count=len(divergencias)
         )
-        divergencias.extend(divergencias_valores)
+        acima_do_limite = confiancas >= limite_confianca
         
-        # Filtra por confiança mínima
-        divergencias_filtradas = [
-            d for d in divergencias
-            if d.confianca >= limite_confianca
-        ]
+        # Uma divergência por (nota, campo): fica a de maior confiança, na
+        # posição da primeira ocorrência
+        por_chave: Dict[Tuple[str, str], Divergencia] = {}
+        for i in np.flatnonzero(acima_do_limite):
+            d = divergencias[i]
+            chave = (d.idnfsexterno, d.campo_afetado)
+            atual = por_chave.get(chave)
+            if atual is None or d.confianca > atual.confianca:
+                por_chave[chave] = d
+        divergencias_filtradas = list(por_chave.values())
         
         logger.info(
             f"Deteccao concluida: {len(divergencias_filtradas)} divergencias encontradas "
@@ -161,87 +263,292 @@ class DivergenceProcessor:
         
         return divergencias_filtradas
     
-    def _detectar_divergencias_trade_marketing(
+    @staticmethod
+    def _detectar_em_conexao_propria(
+        regra: str,
+        data_inicio: Optional[str],
+        data_fim: Optional[str],
+        **opcoes
+    ) -> List[Divergencia]:
+        """
+        Executa uma regra de detecção em uma conexão emprestada do pool.
+        
+        Args:
+            regra: Nome do método da regra (ver REGRAS_DETECCAO)
+            data_inicio: Data inicial no formato 'YYYY-MM-DD'
+            data_fim: Data final no formato 'YYYY-MM-DD'
+            **opcoes: Argumentos adicionais da regra
+        
+        Returns:
+            List[Divergencia]: Divergências encontradas pela regra
+        """
+        with db_connection() as conn:
+            return getattr(DivergenceProcessor(conn), regra)(data_inicio, data_fim, **opcoes)
+    
+    def _consultar_em_lotes(self, nome: str, query: str, params: List[Any]) -> Iterator[tuple]:
+        """
+        Executa uma consulta de detecção em um cursor nomeado (server-side).
+        
+        As linhas chegam em lotes de DETECCAO_ITERSIZE enquanto são
+        consumidas, sem materializar o resultado inteiro com fetchall().
+        O cursor é fechado ao fim da iteração.
+        
+        O DECLARE do cursor nomeado só aceita SELECT/VALUES, não EXECUTE:
+        estas consultas não passam por executar_preparado(). Varreduras
+        repetidas no mesmo processador vêm do cache de _varrer_bonus_view.
+        
+        Args:
+            nome: Nome do cursor (único por conexão enquanto aberto)
+            query: Consulta SQL
+            params: Parâmetros da consulta
+        
+        Yields:
+            tuple: Linha do resultado
+        """
+        with self.conn.cursor(name=nome) as cursor:
+            cursor.itersize = DETECCAO_ITERSIZE
+            cursor.execute(query, params)
+            yield from cursor
+    
+    def _varrer_bonus_view(
         self,
         data_inicio: Optional[str],
         data_fim: Optional[str]
+    ) -> pd.DataFrame:
+        """
+        Lê em uma única consulta as linhas da bonus_view que interessam às
+        três regras de detecção.
+        
+        Cada linha traz os valores já convertidos, os flags de divergência e
+        um flag por regra (regra_trade, regra_pendente, regra_valores); os
+        métodos _detectar_* só filtram o DataFrame. O resultado fica em cache
+        por período (LRU de VARREDURAS_EM_CACHE entradas) até a próxima
+        aplicação de correções.
+        
+        Args:
+            data_inicio: Data inicial (opcional)
+            data_fim: Data final (opcional)
+        
+        Returns:
+            pd.DataFrame: Colunas COLUNAS_VARREDURA, valores como objetos
+            Python (os mesmos que as consultas por regra devolvem)
+        """
+        chave = (data_inicio, data_fim)
+        if chave in self._varreduras:
+            self._varreduras.move_to_end(chave)
+            return self._varreduras[chave]
+        
+        params = []
+        periodo = "TRUE"
+        filtro_periodo = ""
+        if data_inicio and data_fim:
+            periodo = "dta_processamento BETWEEN %s AND %s"
+            # Filtro no SELECT mais interno: só o período pedido e o período
+            # fixo dos pendentes são lidos da view (no_periodo separa os dois)
+            filtro_periodo = (
+                f"WHERE {periodo} "
+                "OR dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'"
+            )
+            params.extend([data_inicio, data_fim] * 2)
+        
+        # Os predicados são os mesmos das consultas por regra; a de pendentes
+        # usa sempre o período fixo
+        query = f"""
+        SELECT
+            idnfsexterno,
+            des_modelo,
+            competencia,
+            bonus_utilizado,
+            valor_bonus,
+            trade,
+            bonus_dpto,
+            trade_mkt_dpto,
+            dta_processamento,
+            dias_pendente,
+            diverge_bonus,
+            diverge_trade,
+            regra_trade,
+            regra_pendente,
+            regra_valores
+        FROM (
+            SELECT
+                *,
+                COALESCE(
+                    apontamento = 'Revisar Divergência!' AND no_periodo
+                    AND (diverge_bonus OR diverge_trade),
+                    FALSE
+                ) AS regra_trade,
+                COALESCE(
+                    bonus_utilizado = 'PENDENTE VERIFICACAO'
+                    AND dta_processamento BETWEEN '2025-08-01' AND '2026-12-31',
+                    FALSE
+                ) AS regra_pendente,
+                COALESCE(
+                    no_periodo AND (
+                        trade < 0
+                        OR valor_bonus < 0
+                        OR bonus_dpto < 0
+                        OR trade > 100000
+                        OR valor_bonus > 100000
+                    ),
+                    FALSE
+                ) AS regra_valores
+            FROM (
+                SELECT
+                    *,
+                    EXTRACT(DAY FROM NOW() - dta_processamento)::INTEGER AS dias_pendente,
+                    ABS(bonus_dpto - valor_bonus) > 0.01 AS diverge_bonus,
+                    ABS(trade_mkt_dpto - trade) > 0.01 AS diverge_trade
+                FROM (
+                    SELECT 
+                        idnfsexterno,
+                        des_modelo,
+                        competencia,
+                        bonus_utilizado,
+                        apontamento,
+                        COALESCE(CAST(valor_bonus AS NUMERIC), 0)::float8 AS valor_bonus,
+                        COALESCE(CAST(trade AS NUMERIC), 0)::float8 AS trade,
+                        COALESCE(CAST(bonus_dpto AS NUMERIC), 0)::float8 AS bonus_dpto,
+                        COALESCE(CAST(trade_mkt_dpto AS NUMERIC), 0)::float8 AS trade_mkt_dpto,
+                        dta_processamento,
+                        {periodo} AS no_periodo
+                    FROM byd.bonus_view
+                    {filtro_periodo}
+                ) valores
+            ) comparados
+        ) regras
+        WHERE regra_trade OR regra_pendente OR regra_valores
+        ORDER BY dta_processamento DESC
+        """
+        
+        # dtype=object mantém date, int e None como vieram do cursor
+        dados = pd.DataFrame(
+            list(self._consultar_em_lotes('div_varredura', query, params)),
+            columns=list(COLUNAS_VARREDURA),
+            dtype=object
+        )
+        regras = ['regra_trade', 'regra_pendente', 'regra_valores']
+        dados[regras] = dados[regras].astype(bool)
+        
+        logger.info(f"Varredura bonus_view: {len(dados)} linhas candidatas")
+        
+        self._varreduras[chave] = dados
+        if len(self._varreduras) > VARREDURAS_EM_CACHE:
+            self._varreduras.popitem(last=False)
+        return dados
+    
+    @staticmethod
+    def _linhas_da_varredura(
+        dados: pd.DataFrame,
+        regra: str,
+        colunas: Tuple[str, ...]
+    ) -> Iterator[tuple]:
+        """Linhas da varredura marcadas por `regra`, na ordem de `colunas`."""
+        return dados.loc[dados[regra], list(colunas)].itertuples(index=False, name=None)
+    
+    def _detectar_divergencias_trade_marketing(
+        self,
+        data_inicio: Optional[str],
+        data_fim: Optional[str],
+        dados: Optional[pd.DataFrame] = None
     ) -> List[Divergencia]:
         """
         Detecta divergências de Trade Marketing usando a view bonus_view.
         
         Esta é a regra principal que substitui o notebook divergencia.ipynb.
         Identifica casos onde bonus_view.apontamento = 'Revisar Divergência!'
+        
+        A conversão para número e a comparação com tolerância de 0.01 são
+        feitas no banco: só voltam as linhas com ao menos um campo
+        divergente, já com os valores em float8 e um flag por campo.
+        
+        Com `dados` (resultado de _varrer_bonus_view) não consulta o banco.
         """
         try:
             query = """
-            SELECT 
-                idnfsexterno,
-                des_modelo,
-                apontamento,
-                competencia,
-                bonus_utilizado,
-                valor_bonus,
-                trade,
-                bonus_dpto,
-                trade_mkt_dpto,
-                dta_processamento
-            FROM byd.bonus_view
-            WHERE apontamento = 'Revisar Divergência!'
+            SELECT *
+            FROM (
+                SELECT 
+                    idnfsexterno,
+                    des_modelo,
+                    competencia,
+                    bonus_utilizado,
+                    valor_bonus,
+                    trade,
+                    bonus_dpto,
+                    trade_mkt_dpto,
+                    dta_processamento,
+                    ABS(bonus_dpto - valor_bonus) > 0.01 AS diverge_bonus,
+                    ABS(trade_mkt_dpto - trade) > 0.01 AS diverge_trade
+                FROM (
+                    SELECT 
+                        idnfsexterno,
+                        des_modelo,
+                        competencia,
+                        bonus_utilizado,
+                        COALESCE(CAST(valor_bonus AS NUMERIC), 0)::float8 AS valor_bonus,
+                        COALESCE(CAST(trade AS NUMERIC), 0)::float8 AS trade,
+                        COALESCE(CAST(bonus_dpto AS NUMERIC), 0)::float8 AS bonus_dpto,
+                        COALESCE(CAST(trade_mkt_dpto AS NUMERIC), 0)::float8 AS trade_mkt_dpto,
+                        dta_processamento
+                    FROM byd.bonus_view
+                    WHERE apontamento = 'Revisar Divergência!'
+                    {periodo}
+                ) valores
+            ) comparados
+            WHERE diverge_bonus OR diverge_trade
+            ORDER BY dta_processamento DESC
             """
             
             params = []
+            periodo = ""
             if data_inicio and data_fim:
-                query += " AND dta_processamento BETWEEN %s AND %s"
+                periodo = "AND dta_processamento BETWEEN %s AND %s"
                 params.extend([data_inicio, data_fim])
             
-            query += " ORDER BY dta_processamento DESC"
-            
-            self.cursor.execute(query, params)
-            rows = self.cursor.fetchall()
+            if dados is not None:
+                linhas = self._linhas_da_varredura(dados, 'regra_trade', (
+                    'idnfsexterno', 'des_modelo', 'competencia', 'bonus_utilizado',
+                    'valor_bonus', 'trade', 'bonus_dpto', 'trade_mkt_dpto',
+                    'dta_processamento', 'diverge_bonus', 'diverge_trade'
+                ))
+            else:
+                linhas = self._consultar_em_lotes('div_trade', query.format(periodo=periodo), params)
             
             divergencias = []
-            for row in rows:
-                # Analisa se bonus_dpto deveria ser igual a valor_bonus
-                # e trade_mkt_dpto deveria ser igual a trade
-                valor_bonus = float(row[5]) if row[5] else 0.0
-                trade = float(row[6]) if row[6] else 0.0
-                bonus_dpto_atual = float(row[7]) if row[7] else 0.0
-                trade_mkt_dpto_atual = float(row[8]) if row[8] else 0.0
+            for row in linhas:
+                dados_adicionais = {
+                    'des_modelo': row[1],
+                    'bonus_utilizado': row[3],
+                    'dta_processamento': str(row[8]) if row[8] else None
+                }
                 
-                # Divergência no campo bonus_dpto
-                if abs(bonus_dpto_atual - valor_bonus) > 0.01:
+                # bonus_dpto deveria ser igual a valor_bonus
+                if row[9]:
                     divergencias.append(Divergencia(
                         idnfsexterno=row[0],
                         tipo='TRADE_MARKETING_BONUS',
                         campo_afetado='bonus_dpto',
-                        valor_atual=bonus_dpto_atual,
-                        valor_esperado=valor_bonus,
-                        competencia=row[3],
+                        valor_atual=row[6],
+                        valor_esperado=row[4],
+                        competencia=row[2],
                         confianca=0.95,
                         regras_violadas=['BONUS_DPTO_DIVERGENTE'],
-                        dados_adicionais={
-                            'des_modelo': row[1],
-                            'bonus_utilizado': row[4],
-                            'dta_processamento': str(row[9]) if row[9] else None
-                        }
+                        dados_adicionais=dados_adicionais
                     ))
                 
-                # Divergência no campo trade_mkt_dpto
-                if abs(trade_mkt_dpto_atual - trade) > 0.01:
+                # trade_mkt_dpto deveria ser igual a trade
+                if row[10]:
                     divergencias.append(Divergencia(
                         idnfsexterno=row[0],
                         tipo='TRADE_MARKETING_TRADE',
                         campo_afetado='trade_mkt_dpto',
-                        valor_atual=trade_mkt_dpto_atual,
-                        valor_esperado=trade,
-                        competencia=row[3],
+                        valor_atual=row[7],
+                        valor_esperado=row[5],
+                        competencia=row[2],
                         confianca=0.95,
                         regras_violadas=['TRADE_MKT_DPTO_DIVERGENTE'],
-                        dados_adicionais={
-                            'des_modelo': row[1],
-                            'bonus_utilizado': row[4],
-                            'dta_processamento': str(row[9]) if row[9] else None
-                        }
+                        dados_adicionais=dados_adicionais
                     ))
             
             logger.info(
@@ -256,38 +563,62 @@ class DivergenceProcessor:
     def _detectar_pendentes_verificacao(
         self,
         data_inicio: Optional[str],
-        data_fim: Optional[str]
+        data_fim: Optional[str],
+        dados: Optional[pd.DataFrame] = None,
+        listar: bool = True
     ) -> List[Divergencia]:
         """
         Detecta registros com status 'PENDENTE VERIFICACAO' que permanecem
         sem resolução por período prolongado.
         Busca sempre no período fixo: Agosto/2025 até Dezembro/2026.
+        Com `dados` (resultado de _varrer_bonus_view) não consulta o banco.
+        Com listar=False só o total é apurado (COUNT(*) preparado, no
+        banco) para o nível de criticidade, e a lista volta vazia.
         """
         try:
-            query = """
+            filtro = """
+            FROM byd.bonus_view
+            WHERE bonus_utilizado = 'PENDENTE VERIFICACAO'
+                AND dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'
+            """
+            
+            if not listar:
+                if dados is not None:
+                    total_pendentes = int(dados['regra_pendente'].sum())
+                else:
+                    # Texto fixo: parse/plan uma vez por conexão do pool
+                    executar_preparado(
+                        self.cursor, 'div_contar_pendentes', f"SELECT COUNT(*) {filtro}"
+                    )
+                    total_pendentes = self.cursor.fetchone()[0]
+                self._registrar_criticidade_pendentes(total_pendentes)
+                return []
+            
+            query = f"""
             SELECT 
                 idnfsexterno,
                 competencia,
                 bonus_utilizado,
                 dta_processamento,
                 EXTRACT(DAY FROM NOW() - dta_processamento)::INTEGER as dias_pendente
-            FROM byd.bonus_view
-            WHERE bonus_utilizado = 'PENDENTE VERIFICACAO'
-                AND dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'
+            {filtro}
             """
             
-            params = []
-            
-            self.cursor.execute(query, params)
-            rows = self.cursor.fetchall()
+            if dados is not None:
+                linhas = self._linhas_da_varredura(dados, 'regra_pendente', (
+                    'idnfsexterno', 'competencia', 'bonus_utilizado',
+                    'dta_processamento', 'dias_pendente'
+                ))
+            else:
+                linhas = self._consultar_em_lotes('div_pendentes', query, [])
             
             divergencias = []
-            for row in rows:
+            for row in linhas:
                 dias_pendente = row[4]
                 
                 # Marca todos como baixa confiança individual (não processar automaticamente)
                 # A criticidade será avaliada no total de pendentes
-                confianca = 0.5
+                confianca = CONFIANCA_PENDENTE
                 
                 divergencias.append(Divergencia(
                     idnfsexterno=row[0],
@@ -304,28 +635,32 @@ class DivergenceProcessor:
                     }
                 ))
             
-            # Determina criticidade baseada no volume total
-            total_pendentes = len(divergencias)
-            if total_pendentes < 10:
-                nivel_criticidade = "BAIXA CRITICIDADE"
-            elif total_pendentes <= 20:
-                nivel_criticidade = "ATENCAO - Volume moderado de pendentes"
-            else:
-                nivel_criticidade = "CRITICO - Ajustar Chassis pendentes de verificacao!"
-            
-            logger.info(
-                f"Pendentes Verificacao: {total_pendentes} detectadas - {nivel_criticidade}"
-            )
+            self._registrar_criticidade_pendentes(len(divergencias))
             return divergencias
             
         except Exception as e:
             logger.error(f"Erro ao detectar pendentes verificacao: {e}")
             raise
     
+    @staticmethod
+    def _registrar_criticidade_pendentes(total_pendentes: int) -> None:
+        """Registra no log a criticidade baseada no volume total de pendentes."""
+        if total_pendentes < 10:
+            nivel_criticidade = "BAIXA CRITICIDADE"
+        elif total_pendentes <= 20:
+            nivel_criticidade = "ATENCAO - Volume moderado de pendentes"
+        else:
+            nivel_criticidade = "CRITICO - Ajustar Chassis pendentes de verificacao!"
+        
+        logger.info(
+            f"Pendentes Verificacao: {total_pendentes} detectadas - {nivel_criticidade}"
+        )
+    
     def _detectar_divergencias_valores(
         self,
         data_inicio: Optional[str],
-        data_fim: Optional[str]
+        data_fim: Optional[str],
+        dados: Optional[pd.DataFrame] = None
     ) -> List[Divergencia]:
         """
         Detecta valores suspeitos ou fora dos ranges esperados.
@@ -334,16 +669,18 @@ class DivergenceProcessor:
         - Valores negativos em campos de bônus
         - Valores extremamente altos (outliers)
         - Inconsistências matemáticas
+        
+        As regras violadas são avaliadas com máscaras NumPy sobre as colunas
+        inteiras, não linha a linha em Python. Com `dados` (resultado de
+        _varrer_bonus_view) não consulta o banco.
         """
         try:
             query = """
             SELECT 
                 idnfsexterno,
                 competencia,
-                trade,
-                valor_bonus,
-                bonus_dpto,
-                trade_mkt_dpto
+                COALESCE(CAST(trade AS NUMERIC), 0)::float8 AS trade,
+                COALESCE(CAST(valor_bonus AS NUMERIC), 0)::float8 AS valor_bonus
             FROM byd.bonus_view
             WHERE (
                 COALESCE(CAST(trade AS NUMERIC), 0) < 0
@@ -359,40 +696,45 @@ class DivergenceProcessor:
                 query += " AND dta_processamento BETWEEN %s AND %s"
                 params.extend([data_inicio, data_fim])
             
-            self.cursor.execute(query, params)
-            rows = self.cursor.fetchall()
-            
-            divergencias = []
-            for row in rows:
-                trade = float(row[2]) if row[2] else 0.0
-                valor_bonus = float(row[3]) if row[3] else 0.0
-                
-                regras_violadas = []
+            colunas = ['idnfsexterno', 'competencia', 'trade', 'valor_bonus']
+            if dados is not None:
+                df = dados.loc[dados['regra_valores'], colunas]
+            else:
+                df = pd.DataFrame.from_records(
+                    self._consultar_em_lotes('div_valores', query, params),
+                    columns=colunas
+                )
+            trade = df['trade'].to_numpy(dtype=float)
+            valor_bonus = df['valor_bonus'].to_numpy(dtype=float)
                 
-                if trade < 0:
-                    regras_violadas.append('TRADE_VALOR_NEGATIVO')
-                if valor_bonus < 0:
-                    regras_violadas.append('BONUS_VALOR_NEGATIVO')
-                if trade > 100000:
-                    regras_violadas.append('TRADE_VALOR_OUTLIER')
-                if valor_bonus > 100000:
-                    regras_violadas.append('BONUS_VALOR_OUTLIER')
+            # Uma máscara por regra, na ordem em que aparecem em regras_violadas
+            mascaras = (
+                ('TRADE_VALOR_NEGATIVO', trade < 0),
+                ('BONUS_VALOR_NEGATIVO', valor_bonus < 0),
+                ('TRADE_VALOR_OUTLIER', trade > 100000),
+                ('BONUS_VALOR_OUTLIER', valor_bonus > 100000),
+            )
+            violada = np.logical_or.reduce([m for _, m in mascaras])
                 
-                if regras_violadas:
-                    divergencias.append(Divergencia(
-                        idnfsexterno=row[0],
-                        tipo='VALIDACAO_VALOR',
-                        campo_afetado='valores_bonus',
-                        valor_atual=None,
-                        valor_esperado=None,
-                        competencia=row[1],
-                        confianca=0.7,
-                        regras_violadas=regras_violadas,
-                        dados_adicionais={
-                            'trade': trade,
-                            'valor_bonus': valor_bonus
-                        }
-                    ))
+            idnfs = df['idnfsexterno'].tolist()
+            competencias = df['competencia'].tolist()
+            divergencias = [
+                Divergencia(
+                    idnfsexterno=idnfs[i],
+                    tipo='VALIDACAO_VALOR',
+                    campo_afetado='valores_bonus',
+                    valor_atual=None,
+                    valor_esperado=None,
+                    competencia=competencias[i],
+                    confianca=0.7,
+                    regras_violadas=[regra for regra, m in mascaras if m[i]],
+                    dados_adicionais={
+                        'trade': float(trade[i]),
+                        'valor_bonus': float(valor_bonus[i])
+                    }
+                )
+                for i in np.flatnonzero(violada)
+            ]
             
             logger.info(
                 f"Validacao Valores: {len(divergencias)} divergencias detectadas"
@@ -413,6 +755,13 @@ class DivergenceProcessor:
         """
         Aplica correções para as divergências detectadas.
         
+        Com a auditoria em conexão própria (conexao_dedicada()) ou em modo
+        'group', tudo é confirmado em um único commit ao final: cada grupo
+        de correções e o registro das pendentes ficam em um SAVEPOINT, e uma
+        falha desfaz só a sua parte. Com o AuditLogger padrão (modo
+        'immediate' na mesma conexão) cada chamada de auditoria confirma a
+        transação; cada grupo é então confirmado ou desfeito por inteiro.
+        
         Args:
             divergencias: Lista de divergências a corrigir
             modo: 'auto' para aplicação automática, 'manual' para gerar apenas relatório
@@ -441,55 +790,82 @@ class DivergenceProcessor:
             'detalhes': []
         }
         
+        # Separa em uma passada as aplicáveis automaticamente das pendentes
+        automaticas = []
+        pendentes = []
         for div in divergencias:
-            try:
-                # Decide se aplica automaticamente ou marca como pendente
-                aplicar_auto = (
-                    modo == 'auto' and
-                    div.confianca >= limite_auto_aplicacao and
-                    div.tipo in ['TRADE_MARKETING_BONUS', 'TRADE_MARKETING_TRADE']
+            aplicar_auto = (
+                modo == 'auto' and
+                div.confianca >= limite_auto_aplicacao and
+                div.tipo in ['TRADE_MARKETING_BONUS', 'TRADE_MARKETING_TRADE']
+            )
+            (automaticas if aplicar_auto else pendentes).append(div)
+        
+        # Agrupa por campo: o nome da coluna não pode ser parâmetro
+        automaticas_por_campo = {}
+        for div in automaticas:
+            automaticas_por_campo.setdefault(div.campo_afetado, []).append(div)
+        
+        # As correções alteram a bonus_view: varreduras em cache ficam velhas
+        if automaticas_por_campo:
+            self._varreduras.clear()
+        
+        for campo, grupo in automaticas_por_campo.items():
+            if self._aplicar_correcoes_automaticas(campo, grupo, usuario):
+                resultado['corrigidas_automaticamente'] += len(grupo)
+                resultado['detalhes'].extend(
+                    {
+                        'idnfsexterno': div.idnfsexterno,
+                        'tipo': div.tipo,
+                        'status': 'CORRIGIDO_AUTO',
+                        'valor_aplicado': div.valor_esperado
+                    }
+                    for div in grupo
+                )
+            else:
+                resultado['erros'] += len(grupo)
+                resultado['detalhes'].extend(
+                    {
+                        'idnfsexterno': div.idnfsexterno,
+                        'tipo': div.tipo,
+                        'status': 'ERRO',
+                        'motivo': 'Falha na aplicacao automatica'
+                    }
+                    for div in grupo
                 )
                 
-                if aplicar_auto:
-                    sucesso = self._aplicar_correcao_automatica(div, usuario)
-                    if sucesso:
-                        resultado['corrigidas_automaticamente'] += 1
-                        resultado['detalhes'].append({
-                            'idnfsexterno': div.idnfsexterno,
-                            'tipo': div.tipo,
-                            'status': 'CORRIGIDO_AUTO',
-                            'valor_aplicado': div.valor_esperado
-                        })
-                    else:
-                        resultado['erros'] += 1
-                        resultado['detalhes'].append({
-                            'idnfsexterno': div.idnfsexterno,
-                            'tipo': div.tipo,
-                            'status': 'ERRO',
-                            'motivo': 'Falha na aplicacao automatica'
-                        })
-                else:
-                    # Registra como pendente de aprovação manual
-                    self._registrar_divergencia_pendente(div)
-                    resultado['pendentes_aprovacao'] += 1
-                    resultado['detalhes'].append({
+        if pendentes:
+            try:
+                # Registra como pendentes de aprovação manual
+                self._abrir_etapa('divergencias_pendentes')
+                self._registrar_divergencias_pendentes(pendentes)
+                self._concluir_etapa('divergencias_pendentes')
+                resultado['pendentes_aprovacao'] += len(pendentes)
+                resultado['detalhes'].extend(
+                    {
                         'idnfsexterno': div.idnfsexterno,
                         'tipo': div.tipo,
                         'status': 'PENDENTE_APROVACAO',
                         'confianca': div.confianca
-                    })
-                    
+                    }
+                    for div in pendentes
+                )
             except Exception as e:
-                logger.error(
-                    f"Erro ao processar divergencia {div.idnfsexterno}: {e}"
+                self._desfazer_etapa('divergencias_pendentes')
+                logger.error(f"Erro ao registrar divergencias pendentes: {e}")
+                resultado['erros'] += len(pendentes)
+                resultado['detalhes'].extend(
+                    {
+                        'idnfsexterno': div.idnfsexterno,
+                        'tipo': div.tipo,
+                        'status': 'ERRO',
+                        'motivo': str(e)
+                    }
+                    for div in pendentes
                 )
-                resultado['erros'] += 1
-                resultado['detalhes'].append({
-                    'idnfsexterno': div.idnfsexterno,
-                    'tipo': div.tipo,
-                    'status': 'ERRO',
-                    'motivo': str(e)
-                })
+        
+        if automaticas or pendentes:
+            self.conn.commit()
         
         logger.info(
             f"Aplicacao de correcoes concluida: "
@@ -500,66 +876,86 @@ class DivergenceProcessor:
         
         return resultado
     
-    def _aplicar_correcao_automatica(
+    @staticmethod
+    def _dados_auditoria(divergencia: Divergencia) -> Dict[str, Any]:
+        """Argumentos de AuditLogger.registrar_divergencia para a divergência."""
+        return {
+            'idnfsexterno': divergencia.idnfsexterno,
+            'tipo_divergencia': divergencia.tipo,
+            'valor_anterior': divergencia.valor_atual,
+            'valor_sugerido': divergencia.valor_esperado,
+            'campo_afetado': divergencia.campo_afetado,
+            'competencia': divergencia.competencia,
+            'confidence_score': divergencia.confianca,
+            'regras_aplicadas': divergencia.regras_violadas,
+            'dados_contextuais': divergencia.dados_adicionais
+        }
+    
+    def _aplicar_correcoes_automaticas(
         self,
-        divergencia: Divergencia,
+        campo: str,
+        divergencias: List[Divergencia],
         usuario: str
     ) -> bool:
         """
-        Aplica correção automática para uma divergência específica.
-        Registra a operação no sistema de auditoria.
+        Aplica as correções automáticas de um mesmo campo em lote.
+        
+        A captura dos valores anteriores (em JSON, no próprio banco), um
+        UPDATE ... FROM (VALUES ...) e o
+        registro das divergências em lote, sob uma única operação auditada:
+        a quantidade de round-trips não depende do tamanho do lote. Com
+        SAVEPOINTs (ver _usa_savepoints) não confirma: o commit é feito uma
+        vez por aplicar_correcoes().
         """
         try:
+            self._abrir_etapa('correcao_campo')
+            
             # Inicia operação auditada
             op_id = self.audit.iniciar_operacao(
-                tipo_operacao='UPDATE',
-                descricao=f'Correcao automatica: {divergencia.tipo}',
+                tipo_operacao='BULK_UPDATE',
+                descricao=f'Correcao automatica em lote: {campo} ({len(divergencias)} divergencias)',
                 usuario=usuario,
                 origem='AUTOMATION',
                 tabela_afetada='byd.controladoria'
             )
             
-            # Captura dados anteriores para rollback
-            query_anterior = f"""
-            SELECT {divergencia.campo_afetado}
-            FROM byd.controladoria
-            WHERE idnfsexterno = %s
-            """
-            self.cursor.execute(query_anterior, (divergencia.idnfsexterno,))
-            valor_anterior = self.cursor.fetchone()
+            # Para a mesma nota vale a última sugestão, como na aplicação item a item
+            valores = {div.idnfsexterno: div.valor_esperado for div in divergencias}
             
-            # Aplica a correção
-            query_update = f"""
-            UPDATE byd.controladoria
-            SET {divergencia.campo_afetado} = %s
-            WHERE idnfsexterno = %s
-            """
-            self.cursor.execute(
-                query_update,
-                (divergencia.valor_esperado, divergencia.idnfsexterno)
+            # Captura dados anteriores para rollback: o JSON é montado no
+            # próprio PostgreSQL, sem trazer os valores para o Python
+            self.audit.gravar_dados_por_consulta(
+                op_id,
+                f"""
+                SELECT idnfsexterno, %s::text AS campo, {campo} AS valor
+                FROM byd.controladoria
+                WHERE idnfsexterno = ANY(%s)
+                """,
+                (campo, list(valores))
             )
             
+            # Aplica as correções
+            execute_values(
+                self.cursor,
+                f"""
+                UPDATE byd.controladoria c
+                SET {campo} = v.val
+                FROM (VALUES %s) AS v(idnfsexterno, val)
+                WHERE c.idnfsexterno = v.idnfsexterno
+                """,
+                list(valores.items()),
+                template="(%s, %s::numeric)",
+                page_size=len(valores)
+            )
             registros_afetados = self.cursor.rowcount
             
-            # Registra divergência no audit
-            div_id = self.audit.registrar_divergencia(
-                operacao_id=op_id,
-                idnfsexterno=divergencia.idnfsexterno,
-                tipo_divergencia=divergencia.tipo,
-                valor_anterior=divergencia.valor_atual,
-                valor_sugerido=divergencia.valor_esperado,
-                campo_afetado=divergencia.campo_afetado,
-                competencia=divergencia.competencia,
-                confidence_score=divergencia.confianca,
-                regras_aplicadas=divergencia.regras_violadas,
-                dados_contextuais=divergencia.dados_adicionais
+            # Registra as divergências no audit já como aplicadas
+            div_ids = self.audit.registrar_divergencias_batch(
+                op_id, [self._dados_auditoria(div) for div in divergencias]
             )
-            
-            # Atualiza status da divergência como aplicada
-            self.audit.atualizar_status_divergencia(
-                divergencia_id=div_id,
+            self.audit.atualizar_status_divergencia_batch(
+                [(div_id, div.valor_esperado) for div_id, div in zip(div_ids, divergencias)],
                 novo_status='AUTO_APPLIED',
-                valor_aplicado=divergencia.valor_esperado,
                 processado_por=usuario
             )
             
@@ -568,31 +964,25 @@ class DivergenceProcessor:
                 operacao_id=op_id,
                 status='SUCCESS',
                 registros_afetados=registros_afetados,
-                dados_anteriores=[{
-                    'idnfsexterno': divergencia.idnfsexterno,
-                    'campo': divergencia.campo_afetado,
-                    'valor': valor_anterior[0] if valor_anterior else None
-                }],
-                dados_posteriores=[{
-                    'idnfsexterno': divergencia.idnfsexterno,
-                    'campo': divergencia.campo_afetado,
-                    'valor': divergencia.valor_esperado
-                }]
+                dados_posteriores=[
+                    {'idnfsexterno': idnf, 'campo': campo, 'valor': valor}
+                    for idnf, valor in valores.items()
+                ]
             )
             
-            self.conn.commit()
+            self._concluir_etapa('correcao_campo')
             
             logger.info(
-                f"Correcao automatica aplicada: idnf={divergencia.idnfsexterno}, "
-                f"campo={divergencia.campo_afetado}"
+                f"Correcoes automaticas aplicadas: campo={campo}, "
+                f"divergencias={len(divergencias)}, registros={registros_afetados}"
             )
             
             return True
             
         except Exception as e:
-            self.conn.rollback()
+            self._desfazer_etapa('correcao_campo')
             logger.error(
-                f"Erro ao aplicar correcao automatica para {divergencia.idnfsexterno}: {e}"
+                f"Erro ao aplicar correcoes automaticas em {campo}: {e}"
             )
             
             # Registra falha na auditoria
@@ -605,74 +995,134 @@ class DivergenceProcessor:
             
             return False
     
-    def _registrar_divergencia_pendente(self, divergencia: Divergencia) -> int:
+    def _registrar_divergencias_pendentes(self, divergencias: List[Divergencia]) -> List[int]:
         """
-        Registra divergência que requer aprovação manual.
+        Registra em lote as divergências que requerem aprovação manual.
         """
         op_id = self.audit.iniciar_operacao(
             tipo_operacao='DETECT',
-            descricao=f'Divergencia detectada: {divergencia.tipo}',
+            descricao=f'Divergencias detectadas: {len(divergencias)}',
             usuario='sistema',
             origem='AUTOMATION'
         )
         
-        div_id = self.audit.registrar_divergencia(
-            operacao_id=op_id,
-            idnfsexterno=divergencia.idnfsexterno,
-            tipo_divergencia=divergencia.tipo,
-            valor_anterior=divergencia.valor_atual,
-            valor_sugerido=divergencia.valor_esperado,
-            campo_afetado=divergencia.campo_afetado,
-            competencia=divergencia.competencia,
-            confidence_score=divergencia.confianca,
-            regras_aplicadas=divergencia.regras_violadas,
-            dados_contextuais=divergencia.dados_adicionais
+        # A fila de aprovação manual não passa pelo filtro de nível/amostragem
+        div_ids = self.audit.registrar_divergencias_batch(
+            op_id, [self._dados_auditoria(div) for div in divergencias],
+            filtrar=False
         )
         
-        self.audit.finalizar_operacao(op_id, status='SUCCESS')
-        self.conn.commit()
+        self.audit.finalizar_operacao(
+            op_id, status='SUCCESS', registros_afetados=len(div_ids)
+        )
         
-        return div_id
+        return div_ids
+    
+    def _usa_savepoints(self) -> bool:
+        """
+        Indica se as etapas de aplicar_correcoes() podem ficar em SAVEPOINTs
+        até um commit final.
+        
+        Um AuditLogger em modo 'immediate' na mesma conexão confirma a cada
+        chamada, o que libera os SAVEPOINTs abertos.
+        """
+        return self.audit.conn is not self.conn or self.audit.commit_mode != 'immediate'
+    
+    def _abrir_etapa(self, savepoint: str) -> None:
+        """Abre o SAVEPOINT de uma etapa, quando eles são usados."""
+        if self._usa_savepoints():
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+    
+    def _concluir_etapa(self, savepoint: str) -> None:
+        """Libera o SAVEPOINT da etapa ou, sem SAVEPOINTs, confirma a etapa."""
+        if self._usa_savepoints():
+            self.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+        else:
+            self.conn.commit()
+    
+    def _desfazer_etapa(self, savepoint: str) -> None:
+        """
+        Desfaz a etapa que falhou, preservando o que veio antes dela.
+        
+        Sem SAVEPOINTs, ou se o SAVEPOINT já não existir (um commit da
+        auditoria na mesma conexão o libera), desfaz a transação inteira.
+        """
+        if self._usa_savepoints():
+            try:
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                return
+            except psycopg2.Error:
+                logger.warning(f"SAVEPOINT {savepoint} indisponivel: transacao desfeita")
+        self.conn.rollback()
+    
+    @staticmethod
+    def _dataframe_relatorio(divergencias: Iterable[Divergencia]) -> pd.DataFrame:
+        """
+        Monta o DataFrame do relatório coluna a coluna.
+        
+        Cada coluna é alocada de uma vez a partir de uma lista, sem dicts ou
+        tuplas intermediários por linha; tipo e campo viram category.
+        """
+        divergencias = list(divergencias)
+        df = pd.DataFrame({
+            'idnfsexterno': [d.idnfsexterno for d in divergencias],
+            'tipo_divergencia': [d.tipo for d in divergencias],
+            'campo_afetado': [d.campo_afetado for d in divergencias],
+            'valor_atual': [d.valor_atual for d in divergencias],
+            'valor_esperado': [d.valor_esperado for d in divergencias],
+            'competencia': [d.competencia for d in divergencias],
+            'confianca': [d.confianca for d in divergencias],
+            'regras_violadas': [', '.join(d.regras_violadas) for d in divergencias],
+        }, columns=list(COLUNAS_RELATORIO))
+        return df.astype({'tipo_divergencia': 'category', 'campo_afetado': 'category'})
     
     def gerar_relatorio_divergencias(
         self,
-        divergencias: List[Divergencia],
+        divergencias: Iterable[Divergencia],
         formato: str = 'csv',
         caminho_saida: Optional[str] = None
     ) -> str:
         """
         Gera relatório consolidado de divergências detectadas.
         
+        Em CSV as linhas são escritas uma a uma a partir do iterável, sem
+        montar DataFrame; em Excel o DataFrame é montado por colunas.
+        Aceita lista ou gerador.
+        
         Args:
-            divergencias: Lista de divergências
+            divergencias: Divergências (lista ou iterável)
             formato: 'csv' ou 'excel'
             caminho_saida: Caminho para salvar o arquivo (opcional)
         
         Returns:
             str: Caminho do arquivo gerado
         """
-        df = pd.DataFrame([
-            {
-                'idnfsexterno': d.idnfsexterno,
-                'tipo_divergencia': d.tipo,
-                'campo_afetado': d.campo_afetado,
-                'valor_atual': d.valor_atual,
-                'valor_esperado': d.valor_esperado,
-                'competencia': d.competencia,
-                'confianca': d.confianca,
-                'regras_violadas': ', '.join(d.regras_violadas)
-            }
-            for d in divergencias
-        ])
-        
         if caminho_saida is None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             caminho_saida = f'divergencias_{timestamp}.{formato}'
         
         if formato == 'csv':
-            df.to_csv(caminho_saida, index=False, encoding='utf-8-sig')
+            linhas = (
+                (
+                    d.idnfsexterno,
+                    d.tipo,
+                    d.campo_afetado,
+                    d.valor_atual,
+                    d.valor_esperado,
+                    d.competencia,
+                    d.confianca,
+                    ', '.join(d.regras_violadas)
+                )
+                for d in divergencias
+            )
+        
+            # utf-8-sig: BOM para o Excel reconhecer a codificação
+            with open(caminho_saida, 'w', newline='', encoding='utf-8-sig') as arquivo:
+                writer = csv.writer(arquivo)
+                writer.writerow(COLUNAS_RELATORIO)
+                writer.writerows(linhas)
         elif formato == 'excel':
-            df.to_excel(caminho_saida, index=False)
+            self._dataframe_relatorio(divergencias).to_excel(caminho_saida, index=False)
         
         logger.info(f"Relatorio gerado: {caminho_saida}")
         return caminho_saida
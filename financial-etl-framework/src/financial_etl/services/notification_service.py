@@ -17,6 +17,7 @@ Versão: 1.0.0
 
 import logging
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -51,6 +52,12 @@ class NotificationService:
         ...     criticas=3,
         ...     destinatarios=['controller@empresa.com']
         ... )
+    
+    Usado como context manager, a conexão SMTP (STARTTLS + login) é aberta
+    no primeiro envio e reaproveitada pelos envios seguintes até a saída:
+        >>> with NotificationService() as notifier:
+        ...     notifier.enviar_alerta_divergencias(...)
+        ...     notifier.enviar_alerta_falha_critica(...)
     """
     
     def __init__(self):
@@ -69,12 +76,73 @@ class NotificationService:
         
         self.smtp_enabled = bool(self.smtp_user and self.smtp_password)
         
+        # Conexão compartilhada enquanto dentro do bloco with
+        self._em_sessao = False
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_lock = threading.Lock()
+        
         if not self.smtp_enabled:
             logger.warning(
                 "SMTP nao configurado. Notificacoes via email desabilitadas. "
                 "Configure SMTP_USER e SMTP_PASSWORD no arquivo .env"
             )
     
+    def __enter__(self) -> 'NotificationService':
+        """Passa a reaproveitar uma única conexão SMTP entre os envios."""
+        self._em_sessao = True
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Fecha a conexão compartilhada; envios seguintes voltam a ser avulsos."""
+        self._em_sessao = False
+        self.fechar_conexao()
+    
+    def fechar_conexao(self) -> None:
+        """Encerra a conexão SMTP compartilhada, se houver."""
+        with self._smtp_lock:
+            smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except smtplib.SMTPException:
+            smtp.close()
+    
+    def _conectar(self) -> smtplib.SMTP:
+        """Abre uma conexão SMTP autenticada."""
+        server = smtplib.SMTP(self.smtp_host, self.smtp_port)
+        try:
+            server.starttls()
+            server.login(self.smtp_user, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    def _enviar_mensagem(self, msg: MIMEMultipart) -> None:
+        """
+        Entrega a mensagem pela conexão compartilhada ou por uma conexão avulsa.
+        
+        Fora do bloco with cada envio abre e fecha sua própria conexão.
+        Dentro dele, se o servidor tiver encerrado a conexão por inatividade,
+        reconecta uma vez.
+        """
+        if not self._em_sessao:
+            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
+                server.starttls()
+                server.login(self.smtp_user, self.smtp_password)
+                server.send_message(msg)
+            return
+        
+        with self._smtp_lock:
+            if self._smtp is None:
+                self._smtp = self._conectar()
+            try:
+                self._smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = self._conectar()
+                self._smtp.send_message(msg)
+    
     def enviar_email(
         self,
         destinatarios: List[str],
@@ -131,10 +199,7 @@ class NotificationService:
                             msg.attach(part)
             
             # Envia email via SMTP
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_user, self.smtp_password)
-                server.send_message(msg)
+            self._enviar_mensagem(msg)
             
             logger.info(
                 f"Email enviado com sucesso: assunto='{assunto}', "
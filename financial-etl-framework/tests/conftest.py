@@ -35,6 +35,24 @@ def mock_db_connection():
     return conn
 
 
+@pytest.fixture
+def mock_psycopg2_connect(monkeypatch):
+    """
+    Substitui psycopg2.connect do módulo conn por um mock via monkeypatch.
+    
+    Cada teste recebe um mock novo: cópias rasas de MagicMock compartilham
+    os mocks filhos (commit, rollback...) e vazariam chamadas entre testes.
+    
+    Returns:
+        MagicMock: Mock de connect; a conexão retornada está em
+        `mock_psycopg2_connect.return_value` (aberta, closed=0)
+    """
+    connect = MagicMock()
+    connect.return_value.closed = 0
+    monkeypatch.setattr('financial_etl.conn.psycopg2.connect', connect)
+    return connect
+
+
 @pytest.fixture
 def mock_cursor():
     """
@@ -56,6 +56,14 @@ class TestHealthEndpoints:
             assert data["database"] == "healthy"
             assert data["status"] == "healthy"
     
+    def test_server_timing_header(self):
+        """Testa que as respostas trazem o cabeçalho Server-Timing."""
+        response = client.get("/")
+        
+        timing = response.headers["server-timing"]
+        assert timing.startswith("db;dur=")
+        assert "app;dur=" in timing and "total;dur=" in timing
+    
     def test_health_check_database_down(self):
         """Testa health check quando banco está indisponível."""
         with patch('financial_etl.api.main.db_connection') as mock_conn:
@@ -72,26 +80,44 @@ class TestHealthEndpoints:
 class TestMetricasEndpoints:
     """Testes para endpoints de métricas."""
     
+    @pytest.fixture(autouse=True)
+    def limpar_cache_metricas(self):
+        """Garante que cada teste consulte o banco (mockado)."""
+        from financial_etl.api.main import metricas_cache
+        metricas_cache.clear()
+        yield
+        metricas_cache.clear()
+    
     def test_metricas_resumo_sem_filtros(self):
         """Testa endpoint de métricas sem filtros de data."""
         with patch('financial_etl.api.main.db_connection') as mock_conn:
             mock_connection = MagicMock()
             mock_cursor = MagicMock()
-            mock_cursor.fetchone.return_value = (100, 80, 20, 5)
+            mock_cursor.fetchone.return_value = (
+                100, 8, 80,
+                [{"tipo": "TRADE_MARKETING_BONUS", "total": 100, "resolvidas": 80}],
+                [{"status": "SUCCESS", "total": 5}]
+            )
             mock_connection.cursor.return_value = mock_cursor
             mock_conn.return_value.__enter__.return_value = mock_connection
             
             response = client.get("/api/v1/metricas/resumo")
             
-            # Pode retornar 200 ou 404 dependendo da implementação
-            assert response.status_code in [200, 404, 422]
+            assert response.status_code == 200
+            data = response.json()
+            assert data["metricas_gerais"]["total_divergencias"] == 100
+            assert data["metricas_gerais"]["taxa_resolucao_percentual"] == 80.0
+            assert data["divergencias_por_tipo"][0]["taxa_resolucao"] == 80.0
+            assert data["operacoes_por_status"] == [{"status": "SUCCESS", "total": 5}]
+            # Todas as métricas vêm de uma única consulta
+            assert mock_cursor.execute.call_count == 1
     
     def test_metricas_resumo_com_filtros(self):
         """Testa métricas com filtros de data."""
         with patch('financial_etl.api.main.db_connection') as mock_conn:
             mock_connection = MagicMock()
             mock_cursor = MagicMock()
-            mock_cursor.fetchone.return_value = (50, 40, 10, 2)
+            mock_cursor.fetchone.return_value = (50, 4, 40, [], [])
             mock_connection.cursor.return_value = mock_cursor
             mock_conn.return_value.__enter__.return_value = mock_connection
             
@@ -103,7 +129,28 @@ class TestMetricasEndpoints:
                 }
             )
             
-            assert response.status_code in [200, 404, 422]
+            assert response.status_code == 200
+            # Filtro de datas aplicado às divergências e às operações
+            params = mock_cursor.execute.call_args[0][1]
+            assert len(params) == 4
+    
+    def test_metricas_resumo_cache(self):
+        """Testa que requisições repetidas são servidas do cache."""
+        with patch('financial_etl.api.main.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchone.return_value = (10, 2, 5, [], [])
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            primeira = client.get("/api/v1/metricas/resumo")
+            segunda = client.get("/api/v1/metricas/resumo")
+            
+            assert primeira.status_code == 200
+            assert segunda.json() == primeira.json()
+            assert "max-age" in segunda.headers["cache-control"]
+            # Segunda requisição não chega ao banco
+            assert mock_cursor.execute.call_count == 1
 
 
 class TestDivergenciasEndpoints:
@@ -131,6 +178,174 @@ class TestDivergenciasEndpoints:
         
         assert response.status_code in [200, 404]
     
+    def test_obter_divergencia_valores_float8(self):
+        """Testa que os valores chegam como float do SQL (::float8), inclusive zero."""
+        with patch('financial_etl.api.routers.divergences.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchone.return_value = (
+                7, "NF-7", "TRADE_MARKETING_BONUS", "trade_mkt_dpto",
+                0.0, 5000.0, None, "Janeiro", "DETECTED", 0.95,
+                datetime(2026, 1, 5, 10, 30), None
+            )
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            response = client.get("/api/v1/divergencias/7")
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["valor_anterior"] == 0.0
+            assert data["valor_sugerido"] == 5000.0
+            assert data["valor_aplicado"] is None
+            assert "::float8" in mock_cursor.execute.call_args[0][0]
+    
+    def test_listar_divergencias_keyset(self):
+        """Testa paginação por keyset (after_ts + after_id)."""
+        with patch('financial_etl.api.routers.divergences.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchall.return_value = []
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            response = client.get(
+                "/api/v1/divergencias",
+                params={"after_ts": "2026-01-05T10:30:00", "after_id": 42, "limit": 10}
+            )
+            
+            assert response.status_code == 200
+            query, params = mock_cursor.execute.call_args[0]
+            assert "(detectado_em, id) < ($1, $2)" in query
+            assert "ORDER BY detectado_em DESC, id DESC" in query
+            assert params[-4:] == [datetime(2026, 1, 5, 10, 30), 42, 10, 0]
+    
+    def test_listar_divergencias_etag_304(self):
+        """Testa resposta 304 quando o If-None-Match casa com a versão atual."""
+        with patch('financial_etl.api.routers.divergences.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchone.return_value = (3, datetime(2026, 1, 5), None)
+            mock_cursor.fetchall.return_value = []
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            primeira = client.get("/api/v1/divergencias", params={"limit": 10})
+            etag = primeira.headers["etag"]
+            chamadas = mock_cursor.execute.call_count
+            
+            segunda = client.get(
+                "/api/v1/divergencias",
+                params={"limit": 10},
+                headers={"If-None-Match": etag}
+            )
+            
+            assert primeira.status_code == 200
+            assert etag.startswith('W/"')
+            assert segunda.status_code == 304
+            # Só o agregado de versão roda na segunda requisição
+            assert mock_cursor.execute.call_count == chamadas + 1
+    
+    def test_websocket_divergencias_repassa_notificacoes(self):
+        """Testa que o WebSocket envia os payloads recebidos do canal."""
+        import asyncio
+        
+        class CanalFake:
+            cancelada = False
+            
+            async def assinar(self):
+                fila = asyncio.Queue()
+                fila.put_nowait('{"id": 7}')
+                fila.put_nowait(None)
+                return fila
+            
+            def cancelar(self, fila):
+                CanalFake.cancelada = True
+        
+        with patch('financial_etl.api.routers.divergences.canal_divergencias', CanalFake()):
+            with client.websocket_connect("/api/v1/divergencias/ws") as websocket:
+                assert websocket.receive_text() == '{"id": 7}'
+        
+        assert CanalFake.cancelada
+    
+    def test_aprovar_correcoes_em_lote(self):
+        """Testa que a aprovação em lote usa um UPDATE por campo afetado."""
+        with patch('financial_etl.api.routers.divergences.db_connection') as mock_conn, \
+             patch('financial_etl.services.AuditLogger') as mock_audit, \
+             patch('financial_etl.api.routers.divergences.execute_values') as mock_values:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchall.return_value = [
+                (1, "NF-1", "trade_mkt_dpto", 5000),
+                (2, "NF-2", "trade_mkt_dpto", 3000),
+                (3, "NF-3", "bonus_dpto", 1500),
+            ]
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            mock_audit.return_value.iniciar_operacao.return_value = 10
+            
+            response = client.post(
+                "/api/v1/divergencias/aprovar",
+                json={"divergencia_ids": [1, 2, 3, 4], "usuario": "teste"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["aprovados"] == 3
+            assert data["erros"] == 1
+            # SELECT + SAVEPOINT/RELEASE em volta de cada UPDATE por campo
+            assert mock_cursor.execute.call_count == 5
+            # Um UPDATE por campo distinto + uma atualização de status em lote
+            assert mock_values.call_count == 2
+            mock_audit.return_value.atualizar_status_divergencia_batch.assert_called_once_with(
+                [(1, 5000), (2, 3000), (3, 1500)],
+                novo_status='APPROVED',
+                processado_por='teste'
+            )
+            mock_audit.return_value.iniciar_operacao.assert_called_once()
+            mock_audit.return_value.finalizar_operacao.assert_called_once_with(
+                10, status='SUCCESS', registros_afetados=3, erro_mensagem=None
+            )
+    
+    def test_aprovar_correcoes_falha_isolada_por_campo(self):
+        """Testa que a falha em um campo desfaz só o seu SAVEPOINT."""
+        import psycopg2
+        
+        def update_por_campo(cursor, query, valores):
+            if 'bonus_dpto' in query:
+                raise psycopg2.Error("valor invalido")
+        
+        with patch('financial_etl.api.routers.divergences.db_connection') as mock_conn, \
+             patch('financial_etl.services.AuditLogger') as mock_audit, \
+             patch('financial_etl.api.routers.divergences.execute_values',
+                   side_effect=update_por_campo):
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchall.return_value = [
+                (1, "NF-1", "trade_mkt_dpto", 5000),
+                (3, "NF-3", "bonus_dpto", 1500),
+            ]
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            mock_audit.return_value.iniciar_operacao.return_value = 10
+            
+            response = client.post(
+                "/api/v1/divergencias/aprovar",
+                json={"divergencia_ids": [1, 3], "usuario": "teste"}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["aprovados"] == 1
+            assert data["detalhes"][1]["status"] == "erro"
+            comandos = [c[0][0] for c in mock_cursor.execute.call_args_list]
+            assert "ROLLBACK TO SAVEPOINT aprovar_campo" in comandos
+            mock_connection.rollback.assert_not_called()
+            mock_audit.return_value.atualizar_status_divergencia_batch.assert_called_once_with(
+                [(1, 5000)],
+                novo_status='APPROVED',
+                processado_por='teste'
+            )
 
 
 class TestAuditoriaEndpoints:
@@ -187,6 +402,99 @@ class TestRelatoriosEndpoints:
         response = client.get("/api/v1/relatorios/download/relatorio_123.csv")
         
         assert response.status_code in [200, 404]
+    
+    def test_metricas_performance_cache_invalidado_por_tag(self):
+        """Testa cache das métricas de performance e invalidação por tag."""
+        from financial_etl.api.cache import invalidar_tag
+        invalidar_tag('metricas')
+        with patch('financial_etl.api.routers.reports.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchall.return_value = []
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            client.get("/api/v1/relatorios/metricas/performance")
+            client.get("/api/v1/relatorios/metricas/performance")
+            execucoes_em_cache = mock_cursor.execute.call_count
+            
+            invalidar_tag('metricas')
+            client.get("/api/v1/relatorios/metricas/performance")
+            
+            assert mock_cursor.execute.call_count == 2 * execucoes_em_cache
+    
+    def test_metricas_performance_consulta_unica(self):
+        """Testa que duração e taxa de sucesso vêm da mesma consulta."""
+        from financial_etl.api.cache import invalidar_tag
+        invalidar_tag('metricas')
+        with patch('financial_etl.api.routers.reports.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchall.return_value = [
+                ("UPDATE", 10, 1.5, 0.2, 4.0, 1.2, 3.8, 8, 2)
+            ]
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            response = client.get("/api/v1/relatorios/metricas/performance")
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["performance_por_tipo"][0]["percentil_95_seg"] == 3.8
+            assert data["taxa_sucesso_por_tipo"][0]["taxa_sucesso_percentual"] == 80.0
+            assert mock_cursor.execute.call_count == 1
+    
+    def test_metricas_performance_top_consultas(self):
+        """Testa a inclusão das consultas mais lentas do pg_stat_statements."""
+        from financial_etl.api.cache import invalidar_tag
+        invalidar_tag('metricas')
+        with patch('financial_etl.api.routers.reports.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchall.side_effect = [
+                [],
+                [(123, "SELECT * FROM audit.operacoes WHERE id = $1", 40, 8000.0, 200.0, 40)]
+            ]
+            mock_connection.cursor.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            response = client.get(
+                "/api/v1/relatorios/metricas/performance",
+                params={"top_consultas": 5}
+            )
+            
+            assert response.status_code == 200
+            lentas = response.json()["consultas_mais_lentas"]
+            assert lentas[0]["tempo_medio_ms"] == 200.0
+            assert mock_cursor.execute.call_args[0][1] == (5,)
+    
+    def test_exportar_divergencias_csv(self):
+        """Testa exportação CSV em streaming a partir do cursor nomeado."""
+        with patch('financial_etl.api.routers.reports.db_connection') as mock_conn:
+            mock_connection = MagicMock()
+            mock_cursor = MagicMock()
+            mock_cursor.fetchmany.side_effect = [
+                [(
+                    "NF-1", "TRADE_MARKETING_BONUS", "trade_mkt_dpto", None, 5000, None,
+                    "Janeiro", "DETECTED", 0.95, datetime(2026, 1, 5, 10, 30), None,
+                    None, None
+                )],
+                []
+            ]
+            mock_connection.cursor.return_value.__enter__.return_value = mock_cursor
+            mock_conn.return_value.__enter__.return_value = mock_connection
+            
+            response = client.get("/api/v1/relatorios/divergencias/export")
+            
+            assert response.status_code == 200
+            assert response.content.startswith(b"\xef\xbb\xbf")
+            linhas = response.content.decode("utf-8-sig").splitlines()
+            assert linhas[0].startswith("idnfsexterno,tipo_divergencia,")
+            assert linhas[1] == (
+                "NF-1,TRADE_MARKETING_BONUS,trade_mkt_dpto,,5000,,"
+                "Janeiro,DETECTED,0.95,2026-01-05 10:30:00,,,"
+            )
+            mock_connection.cursor.assert_called_once_with(name='export_div')
 
 
 class TestCORS:
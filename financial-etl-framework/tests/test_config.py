@@ -6,6 +6,13 @@ import pytest
 import logging
 from pathlib import Path
 
+try:
+    from financial_etl import config
+    CONFIG_AVAILABLE = True
+except ImportError:
+    CONFIG_AVAILABLE = False
+    config = None
+
 
 def test_log_directory_exists():
     """Verifica se diretório de logs é criado."""
@@ -18,3 +25,15 @@ def test_logger_configuration():
     logger = logging.getLogger('test')
     assert logger is not None
     assert len(logging.root.handlers) >= 1
+
+
+@pytest.mark.skipif(not CONFIG_AVAILABLE, reason="Módulo config não disponível")
+def test_logging_via_queue_listener():
+    """Verifica que o root logger escreve via fila (QueueHandler)."""
+    import logging.handlers
+    
+    assert any(
+        isinstance(h, logging.handlers.QueueHandler)
+        for h in logging.root.handlers
+    )
+    assert config.log_listener._thread is not None
@@ -4,20 +4,37 @@ Testes para o módulo de conexão com o banco de dados.
 
 import pytest
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import MagicMock
 
 try:
-    from financial_etl.conn import get_connection, db_connection
+    from financial_etl.conn import (
+        get_connection, db_connection, get_pool, close_pool, executar_preparado,
+        variantes_consulta
+    )
     CONN_AVAILABLE = True
 except ImportError:
     CONN_AVAILABLE = False
     get_connection = None
     db_connection = None
+    get_pool = None
+    close_pool = None
+    executar_preparado = None
+    variantes_consulta = None
 
 
 pytestmark = pytest.mark.skipif(not CONN_AVAILABLE, reason="Módulo conn não disponível")
 
 
+@pytest.fixture(autouse=True)
+def reset_pool():
+    """Garante um pool novo (e mockável) em cada teste."""
+    if CONN_AVAILABLE:
+        close_pool()
+    yield
+    if CONN_AVAILABLE:
+        close_pool()
+
+
 class TestConnection:
     
     def test_get_connection_missing_credentials(self, monkeypatch):
@@ -28,46 +45,174 @@ class TestConnection:
         with pytest.raises(ValueError, match="Variáveis de ambiente obrigatórias"):
             get_connection()
     
-    @patch('financial_etl.conn.psycopg2.connect')
-    def test_get_connection_success(self, mock_connect):
+    def test_get_connection_success(self, mock_psycopg2_connect):
         """Testa conexão bem-sucedida."""
         if not CONN_AVAILABLE:
             pytest.skip("Módulo conn não disponível")
-            
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
         
         conn = get_connection()
         
         assert conn is not None
-        mock_connect.assert_called_once()
+        mock_psycopg2_connect.assert_called_once()
     
-    @patch('financial_etl.conn.psycopg2.connect')
-    def test_db_connection_commit_on_success(self, mock_connect):
-        """Verifica que commit é executado em caso de sucesso."""
+    def test_db_connection_commit_on_success(self, mock_psycopg2_connect, mock_env_vars):
+        """Verifica que commit é executado e a conexão volta ao pool."""
         if not CONN_AVAILABLE:
             pytest.skip("Módulo conn não disponível")
             
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
+        mock_conn = mock_psycopg2_connect.return_value
         
         with db_connection() as conn:
             pass
         
         mock_conn.commit.assert_called_once()
-        mock_conn.close.assert_called_once()
+        mock_conn.close.assert_not_called()
     
-    @patch('financial_etl.conn.psycopg2.connect')
-    def test_db_connection_rollback_on_error(self, mock_connect):
+    def test_db_connection_rollback_on_error(self, mock_psycopg2_connect, mock_env_vars):
         """Verifica que rollback é executado em caso de erro."""
         if not CONN_AVAILABLE:
             pytest.skip("Módulo conn não disponível")
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
+        mock_conn = mock_psycopg2_connect.return_value
         
         with pytest.raises(Exception):
             with db_connection() as conn:
                 raise Exception("Erro simulado")
         
-        mock_conn.rollback.assert_called_once()
+        # putconn() também faz rollback de conexões fora do estado idle
+        mock_conn.rollback.assert_called()
+        mock_conn.close.assert_not_called()
+    
+    def test_db_connection_reutiliza_pool(self, mock_psycopg2_connect, mock_env_vars, monkeypatch):
+        """Verifica que conexões sucessivas reaproveitam o mesmo pool."""
+        monkeypatch.setenv('DB_POOL_MINCONN', '1')
+        
+        with db_connection():
+            pass
+        with db_connection():
+            pass
+        
+        assert get_pool() is get_pool()
+        mock_psycopg2_connect.assert_called_once()
+    
+    def test_db_connection_aguarda_conexao_livre(self, mock_psycopg2_connect, mock_env_vars, monkeypatch):
+        """Com o pool esgotado, o empréstimo expira com PoolError."""
+        from psycopg2.pool import PoolError
+        monkeypatch.setenv('DB_POOL_MINCONN', '1')
+        monkeypatch.setenv('DB_POOL_MAXCONN', '1')
+        monkeypatch.setenv('DB_POOL_TIMEOUT', '0.01')
+        
+        with db_connection():
+            with pytest.raises(PoolError):
+                with db_connection():
+                    pass
+        
+        # A conexão liberada volta a ficar disponível
+        with db_connection():
+            pass
+    
+    def test_db_connection_descarta_conexao_fechada(self, mock_psycopg2_connect, mock_env_vars):
+        """Conexões fechadas durante o uso não devem voltar ao pool."""
+        mock_conn = mock_psycopg2_connect.return_value
+        mock_conn.closed = 1
+        
+        with db_connection():
+            pass
+        
         mock_conn.close.assert_called_once()
+
+
+class TestConfigConexao:
+    
+    def test_socket_unix_para_host_local(self, monkeypatch):
+        """Com DB_USE_UNIX_SOCKET=1 e host local, usa o socket sem TLS."""
+        from financial_etl.conn import _montar_config
+        monkeypatch.setenv('DB_HOST', 'localhost')
+        monkeypatch.setenv('DB_USE_UNIX_SOCKET', '1')
+        monkeypatch.delenv('DB_SOCKET_DIR', raising=False)
+        
+        cfg = _montar_config()
+        
+        assert cfg['host'] == '/var/run/postgresql'
+        assert cfg['sslmode'] == 'disable'
+    
+    def test_host_remoto_mantem_tcp(self, monkeypatch):
+        """Hosts remotos continuam via TCP mesmo com a flag ligada."""
+        from financial_etl.conn import _montar_config
+        monkeypatch.setenv('DB_HOST', 'db.empresa.com')
+        monkeypatch.setenv('DB_USE_UNIX_SOCKET', '1')
+        
+        cfg = _montar_config()
+        
+        assert cfg['host'] == 'db.empresa.com'
+        assert 'sslmode' not in cfg
+
+
+class TestExecutarPreparado:
+    
+    def test_prepare_apenas_na_primeira_execucao(self):
+        """PREPARE segue junto do primeiro EXECUTE; depois só EXECUTE."""
+        cursor = MagicMock()
+        
+        executar_preparado(cursor, 'q_teste', 'SELECT $1', (1,))
+        executar_preparado(cursor, 'q_teste', 'SELECT $1', (2,))
+        
+        primeiro = cursor.execute.call_args_list[0][0]
+        segundo = cursor.execute.call_args_list[1][0]
+        assert primeiro[0] == "PREPARE q_teste AS SELECT $1;\nEXECUTE q_teste(%s)"
+        assert segundo == ("EXECUTE q_teste(%s)", (2,))
+    
+    def test_erro_limpa_statements_da_sessao(self):
+        """Após erro, a próxima execução recria os statements do zero."""
+        cursor = MagicMock()
+        cursor.execute.side_effect = [Exception("falha"), None]
+        
+        with pytest.raises(Exception):
+            executar_preparado(cursor, 'q_erro', 'SELECT 1')
+        executar_preparado(cursor, 'q_erro', 'SELECT 1')
+        
+        comando = cursor.execute.call_args[0][0]
+        assert comando.startswith("DEALLOCATE ALL;")
+        assert "PREPARE q_erro AS SELECT 1;" in comando
+    
+    def test_variantes_consulta_numera_parametros(self):
+        """Cada combinação de filtros gera um SQL fixo com $n sequenciais."""
+        variantes = variantes_consulta(
+            'q_var',
+            "SELECT 1 WHERE {where} LIMIT $",
+            ["a = $", "(b, id) < ($, $)"]
+        )
+        
+        assert len(variantes) == 4
+        assert variantes[(False, False)] == ('q_var_0', "SELECT 1 WHERE TRUE LIMIT $1")
+        assert variantes[(True, True)][1] == (
+            "SELECT 1 WHERE a = $1 AND (b, id) < ($2, $3) LIMIT $4"
+        )
+
+
+class TestCursorCronometrado:
+    
+    def test_acumula_tempo_no_contexto(self):
+        """O tempo de cada execute é somado ao acumulador do contexto."""
+        from financial_etl.conn import CursorCronometrado, tempo_sql
+        acumulador = [0]
+        token = tempo_sql.set(acumulador)
+        try:
+            CursorCronometrado._registrar_tempo("SELECT 1", 2_000_000)
+            CursorCronometrado._registrar_tempo("SELECT 2", 3_000_000)
+        finally:
+            tempo_sql.reset(token)
+        
+        assert acumulador == [5_000_000]
+    
+    def test_consulta_lenta_registrada_sem_parametros(self, caplog):
+        """Consultas acima de DB_SLOW_QUERY_MS vão para o log só com o texto SQL."""
+        from financial_etl.conn import CursorCronometrado
+        with caplog.at_level('WARNING', logger='financial_etl.conn'):
+            CursorCronometrado._registrar_tempo(
+                b"SELECT *\n    FROM audit.operacoes WHERE usuario = $1", 250_000_000
+            )
+            CursorCronometrado._registrar_tempo("SELECT 1", 1_000_000)
+        
+        assert len(caplog.records) == 1
+        assert "250 ms" in caplog.text
+        assert "SELECT * FROM audit.operacoes WHERE usuario = $1" in caplog.text
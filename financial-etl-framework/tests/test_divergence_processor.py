@@ -8,6 +8,8 @@ Suite completa de testes incluindo:
 - Integração com sistema de auditoria
 """
 
+import sys
+
 import pytest
 from unittest.mock import MagicMock, patch, call, Mock
 from datetime import datetime, date
@@ -48,6 +50,23 @@ class TestDivergenciaDataclass:
         assert div.id_nota == 'NF-001'
         assert div.valor_esperado is None
         assert div.chassi is None
+    
+    @pytest.mark.skipif(sys.version_info < (3, 10), reason="slots=True requer Python 3.10+")
+    def test_divergencia_sem_dict(self):
+        """Testa que as instâncias usam __slots__ em vez de __dict__."""
+        div = Divergencia(
+            idnfsexterno='NF-001',
+            tipo='VALIDACAO_VALOR',
+            campo_afetado='valores_bonus',
+            valor_atual=None,
+            valor_esperado=None,
+            competencia='2026-01'
+        )
+        
+        assert not hasattr(div, '__dict__')
+        assert div.regras_violadas == [] and div.dados_adicionais == {}
+        with pytest.raises(AttributeError):
+            div.atributo_novo = 1
 
 
 class TestDivergenceProcessorInit:
@@ -120,6 +139,121 @@ class TestDetectarDivergencias:
                     )
         
         assert isinstance(divergencias, list)
+    
+    def test_detectar_paralelo_uma_conexao_por_regra(self, mock_db_connection):
+        """Testa que no modo paralelo cada regra usa sua conexão e a ordem é mantida."""
+        def divergencia(idnfsexterno):
+            return Divergencia(
+                idnfsexterno=idnfsexterno,
+                tipo='TESTE',
+                campo_afetado='bonus_utilizado',
+                valor_atual=None,
+                valor_esperado=None,
+                competencia='2026-01',
+                confianca=0.9
+            )
+        
+        conexoes = [MagicMock(), MagicMock(), MagicMock()]
+        mock_pool_conn = MagicMock()
+        mock_pool_conn.return_value.__enter__.side_effect = conexoes
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        
+        with patch('financial_etl.services.divergence_processor.db_connection', mock_pool_conn), \
+             patch.object(DivergenceProcessor, '_detectar_divergencias_trade_marketing', return_value=[divergencia('NF-1')]), \
+             patch.object(DivergenceProcessor, '_detectar_pendentes_verificacao', return_value=[divergencia('NF-2')]), \
+             patch.object(DivergenceProcessor, '_detectar_divergencias_valores', return_value=[divergencia('NF-3')]):
+            divergencias = processor.detectar_divergencias(
+                data_inicio='2026-01-01',
+                data_fim='2026-01-31',
+                paralelo=True
+            )
+        
+        assert [d.idnfsexterno for d in divergencias] == ['NF-1', 'NF-2', 'NF-3']
+        assert mock_pool_conn.call_count == 3
+        mock_db_connection.cursor.return_value.execute.assert_not_called()
+    
+    def test_detectar_remove_duplicadas_por_nota_e_campo(self, mock_db_connection):
+        """Testa filtro de confiança e deduplicação por (nota, campo)."""
+        def divergencia(idnfsexterno, campo, confianca):
+            return Divergencia(
+                idnfsexterno=idnfsexterno,
+                tipo='TESTE',
+                campo_afetado=campo,
+                valor_atual=None,
+                valor_esperado=None,
+                competencia='2026-01',
+                confianca=confianca
+            )
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        
+        with patch.object(processor, '_varrer_bonus_view'), \
+             patch.object(processor, '_detectar_divergencias_trade_marketing', return_value=[
+                 divergencia('NF-1', 'bonus_dpto', 0.9),
+                 divergencia('NF-2', 'bonus_dpto', 0.5),
+             ]), \
+             patch.object(processor, '_detectar_pendentes_verificacao', return_value=[
+                 divergencia('NF-3', 'bonus_utilizado', 0.8),
+             ]), \
+             patch.object(processor, '_detectar_divergencias_valores', return_value=[
+                 divergencia('NF-1', 'bonus_dpto', 0.95),
+                 divergencia('NF-1', 'trade_mkt_dpto', 0.8),
+             ]):
+            divergencias = processor.detectar_divergencias(limite_confianca=0.8)
+        
+        assert [(d.idnfsexterno, d.campo_afetado, d.confianca) for d in divergencias] == [
+            ('NF-1', 'bonus_dpto', 0.95),
+            ('NF-3', 'bonus_utilizado', 0.8),
+            ('NF-1', 'trade_mkt_dpto', 0.8),
+        ]
+    
+    def test_varredura_unica_atende_as_tres_regras(self, mock_db_connection, mock_cursor):
+        """Testa que a detecção sequencial faz uma consulta e filtra por regra."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.__enter__.return_value = mock_cursor
+        mock_cursor.__iter__.side_effect = lambda: iter([
+            # idnf, modelo, comp, bonus_utilizado, valor_bonus, trade, bonus_dpto,
+            # trade_mkt_dpto, dta, dias, diverge_bonus, diverge_trade, regras
+            ('NF-1', 'BYD Seal', '2026-01', 'SIM', 100.0, 50.0, 90.0, 50.0,
+             date(2026, 1, 5), 10, True, False, True, False, False),
+            ('NF-2', None, '2026-01', 'PENDENTE VERIFICACAO', 0.0, 0.0, 0.0, 0.0,
+             date(2026, 1, 4), 11, False, False, False, True, False),
+            ('NF-3', None, '2026-01', 'SIM', -1.0, 0.0, 0.0, 0.0,
+             date(2026, 1, 3), 12, True, False, False, False, True),
+        ])
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        divergencias = processor.detectar_divergencias(
+            '2026-01-01', '2026-01-31', limite_confianca=0.0
+        )
+        
+        assert [(d.idnfsexterno, d.tipo) for d in divergencias] == [
+            ('NF-1', 'TRADE_MARKETING_BONUS'),
+            ('NF-2', 'PENDENTE_VERIFICACAO'),
+            ('NF-3', 'VALIDACAO_VALOR'),
+        ]
+        assert divergencias[1].dados_adicionais == {
+            'dias_pendente': 11, 'dta_processamento': '2026-01-04'
+        }
+        assert divergencias[2].regras_violadas == ['BONUS_VALOR_NEGATIVO']
+        assert mock_cursor.execute.call_count == 1
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'WHERE regra_trade OR regra_pendente OR regra_valores' in query
+        # O período também filtra o SELECT interno, junto com o dos pendentes
+        assert ("WHERE dta_processamento BETWEEN %s AND %s "
+                "OR dta_processamento BETWEEN '2025-08-01' AND '2026-12-31'") in query
+        assert params == ['2026-01-01', '2026-01-31'] * 2
+        
+        # Mesmo período: a varredura vem do cache
+        processor.detectar_divergencias('2026-01-01', '2026-01-31', limite_confianca=0.0)
+        assert mock_cursor.execute.call_count == 1
+        
+        # Correções aplicadas invalidam o cache
+        with patch.object(processor, '_aplicar_correcoes_automaticas', return_value=True):
+            processor.aplicar_correcoes(divergencias[:1], modo='auto')
+        processor.detectar_divergencias('2026-01-01', '2026-01-31', limite_confianca=0.0)
+        assert mock_cursor.execute.call_count == 2
 
 
 class TestDetectarTradeMercado:
@@ -140,6 +274,31 @@ class TestDetectarTradeMercado:
             
             if divergencias:
                 assert divergencias[0].confianca >= 0.90
+    
+    def test_trade_marketing_flags_do_banco(self, mock_db_connection, mock_cursor):
+        """Testa que uma linha vira uma divergência por flag vinda do SQL."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.__enter__.return_value = mock_cursor
+        mock_cursor.__iter__.return_value = iter([
+            ('NF-1', 'BYD Seal', '2026-01', 'SIM', 100.0, 50.0, 90.0, 50.0,
+             date(2026, 1, 5), True, False),
+            ('NF-2', 'BYD Dolphin', '2026-01', 'SIM', 0.0, 30.0, 0.0, 0.0,
+             date(2026, 1, 6), True, True),
+        ])
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        divergencias = processor._detectar_divergencias_trade_marketing('2026-01-01', '2026-01-31')
+        
+        assert [(d.idnfsexterno, d.campo_afetado) for d in divergencias] == [
+            ('NF-1', 'bonus_dpto'), ('NF-2', 'bonus_dpto'), ('NF-2', 'trade_mkt_dpto')
+        ]
+        assert (divergencias[0].valor_atual, divergencias[0].valor_esperado) == (90.0, 100.0)
+        assert (divergencias[2].valor_atual, divergencias[2].valor_esperado) == (0.0, 30.0)
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'WHERE diverge_bonus OR diverge_trade' in query
+        assert params == ['2026-01-01', '2026-01-31']
+        mock_db_connection.cursor.assert_called_with(name='div_trade')
+        assert mock_cursor.itersize == 5000
 
 
 class TestDetectarPendentesVerificacao:
@@ -156,6 +315,25 @@ class TestDetectarPendentesVerificacao:
         divergencias = processor._detectar_pendentes_verificacao()
         
         assert isinstance(divergencias, list)
+    
+    def test_pendentes_apenas_contagem(self, mock_db_connection, mock_cursor):
+        """Testa que listar=False só conta as pendentes no banco."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.fetchone.return_value = (25,)
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        
+        with patch('financial_etl.services.divergence_processor.logger') as mock_logger:
+            divergencias = processor._detectar_pendentes_verificacao(None, None, listar=False)
+        
+        assert divergencias == []
+        query = mock_cursor.execute.call_args[0][0]
+        assert query.startswith('PREPARE div_contar_pendentes AS SELECT COUNT(*)')
+        assert query.endswith('EXECUTE div_contar_pendentes')
+        assert "bonus_utilizado = 'PENDENTE VERIFICACAO'" in query
+        # Nenhum cursor nomeado: as linhas não são trazidas
+        assert all(c == call() for c in mock_db_connection.cursor.call_args_list)
+        assert 'CRITICO' in mock_logger.info.call_args[0][0]
 
 
 class TestDetectarDivergenciasValores:
@@ -173,6 +351,36 @@ class TestDetectarDivergenciasValores:
         divergencias = processor._detectar_divergencias_valores()
         
         assert isinstance(divergencias, list)
+    
+    def test_regras_por_mascara(self, mock_db_connection, mock_cursor):
+        """Testa que cada linha recebe as regras das máscaras que violou."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.__enter__.return_value = mock_cursor
+        mock_cursor.__iter__.return_value = iter([
+            ('NF-1', '2026-01', -5.0, 200000.0),
+            ('NF-2', '2026-01', 10.0, 20.0),
+            ('NF-3', '2026-01', 150000.0, -1.0),
+        ])
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        divergencias = processor._detectar_divergencias_valores('2026-01-01', '2026-01-31')
+        
+        assert [(d.idnfsexterno, d.regras_violadas) for d in divergencias] == [
+            ('NF-1', ['TRADE_VALOR_NEGATIVO', 'BONUS_VALOR_OUTLIER']),
+            ('NF-3', ['BONUS_VALOR_NEGATIVO', 'TRADE_VALOR_OUTLIER']),
+        ]
+        assert divergencias[0].dados_adicionais == {'trade': -5.0, 'valor_bonus': 200000.0}
+        assert type(divergencias[0].dados_adicionais['trade']) is float
+    
+    def test_sem_linhas(self, mock_db_connection, mock_cursor):
+        """Testa consulta vazia."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.__enter__.return_value = mock_cursor
+        mock_cursor.__iter__.return_value = iter([])
+        
+        processor = DivergenceProcessor(mock_db_connection)
+        
+        assert processor._detectar_divergencias_valores(None, None) == []
 
 
 class TestAplicarCorrecoes:
@@ -236,6 +444,117 @@ class TestAplicarCorrecoes:
             pass
 
 
+class TestAplicarCorrecoesEmLote:
+    """Testes para a aplicação de correções com round-trips em lote."""
+    
+    @staticmethod
+    def _divergencia(idnf, campo='trade_mkt_dpto', tipo='TRADE_MARKETING_TRADE', confianca=0.95):
+        return Divergencia(
+            idnfsexterno=idnf,
+            tipo=tipo,
+            campo_afetado=campo,
+            valor_atual=0.0,
+            valor_esperado=1000.0,
+            competencia='2026-01',
+            confianca=confianca
+        )
+    
+    def test_um_update_por_campo(self, mock_db_connection, mock_cursor):
+        """Testa que as correções automáticas saem em um UPDATE por campo."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.rowcount = 2
+        
+        with patch('financial_etl.services.divergence_processor.AuditLogger') as MockAudit, \
+             patch('financial_etl.services.divergence_processor.execute_values') as mock_values:
+            MockAudit.return_value.iniciar_operacao.return_value = 100
+            MockAudit.return_value.registrar_divergencias_batch.side_effect = (
+                lambda op_id, divs, **kwargs: list(range(len(divs)))
+            )
+            processor = DivergenceProcessor(mock_db_connection)
+            
+            resultado = processor.aplicar_correcoes(
+                [
+                    self._divergencia('NF-1'),
+                    self._divergencia('NF-2'),
+                    self._divergencia('NF-3', campo='bonus_dpto', tipo='TRADE_MARKETING_BONUS'),
+                    self._divergencia('NF-4', confianca=0.5),
+                ],
+                modo='auto',
+                usuario='teste'
+            )
+        
+        assert resultado['corrigidas_automaticamente'] == 3
+        assert resultado['pendentes_aprovacao'] == 1
+        assert resultado['erros'] == 0
+        assert mock_values.call_count == 2
+        # Dois grupos automáticos + um registro em lote das pendentes
+        assert MockAudit.return_value.registrar_divergencias_batch.call_count == 3
+        assert MockAudit.return_value.atualizar_status_divergencia_batch.call_count == 2
+        # Um único commit para os dois grupos e as pendentes
+        mock_db_connection.commit.assert_called_once()
+        assert mock_cursor.execute.call_args_list.count(call("SAVEPOINT correcao_campo")) == 2
+    
+    def test_falha_no_grupo_conta_como_erro(self, mock_db_connection, mock_cursor):
+        """Testa que a falha de um UPDATE marca todo o grupo como erro."""
+        mock_db_connection.cursor.return_value = mock_cursor
+        
+        with patch('financial_etl.services.divergence_processor.AuditLogger') as MockAudit, \
+             patch('financial_etl.services.divergence_processor.execute_values',
+                   side_effect=Exception('falha')):
+            MockAudit.return_value.iniciar_operacao.return_value = 100
+            processor = DivergenceProcessor(mock_db_connection)
+            
+            resultado = processor.aplicar_correcoes(
+                [self._divergencia('NF-1'), self._divergencia('NF-2')],
+                modo='auto'
+            )
+        
+        assert resultado['erros'] == 2
+        mock_cursor.execute.assert_any_call("ROLLBACK TO SAVEPOINT correcao_campo")
+        mock_db_connection.rollback.assert_not_called()
+        mock_db_connection.commit.assert_called_once()
+        MockAudit.return_value.finalizar_operacao.assert_called_once_with(
+            operacao_id=100, status='FAILED', erro_mensagem='falha'
+        )
+
+    def test_audit_imediato_na_mesma_conexao(self, mock_db_connection, mock_cursor):
+        """Testa o AuditLogger padrão: sem SAVEPOINTs, um commit por etapa."""
+        import psycopg2
+        from financial_etl.services.audit_logger import AuditLogger
+        
+        mock_db_connection.cursor.return_value = mock_cursor
+        mock_cursor.rowcount = 1
+        
+        def executar(sql, *args, **kwargs):
+            # Os commits da auditoria teriam liberado qualquer SAVEPOINT
+            if 'SAVEPOINT' in sql:
+                raise psycopg2.Error('savepoint "correcao_campo" does not exist')
+        mock_cursor.execute.side_effect = executar
+        
+        audit = AuditLogger(mock_db_connection)
+        assert audit.commit_mode == 'immediate'
+        
+        with patch.object(audit, 'iniciar_operacao', return_value=100), \
+             patch.object(audit, 'gravar_dados_por_consulta'), \
+             patch.object(audit, 'registrar_divergencias_batch',
+                          side_effect=lambda op_id, divs, **kwargs: list(range(len(divs)))), \
+             patch.object(audit, 'atualizar_status_divergencia_batch'), \
+             patch.object(audit, 'finalizar_operacao') as mock_finalizar, \
+             patch('financial_etl.services.divergence_processor.execute_values'):
+            processor = DivergenceProcessor(mock_db_connection, audit=audit)
+            
+            resultado = processor.aplicar_correcoes(
+                [self._divergencia('NF-1'), self._divergencia('NF-2', confianca=0.5)],
+                modo='auto'
+            )
+        
+        assert resultado['corrigidas_automaticamente'] == 1
+        assert resultado['pendentes_aprovacao'] == 1
+        assert resultado['erros'] == 0
+        mock_db_connection.rollback.assert_not_called()
+        assert [c.kwargs['status'] for c in mock_finalizar.call_args_list] == ['SUCCESS', 'SUCCESS']
+
+
 class TestGerarRelatorio:
     """Testes para geração de relatórios."""
     
@@ -294,6 +613,79 @@ class TestGerarRelatorio:
             
             assert mock_gen.called or resultado is not None
 
+    def test_gerar_relatorio_csv_a_partir_de_gerador(self, mock_db_connection, tmp_path):
+        """Testa que o CSV é escrito linha a linha a partir de um gerador."""
+        processor = DivergenceProcessor(mock_db_connection)
+        
+        divergencias = (
+            Divergencia(
+                idnfsexterno=f'NF-{i}',
+                tipo='VALOR_INVALIDO',
+                campo_afetado='bonus_sobre_vendas',
+                valor_atual=None,
+                valor_esperado=100.0 * i,
+                competencia='2025-12',
+                confianca=0.95,
+                regras_violadas=['REGRA_A', 'REGRA_B']
+            )
+            for i in range(3)
+        )
+        
+        output_path = tmp_path / "relatorio_gerador.csv"
+        resultado = processor.gerar_relatorio_divergencias(
+            divergencias,
+            formato='csv',
+            caminho_saida=str(output_path)
+        )
+        
+        assert resultado == str(output_path)
+        linhas = output_path.read_text(encoding='utf-8-sig').splitlines()
+        assert linhas[0] == (
+            'idnfsexterno,tipo_divergencia,campo_afetado,valor_atual,'
+            'valor_esperado,competencia,confianca,regras_violadas'
+        )
+        assert linhas[1:] == [
+            f'NF-{i},VALOR_INVALIDO,bonus_sobre_vendas,,{100.0 * i},2025-12,0.95,"REGRA_A, REGRA_B"'
+            for i in range(3)
+        ]
+
+    def test_gerar_relatorio_excel_por_colunas(self, mock_db_connection, tmp_path):
+        """Testa o DataFrame entregue ao to_excel, montado por colunas."""
+        processor = DivergenceProcessor(mock_db_connection)
+        
+        divergencias = (
+            Divergencia(
+                idnfsexterno=f'NF-{i}',
+                tipo='VALOR_INVALIDO',
+                campo_afetado='bonus_sobre_vendas',
+                valor_atual=None,
+                valor_esperado=100.0 * i,
+                competencia='2025-12',
+                confianca=0.95,
+                regras_violadas=['REGRA_A', 'REGRA_B']
+            )
+            for i in range(2)
+        )
+        
+        capturados = []
+        with patch('pandas.DataFrame.to_excel', autospec=True,
+                   side_effect=lambda df, *args, **kwargs: capturados.append(df)):
+            processor.gerar_relatorio_divergencias(
+                divergencias,
+                formato='excel',
+                caminho_saida=str(tmp_path / "relatorio.xlsx")
+            )
+        
+        df = capturados[0]
+        assert list(df.columns) == [
+            'idnfsexterno', 'tipo_divergencia', 'campo_afetado', 'valor_atual',
+            'valor_esperado', 'competencia', 'confianca', 'regras_violadas'
+        ]
+        assert df['idnfsexterno'].tolist() == ['NF-0', 'NF-1']
+        assert df['regras_violadas'].tolist() == ['REGRA_A, REGRA_B'] * 2
+        assert df['tipo_divergencia'].dtype == 'category'
+        assert df['campo_afetado'].dtype == 'category'
+
 
 class TestIntegracaoComAuditoria:
     """Testes de integração com sistema de auditoria."""
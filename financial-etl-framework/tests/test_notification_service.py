@@ -451,6 +451,36 @@ class TestConfiguracaoSMTP:
         
         assert service.smtp_port == 465
 
+    @patch('smtplib.SMTP')
+    def test_context_manager_reaproveita_conexao(self, mock_smtp_class, mock_env_vars):
+        """Testa que envios dentro do with usam uma única conexão autenticada."""
+        mock_smtp = mock_smtp_class.return_value
+        
+        with NotificationService() as service:
+            assert service.enviar_email(['a@test.com'], 'Primeiro', '<p>1</p>')
+            assert service.enviar_email(['a@test.com'], 'Segundo', '<p>2</p>')
+        
+        mock_smtp_class.assert_called_once_with('smtp.test.com', 587)
+        mock_smtp.starttls.assert_called_once()
+        mock_smtp.login.assert_called_once()
+        assert mock_smtp.send_message.call_count == 2
+        mock_smtp.quit.assert_called_once()
+    
+    @patch('smtplib.SMTP')
+    def test_context_manager_reconecta_apos_desconexao(self, mock_smtp_class, mock_env_vars):
+        """Testa reconexão quando o servidor encerra a conexão compartilhada."""
+        conexao_expirada = MagicMock()
+        conexao_expirada.send_message.side_effect = smtplib.SMTPServerDisconnected()
+        conexao_nova = MagicMock()
+        mock_smtp_class.side_effect = [conexao_expirada, conexao_nova]
+        
+        with NotificationService() as service:
+            assert service.enviar_email(['a@test.com'], 'Assunto', '<p>corpo</p>')
+        
+        assert mock_smtp_class.call_count == 2
+        conexao_nova.send_message.assert_called_once()
+        conexao_nova.quit.assert_called_once()
+
 
 class TestIntegracao:
     """Testes de integração do fluxo completo."""